@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Attempt Statistics
+Counters maintained as events arrive so stats never rescan attempt history
+"""
+
+from collections import Counter, OrderedDict
+
+
+def discount(counts, key):
+    """Take one off a counter entry, dropping it at zero"""
+    if key not in counts:
+        return
+    if counts[key] > 1:
+        counts[key] -= 1
+    else:
+        del counts[key]
+
+
+class AttemptStats:
+    def __init__(self, retention_minutes=1440):
+        self.retention_minutes = retention_minutes
+        self.reset()
+
+    def reset(self):
+        """Zero every counter"""
+        self.total_attempts = 0
+        self.unique_ips = 0
+        self.by_status = Counter()
+        self.by_username = Counter()
+        # "YYYY-MM-DDTHH:MM" -> attempts in that minute, kept in minute order
+        self.per_minute = OrderedDict()
+
+    def record(self, timestamp, username, status, new_ip=False):
+        """Count one attempt (timestamp is an ISO string)"""
+        self.total_attempts += 1
+        if new_ip:
+            self.unique_ips += 1
+        self.by_status[status] += 1
+        self.by_username[username] += 1
+
+        self.count_minute(timestamp[:16])
+
+    def record_many(self, rows):
+        """Count (ip, timestamp, username, status, attempt_number) rows in bulk"""
+        self.total_attempts += len(rows)
+        self.unique_ips += sum(1 for row in rows if row[4] == 1)
+        self.by_status.update(row[3] for row in rows)
+        self.by_username.update(row[2] for row in rows)
+
+        for minute, count in Counter(row[1][:16] for row in rows).items():
+            self.count_minute(minute, count)
+
+    def count_minute(self, minute, count=1):
+        """Add to a per-minute bucket, keeping buckets sorted by minute
+
+        Events usually arrive in time order and append at the end; a late
+        one (e.g. from a second log file) re-sorts the buckets, so the
+        oldest minute is always the one dropped past retention.
+        """
+        per_minute = self.per_minute
+        if minute in per_minute:
+            per_minute[minute] += count
+            return
+        late = per_minute and minute < next(reversed(per_minute))
+        per_minute[minute] = count
+        if late:
+            self.per_minute = per_minute = OrderedDict(sorted(per_minute.items()))
+        while len(per_minute) > self.retention_minutes:
+            per_minute.popitem(last=False)
+
+    def merge(self, other):
+        """Fold counters gathered elsewhere (e.g. a log backfill) into these"""
+        self.total_attempts += other.total_attempts
+        self.unique_ips += other.unique_ips
+        self.by_status.update(other.by_status)
+        self.by_username.update(other.by_username)
+
+        per_minute = Counter(self.per_minute)
+        per_minute.update(other.per_minute)
+        self.per_minute = OrderedDict(sorted(per_minute.items())[-self.retention_minutes:])
+
+    def forget_ip(self, attempt_count, history=()):
+        """Drop a cleared IP from the totals and breakdowns
+
+        history is the IP's retained attempt records. Attempts already
+        trimmed beyond max_history_per_ip cannot be attributed any more and
+        stay in the status/username/minute breakdowns.
+        """
+        self.total_attempts = max(0, self.total_attempts - attempt_count)
+        self.unique_ips = max(0, self.unique_ips - 1)
+        for attempt in history:
+            discount(self.by_status, attempt.get("status"))
+            discount(self.by_username, attempt.get("username"))
+            discount(self.per_minute, attempt.get("timestamp", "")[:16])
+
+    def recent_minutes(self, count=10):
+        """Per-minute buckets of the latest count minutes"""
+        minutes = list(self.per_minute.items())[-count:]
+        return dict(minutes)
+
+    def to_dict(self):
+        return {
+            "total_attempts": self.total_attempts,
+            "unique_ips": self.unique_ips,
+            "by_status": dict(self.by_status),
+            "by_username": dict(self.by_username),
+            "per_minute": dict(self.per_minute)
+        }
+
+    @classmethod
+    def from_dict(cls, data, retention_minutes=1440):
+        stats = cls(retention_minutes)
+        stats.total_attempts = data.get("total_attempts", 0)
+        stats.unique_ips = data.get("unique_ips", 0)
+        stats.by_status = Counter(data.get("by_status", {}))
+        stats.by_username = Counter(data.get("by_username", {}))
+        stats.per_minute = OrderedDict(sorted(data.get("per_minute", {}).items()))
+        return stats
+
+    @classmethod
+    def from_attempts(cls, login_attempts, retention_minutes=1440):
+        """Rebuild counters from stored history (one-off, e.g. after upgrade)"""
+        stats = cls(retention_minutes)
+        records = []
+        for attempts in login_attempts.values():
+            if not attempts:
+                continue
+            stats.unique_ips += 1
+            stats.total_attempts += attempts[-1].get("attempt_number", len(attempts))
+            records.extend(attempts)
+
+        records.sort(key=lambda a: a["timestamp"])
+        for attempt in records:
+            stats.by_status[attempt.get("status")] += 1
+            stats.by_username[attempt.get("username")] += 1
+            minute = attempt["timestamp"][:16]
+            stats.per_minute[minute] = stats.per_minute.get(minute, 0) + 1
+        while len(stats.per_minute) > retention_minutes:
+            stats.per_minute.popitem(last=False)
+        return stats
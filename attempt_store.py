@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Compact Attempt Store
+Columnar login attempt history: one typed array per field, interned
+username/status tables and per-IP row chains, saved as a binary snapshot
+that loads without parsing JSON. Reads still see the familiar
+ip -> [attempt dict, ...] mapping, built on demand
+"""
+
+import json
+import os
+import struct
+import sys
+from array import array
+from collections.abc import MutableMapping
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+MAGIC = b"IPATT02\0"
+# Snapshots from before the offsets column; their times are all naive
+MAGIC_V1 = b"IPATT01\0"
+# magic, row count, ip count, length of the JSON table blob
+HEADER = struct.Struct("<8sQQQ")
+
+# Per-row columns and their typecodes; snapshots also carry the row chain
+COLUMNS = (("times", "q"), ("offsets", "i"), ("users", "I"), ("statuses", "H"),
+           ("numbers", "I"))
+SNAPSHOT_COLUMNS = COLUMNS + (("next", "I"),)
+SNAPSHOT_COLUMNS_V1 = tuple(column for column in SNAPSHOT_COLUMNS if column[0] != "offsets")
+
+# End of an IP's row chain
+NO_ROW = 0xFFFFFFFF
+
+EPOCH = datetime(1970, 1, 1)
+EPOCH_UTC = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+SECOND = timedelta(seconds=1)
+
+# offsets value of a naive timestamp (real UTC offsets are under a day)
+NAIVE = 0x7FFFFFFF
+
+# Dead rows (trimmed or cleared) tolerated before the columns are rewritten
+COMPACT_MIN_DEAD = 4096
+
+
+def timestamp_micros(timestamp):
+    """(microseconds since 1970-01-01, UTC offset in seconds) for an ISO timestamp
+
+    Naive wall-clock times are kept as-is (no local timezone maths) with
+    offset NAIVE; aware times are stored as UTC plus their own offset. Both
+    render back to the identical string.
+    """
+    when = datetime.fromisoformat(timestamp)
+    if when.tzinfo is None:
+        return (when - EPOCH) // MICROSECOND, NAIVE
+    return (when - EPOCH_UTC) // MICROSECOND, when.utcoffset() // SECOND
+
+
+def micros_timestamp(micros, offset=NAIVE):
+    if offset == NAIVE:
+        return (EPOCH + timedelta(microseconds=micros)).isoformat()
+    zone = timezone(timedelta(seconds=offset))
+    return (EPOCH_UTC + timedelta(microseconds=micros)).astimezone(zone).isoformat()
+
+
+class StringTable:
+    """Interned strings addressed by small integer codes"""
+
+    def __init__(self, values=()):
+        self.values = list(values)
+        self.codes = {value: code for code, value in enumerate(self.values)}
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class CompactAttempts(MutableMapping):
+    """ip -> attempt history, stored as columns rather than per-attempt dicts
+
+    Each IP's rows are chained through the next column; compaction lays them
+    out contiguously, so a freshly loaded IP is the offset range
+    [first, first + count). Offers the same append/append_many/
+    last_attempt_number calls as the SQLite AttemptsView, so
+    SecurityMonitor treats both alike.
+    """
+
+    def __init__(self):
+        self.times = array('q')
+        self.offsets = array('i')
+        self.users = array('I')
+        self.statuses = array('H')
+        self.numbers = array('I')
+        self.next = array('I')
+        self.usernames = StringTable()
+        self.status_names = StringTable()
+        # ip -> [first row, last row, row count]
+        self.index = {}
+        self.live_rows = 0
+
+    def __getitem__(self, ip_address):
+        return [self.row_dict(row) for row in self.rows(ip_address)]
+
+    def __setitem__(self, ip_address, attempts):
+        if ip_address in self.index:
+            del self[ip_address]
+        for number, attempt in enumerate(attempts, 1):
+            self.add_row(ip_address, attempt["timestamp"], attempt.get("username"),
+                         attempt.get("status"), attempt.get("attempt_number", number))
+
+    def __delitem__(self, ip_address):
+        self.live_rows -= self.index.pop(ip_address)[2]
+        self.maybe_compact()
+
+    def __contains__(self, ip_address):
+        return ip_address in self.index
+
+    def __iter__(self):
+        return iter(list(self.index))
+
+    def __len__(self):
+        return len(self.index)
+
+    def clear(self):
+        self.__init__()
+
+    def rows(self, ip_address):
+        """Row numbers of an IP's attempts, oldest first"""
+        row, _, count = self.index[ip_address]
+        following = self.next
+        for _ in range(count):
+            yield row
+            row = following[row]
+
+    def row_dict(self, row):
+        return {
+            "timestamp": micros_timestamp(self.times[row], self.offsets[row]),
+            "username": self.usernames.values[self.users[row]],
+            "status": self.status_names.values[self.statuses[row]],
+            "attempt_number": self.numbers[row]
+        }
+
+    def add_row(self, ip_address, timestamp, username, status, attempt_number):
+        row = len(self.times)
+        micros, offset = timestamp_micros(timestamp)
+        self.times.append(micros)
+        self.offsets.append(offset)
+        self.users.append(self.usernames.code(username))
+        self.statuses.append(self.status_names.code(status))
+        self.numbers.append(attempt_number)
+        self.next.append(NO_ROW)
+        self.live_rows += 1
+
+        entry = self.index.get(ip_address)
+        if entry is None:
+            self.index[ip_address] = [row, row, 1]
+        else:
+            self.next[entry[1]] = row
+            entry[1] = row
+            entry[2] += 1
+
+    def append(self, ip_address, record, max_history=None, commit=True):
+        """Add one attempt, trimming the IP's history to max_history rows"""
+        self.add_row(ip_address, record["timestamp"], record["username"],
+                     record["status"], record["attempt_number"])
+        if max_history:
+            self.trim(ip_address, max_history)
+
+    def append_many(self, rows, max_history=None):
+        """Add (ip, timestamp, username, status, attempt_number) rows
+
+        Works column by column: each distinct timestamp and string is
+        converted once and the arrays are extended in bulk, leaving only
+        the row chain to a per-row loop.
+        """
+        rows = list(rows)
+        if not rows:
+            return
+        ips, timestamps, usernames, statuses, numbers = zip(*rows)
+        start = len(self.times)
+
+        micros, offsets = {}, {}
+        for timestamp in set(timestamps):
+            micros[timestamp], offsets[timestamp] = timestamp_micros(timestamp)
+        for username in set(usernames):
+            self.usernames.code(username)
+        for status in set(statuses):
+            self.status_names.code(status)
+        self.times.extend(map(micros.__getitem__, timestamps))
+        self.offsets.extend(map(offsets.__getitem__, timestamps))
+        self.users.extend(map(self.usernames.codes.__getitem__, usernames))
+        self.statuses.extend(map(self.status_names.codes.__getitem__, statuses))
+        self.numbers.extend(numbers)
+
+        following = self.next
+        following.extend([NO_ROW] * len(rows))
+        index = self.index
+        for row, ip_address in enumerate(ips, start):
+            entry = index.get(ip_address)
+            if entry is None:
+                index[ip_address] = [row, row, 1]
+            else:
+                following[entry[1]] = row
+                entry[1] = row
+                entry[2] += 1
+        self.live_rows += len(rows)
+
+        if max_history:
+            for ip_address in set(ips):
+                self.trim(ip_address, max_history)
+
+    def trim(self, ip_address, max_history):
+        """Drop the oldest rows beyond max_history (space is reclaimed on compaction)"""
+        entry = self.index[ip_address]
+        excess = entry[2] - max_history
+        if excess <= 0:
+            return
+        for _ in range(excess):
+            entry[0] = self.next[entry[0]]
+        entry[2] -= excess
+        self.live_rows -= excess
+        self.maybe_compact()
+
+    def last_attempt_number(self, ip_address):
+        entry = self.index.get(ip_address)
+        return self.numbers[entry[1]] if entry else 0
+
+    def maybe_compact(self):
+        dead = len(self.times) - self.live_rows
+        if dead > COMPACT_MIN_DEAD and dead > self.live_rows:
+            self.compact()
+
+    def compact(self):
+        """Rewrite the columns so each IP's live rows form one contiguous range"""
+        order = []
+        for ip_address, entry in self.index.items():
+            start = len(order)
+            order.extend(self.rows(ip_address))
+            entry[:] = [start, len(order) - 1, len(order) - start]
+        # One gather per column instead of a lookup per row and column
+        for name, code in COLUMNS:
+            setattr(self, name, array(code, map(getattr(self, name).__getitem__, order)))
+        self.next = array('I', range(1, len(order) + 1))
+        for _, last, _ in self.index.values():
+            self.next[last] = NO_ROW
+        self.live_rows = len(order)
+
+    def save(self, path):
+        """Atomically write a binary snapshot
+
+        Columns are written as they are, dead rows included (compaction keeps
+        those below the live count), so saving does no per-row work.
+        """
+        ips = list(self.index)
+        entries = array('I')
+        for ip_address in ips:
+            entries.extend(self.index[ip_address])
+        tables = json.dumps({
+            "ips": ips,
+            "usernames": self.usernames.values,
+            "statuses": self.status_names.values,
+            "live_rows": self.live_rows,
+            "byteorder": sys.byteorder,
+            "itemsizes": [array(code).itemsize for _, code in SNAPSHOT_COLUMNS],
+        }, separators=(",", ":")).encode("utf-8")
+
+        path = Path(path)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(self.times), len(ips), len(tables)))
+            f.write(tables)
+            entries.tofile(f)
+            for name, _ in SNAPSHOT_COLUMNS:
+                getattr(self, name).tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read a binary snapshot written by save() (or by releases before offsets)"""
+        with open(path, 'rb') as f:
+            magic, rows, ip_count, tables_size = HEADER.unpack(f.read(HEADER.size))
+            if magic == MAGIC:
+                columns = SNAPSHOT_COLUMNS
+            elif magic == MAGIC_V1:
+                columns = SNAPSHOT_COLUMNS_V1
+            else:
+                raise ValueError(f"{path} is not an IPTrack attempt snapshot")
+            tables = json.loads(f.read(tables_size))
+            if tables["itemsizes"] != [array(code).itemsize for _, code in columns]:
+                raise ValueError(f"{path} was written on an incompatible platform")
+
+            store = cls()
+            entries = array('I')
+            entries.fromfile(f, ip_count * 3)
+            for name, _ in columns:
+                getattr(store, name).fromfile(f, rows)
+
+        if tables["byteorder"] != sys.byteorder:
+            entries.byteswap()
+            for name, _ in columns:
+                getattr(store, name).byteswap()
+        if magic == MAGIC_V1:
+            store.offsets = array('i', [NAIVE]) * rows
+
+        store.usernames = StringTable(tables["usernames"])
+        store.status_names = StringTable(tables["statuses"])
+        store.index = {ip_address: list(entries[i * 3:i * 3 + 3])
+                       for i, ip_address in enumerate(tables["ips"])}
+        store.live_rows = tables["live_rows"]
+        return store
+
+    @classmethod
+    def from_mapping(cls, attempts):
+        """Convert an ip -> [attempt dict, ...] mapping (e.g. a JSON snapshot)"""
+        store = cls()
+        for ip_address, history in attempts.items():
+            store[ip_address] = history
+        return store
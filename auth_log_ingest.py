@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Auth Log Ingester
+Tails sshd/PAM authentication logs (auth.log, secure, journald exports),
+survives rotation via inode + offset tracking and feeds SecurityMonitor in batches
+"""
+
+import json
+import os
+import re
+from datetime import datetime, timedelta
+from pathlib import Path
+from ip_networks import normalize_ip
+
+DEFAULT_AUTH_LOGS = ["/var/log/auth.log", "/var/log/secure"]
+
+# Cheap substring checks run before any regex; most auth.log lines match none
+PREFILTERS = ("Failed ", "Accepted ", "authentication failure")
+FAILED, ACCEPTED, AUTH_FAILURE = PREFILTERS
+
+IP_PATTERN = r"(?P<ip>[0-9A-Fa-f:.]+)"
+
+SSHD_FAILED = re.compile(
+    r"Failed (?:password|publickey|keyboard-interactive/pam|none) for "
+    r"(?P<invalid>invalid user )?(?P<user>.*?) from " + IP_PATTERN + r" port"
+)
+SSHD_ACCEPTED = re.compile(
+    r"Accepted (?:password|publickey|keyboard-interactive/pam) for "
+    r"(?P<user>\S+) from " + IP_PATTERN + r" port"
+)
+PAM_FAILURE = re.compile(
+    r"pam_unix\((?P<service>[^:)]+):auth\): authentication failure;"
+    r".*?rhost=" + IP_PATTERN + r"(?:\s+user=(?P<user>\S+))?"
+)
+
+MONTHS = {name: i for i, name in enumerate(
+    ["Jan", "Feb", "Mar", "Apr", "May", "Jun",
+     "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"], 1)}
+
+SECONDS = [timedelta(seconds=second) for second in range(61)]
+
+
+class SyslogTimestampParser:
+    """Parse syslog and ISO line prefixes
+
+    Lines arrive in time order, so a line stamped with the same second as
+    the one before reuses its datetime; a new second costs one addition to
+    a memoized minute.
+    """
+
+    def __init__(self, max_entries=10000):
+        # "Nov 21 21:43" -> that minute
+        self.minutes = {}
+        self.max_entries = max_entries
+        self.last_key = None
+        self.last_when = None
+        self.now = datetime.now()
+
+    def parse(self, line):
+        iso = line[:1].isdigit()
+        key = line.split(" ", 1)[0] if iso else line[:15]
+        if key != self.last_key:
+            try:
+                when = self.parse_iso(key) if iso else self.parse_syslog(key)
+            except (ValueError, KeyError, IndexError):
+                return None
+            self.last_key, self.last_when = key, when
+        return self.last_when
+
+    def parse_iso(self, text):
+        when = datetime.fromisoformat(text)
+        if when.tzinfo is not None:
+            when = when.astimezone().replace(tzinfo=None)
+        return when
+
+    def parse_syslog(self, text):
+        # "Nov 21 21:43:56" carries no year; assume the most recent one
+        if text[9] != ":" or text[12] != ":":
+            raise ValueError(f"Not a syslog timestamp: {text}")
+        minute = self.minutes.get(text[:12])
+        if minute is None:
+            minute = datetime(self.now.year, MONTHS[text[:3]], int(text[4:6]),
+                              int(text[7:9]), int(text[10:12]))
+            if (minute - self.now).days > 1:
+                minute = minute.replace(year=self.now.year - 1)
+            if len(self.minutes) >= self.max_entries:
+                self.minutes.clear()
+            self.minutes[text[:12]] = minute
+        return minute + SECONDS[int(text[13:15])]
+
+
+def parse_auth_message(message):
+    """Return (ip, username, status) for an auth failure/success message, else None"""
+    if FAILED in message:
+        match = SSHD_FAILED.search(message)
+        if match:
+            ip_address, username, invalid = match.group("ip", "user", "invalid")
+            return ip_address, username or "unknown", "invalid_user" if invalid else "failed"
+    elif ACCEPTED in message:
+        match = SSHD_ACCEPTED.search(message)
+        if match:
+            return match.group("ip"), match.group("user"), "success"
+    elif AUTH_FAILURE in message:
+        match = PAM_FAILURE.search(message)
+        # sshd reports the same event as "Failed password", so skip its PAM line
+        if match:
+            service, ip_address, username = match.group("service", "ip", "user")
+            if service != "sshd":
+                return ip_address, username or "unknown", "failed"
+    return None
+
+
+def parse_auth_lines(lines, timestamps=None):
+    """Yield (ip, username, status, when) for every auth event in lines
+
+    Handles plain syslog/ISO text lines and journald export format
+    (__REALTIME_TIMESTAMP= / MESSAGE= fields).
+    """
+    timestamps = timestamps or SyslogTimestampParser()
+    journal_time = None
+
+    for line in lines:
+        if line.startswith("__REALTIME_TIMESTAMP="):
+            try:
+                journal_time = datetime.fromtimestamp(int(line[21:]) / 1e6)
+            except ValueError:
+                journal_time = None
+            continue
+
+        if FAILED not in line and ACCEPTED not in line and AUTH_FAILURE not in line:
+            continue
+
+        if line.startswith("MESSAGE="):
+            event = parse_auth_message(line)
+            when = journal_time
+        else:
+            event = parse_auth_message(line)
+            when = timestamps.parse(line) if event else None
+
+        if event:
+            ip_address, username, status = event
+            try:
+                ip_address = normalize_ip(ip_address)
+            except ValueError:
+                continue
+            yield ip_address, username, status, when or datetime.now()
+
+
+class AuthLogIngester:
+    def __init__(self, monitor, paths=None, state_file=None, batch_size=None,
+                 read_size=4 * 1024 * 1024):
+        self.monitor = monitor
+        self.logger = monitor.logger
+        monitoring = monitor.config.get('monitoring', {})
+        self.paths = [Path(p) for p in (paths or monitoring.get('auth_log_paths', DEFAULT_AUTH_LOGS))]
+        self.batch_size = batch_size or monitoring.get('ingest_batch_size', 5000)
+        self.read_size = read_size
+        self.state_file = Path(state_file or monitor.log_dir / "ingest_state.json")
+        self.state = self.load_state()
+        self.timestamps = SyslogTimestampParser()
+
+    def load_state(self):
+        """Load saved inode/offset positions"""
+        if self.state_file.exists():
+            try:
+                with open(self.state_file, 'r') as f:
+                    return json.load(f)
+            except Exception as e:
+                self.logger.error(f"Error loading ingest state: {e}")
+        return {}
+
+    def save_state(self):
+        """Persist read positions so restarts resume where they stopped"""
+        try:
+            with open(self.state_file, 'w') as f:
+                json.dump(self.state, f, indent=2)
+        except Exception as e:
+            self.logger.error(f"Error saving ingest state: {e}")
+
+    def poll(self, paths=None):
+        """Ingest everything appended since the last poll; returns events ingested
+
+        paths reads those logs instead of the configured ones, sharing the
+        same saved positions.
+        """
+        self.timestamps.now = datetime.now()
+        total = 0
+        for path in (self.paths if paths is None else [Path(p) for p in paths]):
+            try:
+                total += self.poll_path(path)
+            except Exception as e:
+                self.logger.error(f"Error ingesting {path}: {e}")
+        self.save_state()
+        return total
+
+    def poll_path(self, path):
+        key = str(path)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return 0
+
+        position = self.state.get(key)
+        total = 0
+
+        if position and position["inode"] != stat.st_ino:
+            # Rotated: finish the old file if it was renamed alongside
+            rotated = self.find_rotated(path, position["inode"])
+            if rotated is not None:
+                total += self.read_from(rotated, position["offset"])[0]
+            position = None
+        elif position and stat.st_size < position["offset"]:
+            # Truncated in place (copytruncate)
+            position = None
+
+        offset = position["offset"] if position else 0
+        events, offset = self.read_from(path, offset)
+        self.state[key] = {"inode": stat.st_ino, "offset": offset}
+        return total + events
+
+    def find_rotated(self, path, inode):
+        """Locate the renamed predecessor of a rotated log by inode"""
+        for candidate in (path.with_name(path.name + ".1"), path.with_name(path.name + ".0")):
+            try:
+                if os.stat(candidate).st_ino == inode:
+                    return candidate
+            except FileNotFoundError:
+                continue
+        return None
+
+    def read_from(self, path, offset):
+        """Read complete lines from offset, feeding events in batches"""
+        events = 0
+        pending = []
+
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            while True:
+                chunk = f.read(self.read_size)
+                if not chunk:
+                    break
+                end = chunk.rfind(b"\n")
+                if end < 0:
+                    # No complete line yet; leave it for the next poll
+                    break
+                if end + 1 < len(chunk):
+                    f.seek(offset + end + 1)
+                offset += end + 1
+
+                lines = chunk[:end].decode('utf-8', 'replace').split("\n")
+                pending.extend(parse_auth_lines(lines, self.timestamps))
+                if len(pending) >= self.batch_size:
+                    events += len(pending)
+                    self.monitor.log_attempts(pending)
+                    pending = []
+
+        if pending:
+            events += len(pending)
+            self.monitor.log_attempts(pending)
+        return events, offset
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Block Aggregator
+Collapses blocked addresses into the minimal set of covering prefixes,
+optionally escalating to a whole network once enough of its hosts are
+blocked, and works out which prefixes the firewall must add or remove.
+A block or unblock only re-aggregates the network around the changed
+address, so its cost does not grow with the size of the blocklist
+"""
+
+import ipaddress
+import json
+from collections import defaultdict
+from pathlib import Path
+from ip_networks import PrefixTrie, address_value, parse_network
+from journal import AppendJournal, write_snapshot
+
+
+def prefix_string(network):
+    """Render a network for firewall backends (single hosts without /32, /128)"""
+    if network.prefixlen == network.max_prefixlen:
+        return str(network.network_address)
+    return str(network)
+
+
+class PrefixIndex:
+    """Set of prefix strings grouped by their escalation network
+
+    Prefixes narrower than the escalation length sit in a bucket per
+    enclosing network, keyed without building ip_network objects, so
+    indexing a large blocklist stays cheap; wider ones go in a trie.
+    """
+
+    def __init__(self, lengths):
+        self.lengths = lengths
+        # (version, escalation network number) -> prefix strings inside it
+        self.buckets = defaultdict(set)
+        self.wide = PrefixTrie()
+
+    def locate(self, text):
+        """(bucket key, None) for a narrow prefix, (None, network) for a wide one"""
+        if '/' not in text:
+            value = address_value(text)
+            if value >> 32 == 0xFFFF:
+                return (4, (value & 0xFFFFFFFF) >> (32 - self.lengths[4])), None
+            return (6, value >> (128 - self.lengths[6])), None
+        network = parse_network(text)
+        length = self.lengths[network.version]
+        if network.prefixlen > length:
+            value = int(network.network_address) >> (network.max_prefixlen - length)
+            return (network.version, value), None
+        return None, network
+
+    def add(self, text):
+        key, network = self.locate(text)
+        if key is None:
+            self.wide.add(network)
+        else:
+            self.buckets[key].add(text)
+
+    def discard(self, text):
+        key, network = self.locate(text)
+        if key is None:
+            self.wide.discard(network)
+            return
+        bucket = self.buckets.get(key)
+        if bucket is not None:
+            bucket.discard(text)
+            if not bucket:
+                del self.buckets[key]
+
+    def covering(self, network):
+        """Shortest stored prefix containing (or equal to) a network at most the escalation length"""
+        return self.wide.covering(network)
+
+    def within(self, network):
+        """Stored prefixes inside a network no narrower than the escalation length"""
+        found = [prefix_string(n) for n in self.wide.networks(network)]
+        for _, bucket in self.buckets_within(network):
+            found.extend(bucket)
+        return found
+
+    def buckets_within(self, network):
+        """(escalation network, prefix strings) for each bucket inside a network"""
+        version = network.version
+        length = self.lengths[version]
+        width = network.max_prefixlen
+        span = length - network.prefixlen
+        first = int(network.network_address) >> (width - length)
+        if (1 << span) <= len(self.buckets):
+            keys = [(version, first + i) for i in range(1 << span)]
+        else:
+            keys = [key for key in self.buckets
+                    if key[0] == version and key[1] >> span == first >> span]
+
+        found = []
+        for key in keys:
+            bucket = self.buckets.get(key)
+            if bucket:
+                supernet = ipaddress.ip_network((key[1] << (width - length), length))
+                found.append((supernet, bucket))
+        return found
+
+
+class BlockAggregator:
+    def __init__(self, state_file, logger, escalate_threshold=None,
+                 escalate_prefix_v4=24, escalate_prefix_v6=64, whitelist=None,
+                 snapshot_every=1000):
+        self.state_file = Path(state_file)
+        self.logger = logger
+        # Block the whole network once this many of its hosts are blocked (None = never)
+        self.escalate_threshold = escalate_threshold
+        self.escalate_prefixes = {4: escalate_prefix_v4, 6: escalate_prefix_v6}
+        self.whitelist = whitelist if whitelist is not None else PrefixTrie()
+        # Emitted prefix changes are journaled; the full list is rewritten every snapshot_every
+        self.journal = AppendJournal(self.state_file.with_suffix(".journal"))
+        self.snapshot_every = snapshot_every
+        self.emitted = None
+        self.emitted_index = PrefixIndex(self.escalate_prefixes)
+        self.sources = PrefixIndex(self.escalate_prefixes)
+
+    def load_state(self, default):
+        """Prefixes emitted by previous runs (default when none were recorded)"""
+        if self.state_file.exists():
+            try:
+                with open(self.state_file, 'r') as f:
+                    self.emitted = set(json.load(f))
+                for record in self.journal.replay():
+                    self.emitted.difference_update(record["remove"])
+                    self.emitted.update(record["add"])
+            except Exception as e:
+                self.logger.error(f"Error loading firewall prefix state: {e}")
+                self.emitted = None
+        if self.emitted is None:
+            self.emitted = set(default)
+            self.save_state()
+
+        self.emitted_index = PrefixIndex(self.escalate_prefixes)
+        for prefix in list(self.emitted):
+            try:
+                self.emitted_index.add(prefix)
+            except ValueError:
+                self.emitted.discard(prefix)
+        return self.emitted
+
+    def track(self, addresses):
+        """Index the currently blocked addresses/CIDRs that updates work from"""
+        self.sources = PrefixIndex(self.escalate_prefixes)
+        for address in addresses:
+            try:
+                self.sources.add(address)
+            except ValueError:
+                self.logger.warning(f"Skipping invalid address for aggregation: {address}")
+
+    def save_state(self):
+        """Write the full prefix list and start a fresh journal"""
+        try:
+            write_snapshot(self.state_file, sorted(self.emitted))
+            self.journal.truncate()
+        except Exception as e:
+            self.logger.error(f"Error saving firewall prefix state: {e}")
+
+    def aggregate(self, addresses):
+        """Minimal set of prefixes covering the addresses/CIDRs (plus escalated networks)"""
+        networks = {4: [], 6: []}
+        for address in addresses:
+            try:
+                network = parse_network(address)
+            except ValueError:
+                self.logger.warning(f"Skipping invalid address for aggregation: {address}")
+                continue
+            networks[network.version].append(network)
+
+        prefixes = set()
+        for version, hosts in networks.items():
+            if self.escalate_threshold:
+                hosts = self.escalate(hosts, self.escalate_prefixes[version])
+            prefixes.update(prefix_string(n) for n in ipaddress.collapse_addresses(hosts))
+        return prefixes
+
+    def escalate(self, hosts, prefix_length):
+        """Replace hosts with their enclosing network where the threshold is met"""
+        groups = defaultdict(list)
+        for host in hosts:
+            if host.prefixlen > prefix_length:
+                groups[host.supernet(new_prefix=prefix_length)].append(host)
+            else:
+                groups[host].append(host)
+
+        result = []
+        for network, members in groups.items():
+            if (len(members) >= self.escalate_threshold and network not in members
+                    and not self.whitelist.overlaps(network)):
+                result.append(network)
+            else:
+                result.extend(members)
+        return result
+
+    def update(self, changes):
+        """(prefixes to add, prefixes to remove) after addresses were blocked or unblocked
+
+        changes maps each address/CIDR to True if it is now blocked, False if
+        not. Only the networks around the changed addresses are recomputed.
+        """
+        if self.emitted is None:
+            self.load_state(())
+        regions = []
+        for address, blocked in changes.items():
+            try:
+                network = parse_network(address)
+            except ValueError:
+                self.logger.warning(f"Skipping invalid address for aggregation: {address}")
+                continue
+            if blocked:
+                self.sources.add(address)
+            else:
+                self.sources.discard(address)
+            length = self.escalate_prefixes[network.version]
+            if network.prefixlen > length:
+                network = network.supernet(new_prefix=length)
+            regions.append(network)
+
+        additions, removals = set(), set()
+        for region in regions:
+            added, removed = self.update_region(region)
+            for prefix in removed:
+                self.emitted.discard(prefix)
+                self.emitted_index.discard(prefix)
+                if prefix in additions:
+                    additions.discard(prefix)
+                else:
+                    removals.add(prefix)
+            for prefix in added:
+                self.emitted.add(prefix)
+                self.emitted_index.add(prefix)
+                if prefix in removals:
+                    removals.discard(prefix)
+                else:
+                    additions.add(prefix)
+
+        if additions or removals:
+            self.journal_changes(sorted(additions), sorted(removals))
+        return sorted(additions), sorted(removals)
+
+    def update_region(self, region):
+        """(prefixes to add, prefixes to remove) so the firewall matches the blocks in region
+
+        The region grows until no emitted prefix extends past it and it is
+        not entirely blocked (a full region could merge with its neighbour),
+        so the prefixes inside it are exactly those of the whole blocklist.
+        """
+        while True:
+            covering = self.emitted_index.covering(region)
+            if covering is not None and covering.prefixlen < region.prefixlen:
+                region = covering
+                continue
+            target = self.region_target(region)
+            if region.prefixlen > 0 and target == {prefix_string(region)}:
+                region = region.supernet()
+                continue
+            break
+        current = set(self.emitted_index.within(region))
+        return target - current, current - target
+
+    def region_target(self, region):
+        """Aggregated prefixes for the blocks inside region"""
+        if self.sources.covering(region) is not None:
+            return {prefix_string(region)}
+        hosts = self.sources.wide.networks(region)
+        for supernet, bucket in self.sources.buckets_within(region):
+            # Same rule as escalate(), without parsing the hosts it replaces
+            if (self.escalate_threshold and len(bucket) >= self.escalate_threshold
+                    and not self.whitelist.overlaps(supernet)):
+                hosts.append(supernet)
+            else:
+                hosts.extend(parse_network(text) for text in bucket)
+        return {prefix_string(n) for n in ipaddress.collapse_addresses(hosts)}
+
+    def journal_changes(self, additions, removals):
+        """Append one change record, snapshotting every snapshot_every records"""
+        try:
+            self.journal.append({"add": additions, "remove": removals})
+        except Exception as e:
+            self.logger.error(f"Error writing firewall prefix journal: {e}")
+            self.save_state()
+            return
+        if self.journal.pending_records >= self.snapshot_every:
+            self.save_state()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Block Expiry Scheduler
+Min-heap of block expiry times so due blocks are found without scanning
+"""
+
+import heapq
+from datetime import datetime, timedelta
+
+
+class ExpiryScheduler:
+    def __init__(self):
+        self.heap = []
+        # ip -> current expiry timestamp; heap entries that disagree are stale
+        self.expiry_for_ip = {}
+
+    def schedule(self, ip_address, expires_at):
+        """Track (or re-track) when an IP's block expires"""
+        self.expiry_for_ip[ip_address] = expires_at
+        heapq.heappush(self.heap, (expires_at, ip_address))
+
+    def cancel(self, ip_address):
+        """Stop tracking an IP (its heap entry is discarded lazily)"""
+        self.expiry_for_ip.pop(ip_address, None)
+
+    def next_due(self):
+        """Earliest live expiry timestamp, or None"""
+        self.discard_stale()
+        return self.heap[0][0] if self.heap else None
+
+    def is_due(self, now):
+        """O(1) check used on hot paths before doing any expiry work"""
+        due = self.next_due()
+        return due is not None and due <= now
+
+    def pop_due(self, now, limit=None):
+        """Remove and return IPs whose blocks expired at or before now"""
+        due = []
+        while self.heap and (limit is None or len(due) < limit):
+            self.discard_stale()
+            if not self.heap or self.heap[0][0] > now:
+                break
+            expires_at, ip_address = heapq.heappop(self.heap)
+            del self.expiry_for_ip[ip_address]
+            due.append(ip_address)
+        return due
+
+    def discard_stale(self):
+        while self.heap:
+            expires_at, ip_address = self.heap[0]
+            if self.expiry_for_ip.get(ip_address) == expires_at:
+                return
+            heapq.heappop(self.heap)
+
+    def rebuild(self, blocked_ips, default_minutes):
+        """Rebuild from blocked IP records in one heapify"""
+        self.expiry_for_ip = {}
+        for ip_address, info in blocked_ips.items():
+            expires_at = block_expiry_time(info, default_minutes)
+            if expires_at is not None:
+                self.expiry_for_ip[ip_address] = expires_at
+        self.heap = [(ts, ip) for ip, ts in self.expiry_for_ip.items()]
+        heapq.heapify(self.heap)
+
+    def __len__(self):
+        return len(self.expiry_for_ip)
+
+
+def block_expiry_time(info, default_minutes):
+    """Expiry timestamp for a block record, or None if it never expires"""
+    if "expires_at" in info:
+        if not info["expires_at"]:
+            return None
+        return datetime.fromisoformat(info["expires_at"]).timestamp()
+
+    # Records written before expiry existed use the configured duration
+    if not default_minutes or not info.get("blocked_at"):
+        return None
+    blocked_at = datetime.fromisoformat(info["blocked_at"])
+    return (blocked_at + timedelta(minutes=default_minutes)).timestamp()
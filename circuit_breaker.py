@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Circuit Breaker
+Stops calling a failing provider after repeated errors (or HTTP 429) and
+lets a single probe through once the cool-down has passed
+"""
+
+import threading
+import time
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=3, reset_seconds=300):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        # Monotonic time before which calls are skipped (0 = closed)
+        self.open_until = 0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if not self.open_until:
+            return "closed"
+        return "open" if time.monotonic() < self.open_until else "half-open"
+
+    def allow(self):
+        """True if a call may go out now (one probe at a time once half-open)"""
+        with self.lock:
+            if not self.open_until:
+                return True
+            if time.monotonic() < self.open_until or self.probing:
+                return False
+            self.probing = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.open_until = 0
+            self.probing = False
+
+    def record_failure(self, retry_after=None):
+        """Count a failure; retry_after (seconds) opens the circuit immediately"""
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if retry_after is not None or self.failures >= self.failure_threshold:
+                cool_down = self.reset_seconds if retry_after is None else retry_after
+                self.open_until = time.monotonic() + cool_down
+                return True
+            return False
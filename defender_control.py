@@ -10,11 +10,16 @@ from datetime import datetime
 from pathlib import Path
 from security_monitor import SecurityMonitor
 from ip_locator import IPLocator
+from ip_networks import read_addresses, stored_key
+from iptrack_daemon import DaemonMonitor, running_daemon
+
+# Commands that change state, sent to the daemon when one is running
+DAEMON_COMMANDS = {"unblock", "unblock-all", "expire", "reset"}
 
 class DefenderControl:
-    def __init__(self):
-        self.monitor = SecurityMonitor()
-        self.locator = IPLocator()
+    def __init__(self, monitor=None, locator=None):
+        self.monitor = monitor or SecurityMonitor()
+        self.locator = locator or IPLocator()
         
     def show_dashboard(self):
         """Show security dashboard with all stats"""
@@ -30,23 +35,34 @@ class DefenderControl:
         print(f"   Currently Blocked: {stats['blocked_ips_count']}")
         
         if blocked_ips:
+            blocked_ips = dict(blocked_ips.items())
+            # Resolve every location up front in one bulk lookup
+            try:
+                reports = self.locator.generate_location_reports(list(blocked_ips))
+                location_error = None
+            except Exception as e:
+                reports = {}
+                location_error = e
+            
             print(f"\n🚫 Blocked IPs:")
             for ip, info in blocked_ips.items():
                 print(f"\n   IP: {ip}")
                 print(f"   Blocked At: {info['blocked_at']}")
                 print(f"   Reason: {info['reason']}")
                 print(f"   Attempts: {info['attempts']}")
+                print(f"   Expires: {info.get('expires_at') or 'Never'}")
                 
-                # Get location
-                try:
-                    location = self.locator.get_location(ip)
-                    if location:
-                        loc_str = f"{location.get('city', 'Unknown')}, {location.get('country', 'Unknown')}"
-                        print(f"   Location: {loc_str}")
-                        if location.get('isp'):
-                            print(f"   ISP: {location['isp']}")
-                except Exception as e:
-                    print(f"   Location: Unable to fetch ({e})")
+                report = reports.get(ip)
+                if report:
+                    location = report["location"]
+                    loc_str = f"{location.get('city', 'Unknown')}, {location.get('country', 'Unknown')}"
+                    print(f"   Location: {loc_str}")
+                    if location.get('isp'):
+                        print(f"   ISP: {location['isp']}")
+                    if report["map_url"]:
+                        print(f"   Map: {report['map_url']}")
+                elif location_error is not None:
+                    print(f"   Location: Unable to fetch ({location_error})")
         
         print("\n" + "="*70 + "\n")
     
@@ -57,10 +73,8 @@ class DefenderControl:
         # Unblock the IP
         if self.monitor.unblock_ip(ip_address):
             # Clear attempts history
-            if ip_address in self.monitor.login_attempts:
-                old_attempts = len(self.monitor.login_attempts[ip_address])
-                del self.monitor.login_attempts[ip_address]
-                self.monitor.save_login_attempts()
+            old_attempts = self.monitor.clear_attempts(ip_address)
+            if old_attempts:
                 print(f"   ✅ Cleared {old_attempts} recorded attempts")
             
             print(f"   ✅ {ip_address} has been unblocked")
@@ -69,6 +83,34 @@ class DefenderControl:
             print(f"   ⚠️  {ip_address} was not blocked")
             return False
     
+    def unblock_many(self, ip_addresses):
+        """Unblock IPs and clear their attempts with one write and one firewall update"""
+        with self.monitor.batch():
+            unblocked = self.monitor.unblock_ips(ip_addresses)
+            cleared = self.monitor.clear_attempts_many(unblocked)
+        return unblocked, cleared
+    
+    def unblock_file(self, path):
+        """Unblock every IP listed in a file ('-' reads stdin)"""
+        stream = sys.stdin if path == "-" else open(path, 'r')
+        try:
+            entries = list(read_addresses(stream))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        
+        invalid = [entry for ip, entry in entries if ip is None]
+        ip_addresses = list(dict.fromkeys(ip for ip, _ in entries if ip is not None))
+        if invalid:
+            print(f"\n   ⚠️  Skipped {len(invalid)} invalid entries (e.g. {invalid[0]})")
+        
+        print(f"\n🔓 Unblocking {len(ip_addresses)} IPs...")
+        unblocked, cleared = self.unblock_many(ip_addresses)
+        print(f"   ✅ Unblocked {len(unblocked)} IPs, cleared {cleared} recorded attempts")
+        if len(unblocked) < len(ip_addresses):
+            print(f"   ⚠️  {len(ip_addresses) - len(unblocked)} IPs were not blocked")
+        return unblocked
+    
     def unblock_all(self):
         """Unblock all currently blocked IPs"""
         blocked_ips = list(self.monitor.get_blocked_ips().keys())
@@ -79,14 +121,29 @@ class DefenderControl:
         
         print(f"\n🔓 Unblocking {len(blocked_ips)} IPs...")
         
-        for ip in blocked_ips:
-            self.unblock_ip(ip)
+        _, cleared = self.unblock_many(blocked_ips)
+        if cleared:
+            print(f"   ✅ Cleared {cleared} recorded attempts")
         
         print("\n   ✅ All IPs have been unblocked")
     
+    def expire_blocks(self):
+        """Unblock IPs whose block duration has passed"""
+        expired = self.monitor.expire_blocks()
+        
+        if not expired:
+            print("\n   No blocks are due to expire")
+            return expired
+        
+        print(f"\n⏰ Expired {len(expired)} block(s):")
+        for ip in expired:
+            print(f"   ✅ {ip}")
+        return expired
+    
     def view_logs(self, ip_address=None):
         """View access attempt logs"""
         if ip_address:
+            ip_address = stored_key(ip_address)
             if ip_address in self.monitor.login_attempts:
                 attempts = self.monitor.login_attempts[ip_address]
                 print(f"\n📋 Login Attempts from {ip_address}:")
@@ -132,9 +189,9 @@ class DefenderControl:
         export_data = {
             "exported_at": datetime.now().isoformat(),
             "statistics": self.monitor.get_statistics(),
-            "blocked_ips": self.monitor.get_blocked_ips(),
-            "login_attempts": self.monitor.login_attempts,
-            "ip_locations": self.locator.location_cache
+            "blocked_ips": dict(self.monitor.get_blocked_ips().items()),
+            "login_attempts": dict(self.monitor.login_attempts.items()),
+            "ip_locations": dict(self.locator.location_cache.items())
         }
         
         output_path = Path(output_file)
@@ -150,16 +207,20 @@ class DefenderControl:
         response = input("Are you sure? (yes/no): ")
         
         if response.lower() == 'yes':
-            # Clear all blocked IPs
-            self.monitor.blocked_ips = {}
-            self.monitor.save_blocked_ips()
+            # Clear all blocked IPs (and their firewall rules), block history and expiries
+            self.monitor.unblock_ips(list(self.monitor.blocked_ips))
+            self.monitor.block_offenses.clear()
+            self.monitor.save_block_offenses()
+            self.monitor.expiry.rebuild({}, None)
             
             # Clear all login attempts
-            self.monitor.login_attempts = {}
-            self.monitor.save_login_attempts()
+            self.monitor.login_attempts.clear()
+            self.monitor.attempt_windows.clear()
+            self.monitor.stats.reset()
+            self.monitor.save_stats()
             
             # Clear location cache
-            self.locator.location_cache = {}
+            self.locator.location_cache.clear()
             self.locator.save_cache()
             
             # Clear PF rules file
@@ -171,6 +232,21 @@ class DefenderControl:
         else:
             print("   ❌ Reset cancelled")
     
+    def migrate_storage(self):
+        """Migrate JSON state files into the SQLite storage engine"""
+        print("\n🗄️  Migrating JSON state to SQLite...")
+        
+        migrated, store = self.monitor.migrate_to_sqlite()
+        locations = self.locator.migrate_to_sqlite(store)
+        
+        print(f"   ✅ Attempts: {migrated['attempts']}")
+        print(f"   ✅ Blocked IPs: {migrated['blocked_ips']}")
+        print(f"   ✅ Locations: {locations}")
+        print(f"   Database: {store.db_path}")
+        if self.monitor.store is None:
+            print('   Set "storage": {"backend": "sqlite"} in config.json to use it')
+        return migrated
+    
     def show_help(self):
         """Show help information"""
         print("\n" + "="*70)
@@ -179,11 +255,14 @@ class DefenderControl:
         print("\nAvailable Commands:")
         print("  dashboard          - Show security dashboard with stats")
         print("  unblock <ip>       - Unblock a specific IP address")
+        print("  unblock -f <file>  - Unblock every IP listed in a file ('-' = stdin)")
         print("  unblock-all        - Unblock all blocked IPs")
+        print("  expire             - Unblock IPs whose block has expired")
         print("  logs [ip]          - View access logs (all or for specific IP)")
         print("  locate <ip>        - Track location of an IP address")
         print("  export [file]      - Export all security data to JSON")
         print("  reset              - Reset system (clear all data)")
+        print("  migrate            - Migrate JSON state files to SQLite")
         print("  help               - Show this help message")
         print("\nExamples:")
         print("  python defender_control.py dashboard")
@@ -194,19 +273,31 @@ class DefenderControl:
 
 def main():
     """Main CLI interface"""
-    control = DefenderControl()
+    command = sys.argv[1].lower() if len(sys.argv) >= 2 else "help"
+    
+    # A running daemon owns the state; its next save would undo changes made here
+    monitor = None
+    if command in DAEMON_COMMANDS:
+        client = running_daemon()
+        if client is not None:
+            if command == "reset":
+                print("Stop the IPTrack daemon before resetting; it owns the state files")
+                return
+            monitor = DaemonMonitor(client)
+    
+    control = DefenderControl(monitor)
     
     if len(sys.argv) < 2:
         control.show_help()
         return
     
-    command = sys.argv[1].lower()
-    
     if command == "dashboard":
         control.show_dashboard()
     
     elif command == "unblock":
-        if len(sys.argv) >= 3:
+        if len(sys.argv) >= 4 and sys.argv[2] in ("-f", "--file"):
+            control.unblock_file(sys.argv[3])
+        elif len(sys.argv) >= 3:
             ip = sys.argv[2]
             control.unblock_ip(ip)
         else:
@@ -215,6 +306,9 @@ def main():
     elif command == "unblock-all":
         control.unblock_all()
     
+    elif command == "expire":
+        control.expire_blocks()
+    
     elif command == "logs":
         ip = sys.argv[2] if len(sys.argv) >= 3 else None
         control.view_logs(ip)
@@ -233,6 +327,9 @@ def main():
     elif command == "reset":
         control.reset_system()
     
+    elif command == "migrate":
+        control.migrate_storage()
+    
     elif command == "help":
         control.show_help()
     
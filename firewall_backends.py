@@ -0,0 +1,714 @@
+#!/usr/bin/env python3
+"""
+Firewall Backends
+Batched enforcement backends used by SecurityMonitor to apply blocks in bulk
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from block_aggregator import prefix_string
+from ip_networks import PrefixTrie, parse_network
+
+
+def per_ip_rule_name(address):
+    """Windows Firewall rule the per-IP default backend creates for an address
+
+    IPv4 names are unchanged from earlier releases; IPv6 colons become
+    dashes so the name stays valid and distinct from IPv4 names.
+    """
+    safe = address.replace('.', '_').replace(':', '-').replace('/', '_')
+    return f"IPTrack_Block_{safe}"
+
+
+def per_ip_rule_names(address):
+    """Current per-IP rule name, then the unsanitized one older releases used"""
+    names = [per_ip_rule_name(address)]
+    legacy = f"IPTrack_Block_{address.replace('.', '_')}"
+    if legacy not in names:
+        names.append(legacy)
+    return names
+
+
+class BatchingFirewall(ABC):
+    """Queue block/unblock requests and apply them together on flush"""
+
+    method = "batch"
+
+    def __init__(self, logger, batch_window_seconds=2.0):
+        self.logger = logger
+        self.batch_window_seconds = batch_window_seconds
+        self.pending_add = set()
+        self.pending_remove = set()
+        self.lock = threading.RLock()
+        self.timer = None
+        atexit.register(self.flush)
+
+    def is_blocked(self, address):
+        """Whether the backend already enforces an address (unknown: False)"""
+        return False
+
+    def restore(self, addresses, recorded=()):
+        """Bring the backend in line with blocks recorded before this process
+
+        addresses is what the firewall should enforce; recorded lists the
+        IPs whose blocks were made with the per-IP default backend.
+        """
+        return True
+
+    def block(self, addresses):
+        """Queue addresses to be blocked on the next flush"""
+        with self.lock:
+            for address in addresses:
+                self.pending_remove.discard(address)
+                if not self.is_blocked(address):
+                    self.pending_add.add(address)
+            self.schedule()
+        return True
+
+    def unblock(self, addresses):
+        """Queue addresses to be unblocked on the next flush"""
+        with self.lock:
+            for address in addresses:
+                self.pending_add.discard(address)
+                self.pending_remove.add(address)
+            self.schedule()
+        return True
+
+    def schedule(self):
+        """Flush now, or after the batch window if one is configured"""
+        if not self.batch_window_seconds or self.batch_window_seconds <= 0:
+            self.flush()
+            return
+        if self.timer is None:
+            self.timer = threading.Timer(self.batch_window_seconds, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self, force=False):
+        """Apply all pending changes in one backend transaction
+
+        force runs the transaction even with nothing pending, e.g. to load
+        kernel sets when a long-running process starts.
+        """
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+            if not self.pending_add and not self.pending_remove and not force:
+                return True
+
+            additions = sorted(self.pending_add)
+            removals = sorted(self.pending_remove)
+            self.pending_add = set()
+            self.pending_remove = set()
+            return self.apply(additions, removals)
+
+    def reload(self):
+        """Re-apply the whole blocklist (long-running processes call this at start)"""
+        return self.flush(force=True)
+
+    @abstractmethod
+    def apply(self, additions, removals):
+        """Backend-specific bulk update"""
+
+    def check(self, cmd):
+        """Run a read-only backend command; True if it exits 0"""
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, check=False)
+        except Exception:
+            return False
+        return result.returncode == 0
+
+    def run(self, cmd, description, input_text=None):
+        """Run one backend command, logging failures"""
+        try:
+            result = subprocess.run(cmd, input=input_text, capture_output=True,
+                                    text=True, check=False)
+        except Exception as e:
+            self.logger.error(f"Error running {cmd[0]} for {description}: {e}")
+            return False
+
+        if result.returncode == 0:
+            self.logger.info(f"Firewall updated: {description}")
+            return True
+
+        self.logger.error(f"{cmd[0]} failed for {description}: {result.stderr or result.stdout}")
+        return False
+
+
+class NetshBatchFirewall(BatchingFirewall):
+    """Coalesce blocks into a few Windows Firewall rules with remoteip lists"""
+
+    method = "netsh_batch"
+    rule_prefix = "IPTrack_Batch_"
+
+    def __init__(self, log_dir, logger, netsh_path="netsh",
+                 batch_window_seconds=2.0, ips_per_rule=100):
+        super().__init__(logger, batch_window_seconds)
+        self.netsh_path = netsh_path
+        self.ips_per_rule = max(1, ips_per_rule)
+        self.state_file = Path(log_dir) / "netsh_rules.json"
+        # Without a saved layout the existing blocks have never been batched
+        self.fresh = not self.state_file.exists()
+        # (addresses, per-IP recorded) waiting to move into batch rules
+        self.migration = None
+
+        # rule name -> list of addresses currently in that rule
+        self.rules = self.load_state()
+        self.rule_for_ip = {
+            ip: name for name, ips in self.rules.items() for ip in ips
+        }
+
+    def load_state(self):
+        """Load the rule layout applied by previous runs"""
+        if self.state_file.exists():
+            try:
+                with open(self.state_file, 'r') as f:
+                    return json.load(f)
+            except Exception as e:
+                self.logger.error(f"Error loading netsh rule state: {e}")
+        return {}
+
+    def save_state(self):
+        """Persist the current rule layout"""
+        try:
+            with open(self.state_file, 'w') as f:
+                json.dump(self.rules, f, indent=2)
+        except Exception as e:
+            self.logger.error(f"Error saving netsh rule state: {e}")
+
+    def is_blocked(self, address):
+        return address in self.rule_for_ip
+
+    def restore(self, addresses, recorded=()):
+        """Queue blocks made before the switch to netsh_batch for batch rules
+
+        Nothing runs here, so read-only commands never touch the firewall:
+        the move happens on the first write (or reload) while
+        netsh_rules.json does not exist yet.
+        """
+        if self.fresh:
+            self.migration = (list(addresses), list(recorded))
+        return True
+
+    def migrate(self, additions, removals):
+        """Move the queued pre-batch blocks, plus these changes, into batch rules
+
+        The per-IP IPTrack_Block_* rules are deleted only after the batch
+        rules that replace them were created.
+        """
+        addresses, recorded = self.migration
+        self.migration = None
+        self.fresh = False
+        target = (set(addresses) - set(removals)) | set(additions)
+
+        self.logger.info(f"Moving {len(target)} blocked addresses into batch rules")
+        ok = self.rebuild(target)
+        if ok:
+            # Record the layout even when empty, so later processes skip the move
+            self.save_state()
+        else:
+            # Keep the per-IP rules of blocked addresses and retry in the next process
+            try:
+                self.state_file.unlink()
+            except OSError:
+                pass
+            recorded = set(recorded) & set(removals)
+        for address in recorded:
+            self.delete_per_ip_rule(address)
+        return ok
+
+    def delete_per_ip_rule(self, address):
+        """Delete the per-IP rule of an address if one exists"""
+        for name in per_ip_rule_names(address):
+            cmd = [self.netsh_path, 'advfirewall', 'firewall', 'delete', 'rule', f'name={name}']
+            try:
+                result = subprocess.run(cmd, capture_output=True, text=True, check=False)
+            except Exception as e:
+                self.logger.error(f"Error deleting per-IP rule {name}: {e}")
+                return False
+            if result.returncode == 0:
+                self.logger.info(f"Removed per-IP rule {name}")
+                return True
+        return False
+
+    def apply(self, additions, removals):
+        """Rewrite only the rules touched by these changes"""
+        with self.lock:
+            if self.migration is not None:
+                return self.migrate(additions, removals)
+
+            existing = set(self.rules)
+            dirty = set()
+            # Layout of each touched rule before this update, to undo failed calls
+            previous = {}
+
+            for address in removals:
+                name = self.rule_for_ip.pop(address, None)
+                if name is not None:
+                    previous.setdefault(name, list(self.rules[name]))
+                    self.rules[name].remove(address)
+                    dirty.add(name)
+                else:
+                    # Blocked by the per-IP default before the switch
+                    self.delete_per_ip_rule(address)
+
+            additions = [a for a in additions if a not in self.rule_for_ip]
+
+            for name in sorted(self.rules, key=self.rule_index):
+                if not additions:
+                    break
+                room = self.ips_per_rule - len(self.rules[name])
+                if room > 0:
+                    previous.setdefault(name, list(self.rules[name]))
+                    self.assign(name, additions[:room])
+                    additions = additions[room:]
+                    dirty.add(name)
+
+            next_index = max((self.rule_index(n) for n in self.rules), default=0) + 1
+            while additions:
+                name = f"{self.rule_prefix}{next_index}"
+                next_index += 1
+                self.rules[name] = []
+                self.assign(name, additions[:self.ips_per_rule])
+                additions = additions[self.ips_per_rule:]
+                dirty.add(name)
+
+            failed = [name for name in sorted(dirty, key=self.rule_index)
+                      if not self.apply_rule(name, name in existing)]
+            if failed:
+                # The firewall still holds the old rules; record those, not the attempt
+                for name in failed:
+                    if name in previous:
+                        self.rules[name] = previous[name]
+                    else:
+                        self.rules.pop(name, None)
+                self.rule_for_ip = {
+                    ip: name for name, ips in self.rules.items() for ip in ips
+                }
+            if len(failed) < len(dirty):
+                self.save_state()
+            return not failed
+
+    def assign(self, name, addresses):
+        """Place addresses into a rule"""
+        self.rules[name].extend(addresses)
+        for address in addresses:
+            self.rule_for_ip[address] = name
+
+    def apply_rule(self, name, existed):
+        """Create, replace or delete one batch rule with a single netsh call"""
+        addresses = self.rules[name]
+
+        if not addresses:
+            del self.rules[name]
+            if not existed:
+                return True
+            cmd = [self.netsh_path, 'advfirewall', 'firewall', 'delete', 'rule',
+                   f'name={name}']
+        elif existed:
+            cmd = [self.netsh_path, 'advfirewall', 'firewall', 'set', 'rule',
+                   f'name={name}', 'new', f"remoteip={','.join(addresses)}"]
+        else:
+            cmd = [self.netsh_path, 'advfirewall', 'firewall', 'add', 'rule',
+                   f'name={name}', 'dir=in', 'action=block',
+                   f"remoteip={','.join(addresses)}", 'enable=yes']
+
+        return self.run(cmd, f"{name} ({len(addresses)} addresses)")
+
+    def rebuild(self, addresses):
+        """Replace every batch rule so the firewall holds exactly these addresses"""
+        with self.lock:
+            self.pending_add = set()
+            self.pending_remove = set()
+            for name in list(self.rules):
+                self.run([self.netsh_path, 'advfirewall', 'firewall', 'delete', 'rule',
+                          f'name={name}'], name)
+            self.rules = {}
+            self.rule_for_ip = {}
+            self.pending_add = set(addresses)
+            return self.flush()
+
+    def rule_index(self, name):
+        """Numeric suffix of a batch rule name"""
+        try:
+            return int(name[len(self.rule_prefix):])
+        except ValueError:
+            return 0
+
+
+def parse_networks(addresses, logger):
+    """ip_network objects for addresses/CIDRs, dropping invalid ones"""
+    networks = []
+    for address in addresses:
+        try:
+            networks.append(parse_network(address))
+        except ValueError:
+            logger.warning(f"Skipping invalid address for firewall: {address}")
+    return networks
+
+
+def boot_id():
+    """Identifier of the current boot (Linux), or None where unavailable"""
+    try:
+        with open('/proc/sys/kernel/random/boot_id', 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def element_checksum(networks):
+    """Order-independent 64-bit checksum of kernel set elements"""
+    total = 0
+    for network in networks:
+        digest = hashlib.blake2b(prefix_string(network).encode(), digest_size=8).digest()
+        total += int.from_bytes(digest, 'big')
+    return total % (1 << 64)
+
+
+def chunked(items, size):
+    """Yield consecutive slices of at most size items"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class KernelSetFirewall(BatchingFirewall):
+    """Backends enforcing through kernel sets, which start empty after a reboot
+
+    The first transaction of a process recreates the sets from the whole
+    blocklist, unless state_file shows the sets left by an earlier process
+    in this boot already hold exactly that blocklist; later transactions
+    carry only the changes. Only outermost prefixes reach the kernel, so a
+    host inside a blocked range (a feed CIDR, an escalated /24) never
+    becomes an overlapping element.
+    """
+
+    def __init__(self, logger, batch_window_seconds=2.0, state_file=None):
+        super().__init__(logger, batch_window_seconds)
+        self.blocklist = PrefixTrie()
+        self.initialized = False
+        self.state_file = Path(state_file) if state_file else None
+        # [element count, element_checksum] of the kernel sets once initialized
+        self.fingerprint = None
+
+    def restore(self, addresses, recorded=()):
+        """Seed the blocklist, reusing the kernel sets when they already match it"""
+        with self.lock:
+            for network in parse_networks(addresses, self.logger):
+                self.blocklist.add(network)
+            self.initialized = self.kernel_matches()
+        return True
+
+    def reload(self):
+        with self.lock:
+            self.initialized = False
+            return self.flush(force=True)
+
+    def load_state(self):
+        """Fingerprint recorded after the last transaction, or None"""
+        if self.state_file is None or not self.state_file.exists():
+            return None
+        try:
+            with open(self.state_file, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            self.logger.error(f"Error loading kernel set state: {e}")
+            return None
+
+    def save_state(self):
+        if self.state_file is None:
+            return
+        try:
+            if self.fingerprint is None:
+                if self.state_file.exists():
+                    self.state_file.unlink()
+                return
+            with open(self.state_file, 'w') as f:
+                json.dump({"boot_id": boot_id(), "elements": self.fingerprint}, f)
+        except Exception as e:
+            self.logger.error(f"Error saving kernel set state: {e}")
+
+    def kernel_matches(self):
+        """Whether sets from an earlier process in this boot hold exactly the blocklist"""
+        saved = self.load_state()
+        if saved is None or saved.get("boot_id") != boot_id():
+            return False
+        elements = self.blocklist.outermost()
+        fingerprint = [len(elements), element_checksum(elements)]
+        if saved.get("elements") != fingerprint or not self.sets_exist():
+            return False
+        self.fingerprint = fingerprint
+        return True
+
+    def sets_exist(self):
+        """Whether the kernel sets and their match rules are in place"""
+        return False
+
+    def update_blocklist(self, additions, removals):
+        """Apply changes to the blocklist; returns (elements to delete, elements to add)"""
+        deleted, added = set(), set()
+
+        for network in parse_networks(removals, self.logger):
+            enforced = self.blocklist.covering(network) == network
+            if not self.blocklist.discard(network) or not enforced:
+                continue
+            if network in added:
+                added.discard(network)
+            else:
+                deleted.add(network)
+            # Entries it hid become outermost again
+            added.update(self.blocklist.outermost(network))
+
+        for network in parse_networks(additions, self.logger):
+            if self.blocklist.covering(network) is not None:
+                # Already enforced through itself or a wider prefix
+                self.blocklist.add(network)
+                continue
+            for inner in self.blocklist.outermost(network):
+                if inner in added:
+                    added.discard(inner)
+                else:
+                    deleted.add(inner)
+            self.blocklist.add(network)
+            added.add(network)
+
+        return sorted(deleted, key=network_order), sorted(added, key=network_order)
+
+    def apply(self, additions, removals):
+        """Send one transaction: the full blocklist first, then only changes"""
+        with self.lock:
+            deleted, added = self.update_blocklist(additions, removals)
+            if self.initialized:
+                lines = self.change_statements(deleted, added)
+            else:
+                elements = self.blocklist.outermost()
+                lines = self.load_statements(elements)
+            if not lines:
+                return True
+
+            ok = self.run_transaction(lines, f"+{len(additions)} -{len(removals)}")
+            if not ok:
+                # The kernel may be out of step now; reload it next time
+                self.initialized = False
+                self.fingerprint = None
+            elif self.initialized:
+                count, checksum = self.fingerprint
+                self.fingerprint = [
+                    count + len(added) - len(deleted),
+                    (checksum + element_checksum(added) - element_checksum(deleted)) % (1 << 64)
+                ]
+            else:
+                self.initialized = self.after_load()
+                self.fingerprint = ([len(elements), element_checksum(elements)]
+                                    if self.initialized else None)
+            self.save_state()
+            return ok
+
+    def after_load(self):
+        """Extra setup once the sets exist; returns whether it succeeded"""
+        return True
+
+    @staticmethod
+    def by_family(networks):
+        """(IPv4 element strings, IPv6 element strings)"""
+        v4, v6 = [], []
+        for network in networks:
+            (v4 if network.version == 4 else v6).append(prefix_string(network))
+        return v4, v6
+
+
+def network_order(network):
+    return network.version, network.network_address, network.prefixlen
+
+
+class NftablesFirewall(KernelSetFirewall):
+    """Named nftables sets updated atomically with one nft -f transaction"""
+
+    method = "nftables"
+    elements_per_statement = 5000
+
+    def __init__(self, logger, nft_path="nft", table="iptrack",
+                 set_name="iptrack_blocked", batch_window_seconds=2.0, state_file=None):
+        super().__init__(logger, batch_window_seconds, state_file)
+        self.nft_path = nft_path
+        self.table = table
+        self.set_v4 = f"{set_name}_v4"
+        self.set_v6 = f"{set_name}_v6"
+
+    def setup_statements(self):
+        """Idempotent table, set and chain definitions"""
+        table = f"inet {self.table}"
+        return [
+            f"add table {table}",
+            f"add set {table} {self.set_v4} {{ type ipv4_addr; flags interval; }}",
+            f"add set {table} {self.set_v6} {{ type ipv6_addr; flags interval; }}",
+            f"add chain {table} input {{ type filter hook input priority -10; policy accept; }}",
+            f"flush chain {table} input",
+            f"add rule {table} input ip saddr @{self.set_v4} drop",
+            f"add rule {table} input ip6 saddr @{self.set_v6} drop",
+        ]
+
+    def element_statements(self, verb, set_name, addresses):
+        table = f"inet {self.table}"
+        return [
+            f"{verb} element {table} {set_name} {{ {', '.join(chunk)} }}"
+            for chunk in chunked(addresses, self.elements_per_statement)
+        ]
+
+    def load_statements(self, networks):
+        """Create the sets if needed and replace their contents"""
+        table = f"inet {self.table}"
+        lines = self.setup_statements()
+        lines += [f"flush set {table} {self.set_v4}", f"flush set {table} {self.set_v6}"]
+        for set_name, addresses in zip((self.set_v4, self.set_v6), self.by_family(networks)):
+            lines += self.element_statements("add", set_name, addresses)
+        return lines
+
+    def change_statements(self, deleted, added):
+        """Deletes before adds, so a new element never overlaps one it replaces"""
+        lines = []
+        for set_name, addresses in zip((self.set_v4, self.set_v6), self.by_family(deleted)):
+            # Adding first makes the delete succeed even for absent elements
+            lines += self.element_statements("add", set_name, addresses)
+            lines += self.element_statements("delete", set_name, addresses)
+        for set_name, addresses in zip((self.set_v4, self.set_v6), self.by_family(added)):
+            lines += self.element_statements("add", set_name, addresses)
+        return lines
+
+    def run_transaction(self, lines, description):
+        return self.run([self.nft_path, '-f', '-'], f"nftables {description}",
+                        input_text="\n".join(lines) + "\n")
+
+    def sets_exist(self):
+        # -t omits set elements, so the check stays cheap for large sets
+        table = ['inet', self.table]
+        return (all(self.check([self.nft_path, '-t', 'list', 'set'] + table + [name])
+                    for name in (self.set_v4, self.set_v6))
+                and self.check([self.nft_path, 'list', 'chain'] + table + ['input']))
+
+
+class IpsetFirewall(KernelSetFirewall):
+    """hash:net ipsets updated with one ipset restore, matched by a single iptables rule"""
+
+    method = "ipset"
+
+    def __init__(self, logger, ipset_path="ipset", iptables_path="iptables",
+                 ip6tables_path="ip6tables", set_name="iptrack_blocked",
+                 maxelem=1048576, batch_window_seconds=2.0, state_file=None):
+        super().__init__(logger, batch_window_seconds, state_file)
+        self.ipset_path = ipset_path
+        self.iptables_path = iptables_path
+        self.ip6tables_path = ip6tables_path
+        self.set_v4 = f"{set_name}_v4"
+        self.set_v6 = f"{set_name}_v6"
+        self.maxelem = maxelem
+
+    def ensure_match_rules(self):
+        """Insert the set-matching DROP rules unless they already exist"""
+        ok = True
+        for binary, set_name in ((self.iptables_path, self.set_v4),
+                                 (self.ip6tables_path, self.set_v6)):
+            match = ['INPUT', '-m', 'set', '--match-set', set_name, 'src', '-j', 'DROP']
+            try:
+                check = subprocess.run([binary, '-C'] + match,
+                                       capture_output=True, text=True, check=False)
+            except Exception as e:
+                self.logger.error(f"Error checking {binary} rule: {e}")
+                ok = False
+                continue
+            if check.returncode != 0:
+                ok = self.run([binary, '-I'] + match, f"{binary} match on {set_name}") and ok
+        return ok
+
+    def load_statements(self, networks):
+        """Create the sets if needed and replace their contents"""
+        lines = [
+            f"create {self.set_v4} hash:net family inet maxelem {self.maxelem}",
+            f"create {self.set_v6} hash:net family inet6 maxelem {self.maxelem}",
+            f"flush {self.set_v4}",
+            f"flush {self.set_v6}",
+        ]
+        return lines + self.change_statements((), networks)
+
+    def change_statements(self, deleted, added):
+        lines = []
+        for verb, networks in (("del", deleted), ("add", added)):
+            for set_name, addresses in zip((self.set_v4, self.set_v6), self.by_family(networks)):
+                lines += [f"{verb} {set_name} {a}" for a in addresses]
+        return lines
+
+    def run_transaction(self, lines, description):
+        return self.run([self.ipset_path, 'restore', '-exist'], f"ipset {description}",
+                        input_text="\n".join(lines) + "\n")
+
+    def after_load(self):
+        return self.ensure_match_rules()
+
+    def sets_exist(self):
+        # -t lists only the set header, not its members
+        return (all(self.check([self.ipset_path, '-t', 'list', name])
+                    for name in (self.set_v4, self.set_v6))
+                and self.ensure_match_rules())
+
+
+def detect_backend(config):
+    """Backend picked by "auto": netsh_batch on Windows, nftables or ipset
+    when running as root on Linux with the tools installed, else None"""
+    system = platform.system()
+    if system == 'Windows':
+        return 'netsh_batch'
+    if system != 'Linux' or not hasattr(os, 'geteuid') or os.geteuid() != 0:
+        return None
+    if shutil.which(config.get('nft_path', 'nft')):
+        return 'nftables'
+    if (shutil.which(config.get('ipset_path', 'ipset'))
+            and shutil.which(config.get('iptables_path', 'iptables'))):
+        return 'ipset'
+    return None
+
+
+def create_firewall(config, log_dir, logger):
+    """Build the configured batching backend, or None for the per-IP defaults"""
+    backend = config.get('backend', 'auto')
+    if backend == 'auto':
+        backend = detect_backend(config)
+
+    if backend == 'netsh_batch':
+        return NetshBatchFirewall(
+            log_dir, logger,
+            netsh_path=config.get('netsh_path', 'netsh'),
+            batch_window_seconds=config.get('batch_window_seconds', 2),
+            ips_per_rule=config.get('ips_per_rule', 100)
+        )
+
+    if backend == 'nftables':
+        return NftablesFirewall(
+            logger,
+            nft_path=config.get('nft_path', 'nft'),
+            table=config.get('table', 'iptrack'),
+            set_name=config.get('set_name', 'iptrack_blocked'),
+            batch_window_seconds=config.get('batch_window_seconds', 2),
+            state_file=Path(log_dir) / "nftables_state.json"
+        )
+
+    if backend == 'ipset':
+        return IpsetFirewall(
+            logger,
+            ipset_path=config.get('ipset_path', 'ipset'),
+            iptables_path=config.get('iptables_path', 'iptables'),
+            ip6tables_path=config.get('ip6tables_path', 'ip6tables'),
+            set_name=config.get('set_name', 'iptrack_blocked'),
+            batch_window_seconds=config.get('batch_window_seconds', 2),
+            state_file=Path(log_dir) / "ipset_state.json"
+        )
+
+    return None
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Offline Geolocation Database
+Compiles CSV IP-range databases (DB-IP lite, GeoLite2 blocks + locations)
+into a sorted fixed-width binary file, then answers lookups by memory-mapping
+it and binary-searching the ranges, with no network access
+"""
+
+import csv
+import ipaddress
+import json
+import mmap
+import os
+import socket
+import struct
+from pathlib import Path
+
+MAGIC = b"IPGEO01\0"
+# magic, record count, location count, offset of the location table
+HEADER = struct.Struct("<8sIIQ")
+# 36 bytes per range: start and end (16-byte big-endian IPv6, IPv4 as
+# ::ffff:a.b.c.d) and a 4-byte location index
+RECORD = struct.Struct("<16s16sI")
+OFFSET = struct.Struct("<Q")
+
+LOCATION_FIELDS = ("country", "country_code", "region", "city",
+                   "latitude", "longitude", "timezone", "isp", "organization")
+
+
+IPV4_MAPPED_PREFIX = b"\0" * 10 + b"\xff\xff"
+
+
+def address_key(ip):
+    """16-byte sort key for an IPv4/IPv6 address (IPv4 mapped into ::ffff:0:0/96)"""
+    if not isinstance(ip, str):
+        packed = ip.packed
+        return IPV4_MAPPED_PREFIX + packed if len(packed) == 4 else packed
+    # inet_pton is several times faster than ipaddress on the lookup path
+    try:
+        return IPV4_MAPPED_PREFIX + socket.inet_pton(socket.AF_INET, ip)
+    except OSError:
+        pass
+    try:
+        return socket.inet_pton(socket.AF_INET6, ip)
+    except OSError:
+        raise ValueError(f"Invalid IP address: {ip}")
+
+
+def parse_float(value):
+    try:
+        return float(value) if value not in (None, "") else None
+    except ValueError:
+        return None
+
+
+def load_geolite_locations(path):
+    """geoname_id -> location fields from a GeoLite2 *-Locations-*.csv"""
+    locations = {}
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            locations[row["geoname_id"]] = {
+                "country": row.get("country_name") or None,
+                "country_code": row.get("country_iso_code") or None,
+                "region": row.get("subdivision_1_name") or None,
+                "city": row.get("city_name") or None,
+                "timezone": row.get("time_zone") or None,
+            }
+    return locations
+
+
+def read_ranges(csv_path, locations_path=None):
+    """Yield (start_key, end_key, location) from a DB-IP or GeoLite2 CSV"""
+    geonames = load_geolite_locations(locations_path) if locations_path else {}
+
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        for row in reader:
+            if not row or row[0].startswith("#"):
+                continue
+
+            if row[0] == "network":
+                # GeoLite2 blocks header: switch to named columns
+                header = row
+                for values in reader:
+                    record = dict(zip(header, values))
+                    network = ipaddress.ip_network(record["network"], strict=False)
+                    location = dict(geonames.get(
+                        record.get("geoname_id") or record.get("registered_country_geoname_id"), {}
+                    ))
+                    location["latitude"] = parse_float(record.get("latitude"))
+                    location["longitude"] = parse_float(record.get("longitude"))
+                    yield (address_key(network.network_address),
+                           address_key(network.broadcast_address), location)
+                return
+
+            try:
+                start, end = ipaddress.ip_address(row[0]), ipaddress.ip_address(row[1])
+            except ValueError:
+                continue  # header or malformed row
+
+            if len(row) >= 8:
+                # DB-IP city lite: start, end, continent, country, region, city, lat, lon
+                location = {
+                    "country_code": row[3] or None,
+                    "region": row[4] or None,
+                    "city": row[5] or None,
+                    "latitude": parse_float(row[6]),
+                    "longitude": parse_float(row[7]),
+                }
+            else:
+                # DB-IP country lite: start, end, country
+                location = {"country_code": row[2] if len(row) > 2 else None}
+            yield address_key(start), address_key(end), location
+
+
+def compile_database(csv_path, output_path, locations_path=None):
+    """Build the binary range database from a CSV; returns the range count"""
+    location_index = {}
+    locations = []
+    records = []
+
+    for start, end, location in read_ranges(csv_path, locations_path):
+        location = {field: location.get(field) for field in LOCATION_FIELDS}
+        key = json.dumps(location, sort_keys=True, separators=(",", ":"))
+        index = location_index.get(key)
+        if index is None:
+            index = location_index[key] = len(locations)
+            locations.append(key.encode('utf-8'))
+        records.append((start, end, index))
+
+    records.sort()
+
+    output_path = Path(output_path)
+    tmp_path = output_path.with_suffix(output_path.suffix + ".tmp")
+    locations_offset = HEADER.size + RECORD.size * len(records)
+
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(records), len(locations), locations_offset))
+        for record in records:
+            f.write(RECORD.pack(*record))
+
+        # Offset table (count + 1 entries) followed by the JSON location blobs
+        position = 0
+        for blob in locations:
+            f.write(OFFSET.pack(position))
+            position += len(blob)
+        f.write(OFFSET.pack(position))
+        for blob in locations:
+            f.write(blob)
+
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, output_path)
+    return len(records)
+
+
+class GeoDatabase:
+    """Read-only, memory-mapped view of a compiled range database"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.file = open(self.path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.record_count, self.location_count, self.locations_offset = \
+            HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not an IPTrack geolocation database")
+
+        self.blob_offset = self.locations_offset + OFFSET.size * (self.location_count + 1)
+        # Decoded locations are few and shared by many ranges
+        self.location_cache = {}
+
+    def lookup(self, ip_address):
+        """Location dict for an address, or None if no range contains it"""
+        try:
+            key = address_key(ip_address)
+        except ValueError:
+            return None
+
+        data = self.map
+        size = RECORD.size
+        base = HEADER.size
+
+        # Last range whose start <= key (16-byte big-endian keys compare as bytes)
+        low, high = 0, self.record_count
+        while low < high:
+            middle = (low + high) // 2
+            offset = base + middle * size
+            if data[offset:offset + 16] <= key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == 0:
+            return None
+
+        _, end, index = RECORD.unpack_from(data, base + (low - 1) * size)
+        if key > end:
+            return None
+        return dict(self.location(index))
+
+    def location(self, index):
+        location = self.location_cache.get(index)
+        if location is None:
+            start, end = struct.unpack_from(
+                "<QQ", self.map, self.locations_offset + index * OFFSET.size
+            )
+            location = json.loads(self.map[self.blob_offset + start:self.blob_offset + end])
+            self.location_cache[index] = location
+        return location
+
+    def __len__(self):
+        return self.record_count
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+def main():
+    """CLI: compile a CSV or look up an address"""
+    import sys
+
+    if len(sys.argv) >= 4 and sys.argv[1] == "import":
+        locations = sys.argv[4] if len(sys.argv) >= 5 else None
+        count = compile_database(sys.argv[2], sys.argv[3], locations)
+        print(f"Compiled {count} ranges into {sys.argv[3]}")
+    elif len(sys.argv) >= 4 and sys.argv[1] == "lookup":
+        database = GeoDatabase(sys.argv[2])
+        print(json.dumps(database.lookup(sys.argv[3]), indent=2))
+    else:
+        print("Usage:")
+        print("  python geo_database.py import <ranges.csv> <output.bin> [locations.csv]")
+        print("  python geo_database.py lookup <database.bin> <ip_address>")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,28 +4,79 @@ IP Geolocation Tracker
 Tracks the physical location of IP addresses attempting to access the system
 """
 
+import ipaddress
 import json
 import requests
+from requests.adapters import HTTPAdapter
 import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
+from sqlite_store import SQLiteStore, open_store
+from geo_database import GeoDatabase
+from location_cache import LocationCache, JournalCacheBackend, SQLiteCacheBackend
+from circuit_breaker import CircuitBreaker
+from rate_limiter import RateLimiter, BudgetExhausted, INTERACTIVE, BACKGROUND
+from ip_networks import address_string, address_value, stored_key
+
+# Requests per minute allowed by each free tier (batch endpoints count separately)
+DEFAULT_RATE_LIMITS = {
+    "ip-api.com": 45,
+    "ip-api.com/batch": 15,
+    "ipapi.co": 30,
+    "ipwhois.app": 20
+}
 
 class IPLocator:
-    def __init__(self, log_dir="logs"):
+    def __init__(self, log_dir="logs", config_file="config.json"):
         self.log_dir = Path(log_dir)
         self.log_dir.mkdir(exist_ok=True)
+        self.config_file = config_file
+        self.config = self.load_config()
+        self.store = open_store(self.config, self.log_dir)
         self.cache_file = self.log_dir / "ip_locations.json"
+        self.cache_journal = self.log_dir / "ip_locations.journal"
         self.location_cache = self.load_cache()
         
         # Setup logging
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
         
+        # Expired entries are served while one background refresh per IP runs
+        self.refreshing = set()
+        self.refresh_lock = threading.Lock()
+        
+        # Bulk lookups: worker threads, and a cap on in-flight requests per provider
+        geolocation = self.config.get('geolocation', {})
+        self.max_workers = geolocation.get('max_workers', 32)
+        provider_concurrency = geolocation.get('provider_concurrency', 8)
+        # Keep-alive connection pools: (connect, read) timeouts per request
+        http = geolocation.get('http', {})
+        self.request_timeout = (
+            http.get('connect_timeout_seconds', 3),
+            http.get('read_timeout_seconds', geolocation.get('timeout_seconds', 5))
+        )
+        self.pool_size = http.get('pool_size', provider_concurrency)
+        # Optional reuse of one lookup for the whole enclosing /24 (IPv4) or /48 (IPv6)
+        prefix_cache = geolocation.get('prefix_cache', {})
+        self.prefix_enabled = prefix_cache.get('enabled', False)
+        self.prefix_lengths = {
+            4: prefix_cache.get('ipv4_prefix', 24),
+            6: prefix_cache.get('ipv6_prefix', 48)
+        }
+        # Failed lookups are remembered briefly so they are not retried on every render
+        self.negative_ttl = geolocation.get('negative_ttl_seconds', 900)
+        
         # Free IP geolocation APIs (no key required)
         self.apis = [
             {
                 "name": "ip-api.com",
                 "url": "http://ip-api.com/json/{ip}",
+                # POST endpoint answering up to batch_size IPs per request
+                "batch_url": "http://ip-api.com/batch",
+                "batch_size": 100,
                 "fields": ["query", "country", "countryCode", "region", "regionName", 
                           "city", "zip", "lat", "lon", "timezone", "isp", "org", "as"]
             },
@@ -42,61 +93,398 @@ class IPLocator:
                           "latitude", "longitude", "timezone", "isp", "org"]
             }
         ]
+        
+        # Compiled offline range database, consulted before any network API
+        self.offline_db = self.open_offline_db(geolocation)
+        if self.offline_db is not None:
+            self.apis.insert(0, {"name": "offline", "path": str(self.offline_db.path)})
+        
+        self.provider_slots = {
+            api["name"]: threading.BoundedSemaphore(provider_concurrency)
+            for api in self.apis
+        }
+        self.rate_limiter = RateLimiter(geolocation.get('rate_limits', DEFAULT_RATE_LIMITS))
+        # How long an interactive lookup waits for budget before giving up
+        self.interactive_wait = geolocation.get('interactive_wait_seconds', 10)
+        self.sessions = {
+            api["name"]: self.create_session()
+            for api in self.apis if api["name"] != "offline"
+        }
+        breaker_config = geolocation.get('circuit_breaker', {})
+        self.breakers = {
+            api["name"]: CircuitBreaker(
+                api["name"],
+                failure_threshold=breaker_config.get('failure_threshold', 3),
+                reset_seconds=breaker_config.get('reset_seconds', 300)
+            )
+            for api in self.apis
+        }
     
-    def load_cache(self):
-        """Load cached IP locations"""
-        if self.cache_file.exists():
+    def load_config(self):
+        """Load shared configuration (read-only; SecurityMonitor owns defaults)"""
+        if os.path.exists(self.config_file):
             try:
-                with open(self.cache_file, 'r') as f:
+                with open(self.config_file, 'r') as f:
                     return json.load(f)
             except Exception as e:
-                print(f"Error loading cache: {e}")
+                print(f"Error loading config: {e}, using defaults")
         return {}
     
+    def open_offline_db(self, geolocation):
+        """Memory-map the offline database (geolocation.offline_db) if present"""
+        path = geolocation.get('offline_db')
+        if not path:
+            return None
+        path = self.log_dir / path
+        if not path.exists():
+            return None
+        try:
+            return GeoDatabase(path)
+        except Exception as e:
+            self.logger.error(f"Error opening offline geolocation database: {e}")
+            return None
+    
+    def create_session(self):
+        """Pooled keep-alive session for one provider"""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+    
+    def load_cache(self):
+        """LRU location cache over the JSON journal or the SQLite locations table"""
+        geolocation = self.config.get('geolocation', {})
+        if self.store is not None:
+            backend = SQLiteCacheBackend(self.store)
+        else:
+            backend = JournalCacheBackend(self.cache_file, self.cache_journal)
+        
+        ttl_days = geolocation.get('cache_duration_days')
+        return LocationCache(
+            backend,
+            max_entries=geolocation.get('cache_max_entries', 10000),
+            ttl_seconds=ttl_days * 86400 if ttl_days else None
+        )
+    
+    def load_cache_json(self):
+        """Load cached IP locations from the JSON snapshot and journal"""
+        return JournalCacheBackend(self.cache_file, self.cache_journal).load()
+    
     def save_cache(self):
-        """Save IP locations to cache"""
+        """Write a full cache snapshot (inserts are journaled as they happen)"""
         try:
-            with open(self.cache_file, 'w') as f:
-                json.dump(self.location_cache, f, indent=2)
+            self.location_cache.flush()
         except Exception as e:
             self.logger.error(f"Error saving cache: {e}")
     
+    def migrate_to_sqlite(self, store=None):
+        """Copy the JSON location cache into the SQLite store"""
+        if store is None:
+            store = self.store
+        if store is None:
+            storage = self.config.get('storage', {})
+            store = SQLiteStore(self.log_dir / storage.get('sqlite_path', 'iptrack.db'))
+        return store.import_rows(store.locations, self.load_cache_json())
+    
     def get_location(self, ip_address, force_refresh=False):
         """Get location information for an IP address"""
+        ip_address = stored_key(ip_address)
+        if not self.is_routable(ip_address):
+            self.logger.info(f"Skipping lookup for non-routable address {ip_address}")
+            return None
+        
         # Check cache first
-        if not force_refresh and ip_address in self.location_cache:
-            self.logger.info(f"Using cached location for {ip_address}")
-            return self.location_cache[ip_address]
+        if not force_refresh:
+            location = self.cached_location(ip_address)
+            if location is not None:
+                expired = self.location_cache.is_expired(location)
+                if location.get("unresolved"):
+                    if not expired:
+                        return None
+                else:
+                    self.logger.info(f"Using cached location for {ip_address}")
+                    if expired:
+                        self.refresh_in_background([ip_address])
+                    return location
+        
+        try:
+            location = self.query_providers(ip_address)
+        except BudgetExhausted as e:
+            self.logger.warning(f"Could not locate {ip_address} now: {e}")
+            return None
+        if location is None:
+            self.location_cache[ip_address] = self.negative_entry(ip_address)
+            return None
         
-        # Try each API until one succeeds
-        for api in self.apis:
+        # Cache the result
+        self.store_locations({ip_address: location})
+        return location
+    
+    def prefix_key(self, ip_address):
+        """Enclosing network used as the prefix cache key, e.g. 203.0.113.0/24"""
+        try:
+            value = address_value(ip_address)
+        except ValueError:
+            return None
+        # Mask the 128-bit value; IPv4 keeps its ::ffff:0:0/96 marker bits
+        version, width = (4, 32) if value >> 32 == 0xFFFF else (6, 128)
+        length = self.prefix_lengths[version]
+        network = value & ~((1 << (width - length)) - 1)
+        return f"{address_string(network)}/{length}"
+    
+    def cached_location(self, ip_address):
+        """Exact cache entry, else one derived from the prefix cache (or None)"""
+        location = self.location_cache.get(ip_address)
+        if location is not None or not self.prefix_enabled:
+            return location
+        
+        prefix = self.prefix_key(ip_address)
+        shared = self.location_cache.get(prefix) if prefix else None
+        if shared is None:
+            return None
+        # Same network, not necessarily the same city/ISP record
+        return dict(shared, ip=ip_address, confidence="prefix", prefix=prefix)
+    
+    def is_routable(self, ip_address):
+        """False for invalid, private, loopback and other bogon addresses"""
+        try:
+            address = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return False
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        return address.is_global and not address.is_multicast
+    
+    def negative_entry(self, ip_address):
+        """Short-lived cache record for an IP no provider could resolve"""
+        return {
+            "ip": ip_address,
+            "unresolved": True,
+            "queried_at": datetime.now().isoformat(),
+            "ttl_seconds": self.negative_ttl
+        }
+    
+    def record_provider_failure(self, api, response=None):
+        """Count a provider failure; HTTP 429 opens its circuit right away"""
+        breaker = self.breakers[api["name"]]
+        retry_after = None
+        if response is not None and response.status_code == 429:
+            try:
+                retry_after = int(response.headers.get("Retry-After", breaker.reset_seconds))
+            except ValueError:
+                retry_after = breaker.reset_seconds
+        if breaker.record_failure(retry_after):
+            self.logger.warning(
+                f"Skipping {api['name']} for {retry_after or breaker.reset_seconds}s "
+                f"after repeated failures"
+            )
+    
+    def wait_limit(self, priority):
+        """Seconds a lookup may wait for rate-limit budget (background waits freely)"""
+        return self.interactive_wait if priority == INTERACTIVE else None
+    
+    def enrich_in_background(self, ip_list):
+        """Queue low-priority lookups for IPs with no usable cache entry
+        
+        Used for newly blocked IPs; interactive lookups are served first.
+        """
+        missing = []
+        for ip in ip_list:
+            location = self.cached_location(ip) if self.is_routable(ip) else {}
+            if location is None or (location.get("unresolved")
+                                    and self.location_cache.is_expired(location)):
+                missing.append(ip)
+        self.refresh_in_background(missing)
+    
+    def refresh_in_background(self, ip_list, priority=BACKGROUND):
+        """Re-query expired entries without blocking the caller"""
+        with self.refresh_lock:
+            ip_list = [ip for ip in ip_list if ip not in self.refreshing]
+            self.refreshing.update(ip_list)
+        if not ip_list:
+            return
+        
+        def refresh():
+            try:
+                found, failed = self.locate_many(ip_list, priority)
+                # A failed refresh keeps serving the stale record
+                for ip in failed:
+                    if ip not in self.location_cache:
+                        found[ip] = self.negative_entry(ip)
+                self.store_locations(found)
+            except Exception as e:
+                self.logger.warning(f"Background location refresh failed: {e}")
+            finally:
+                with self.refresh_lock:
+                    self.refreshing.difference_update(ip_list)
+        
+        threading.Thread(target=refresh, daemon=True).start()
+    
+    def query_providers(self, ip_address, skip=(), priority=INTERACTIVE):
+        """Ask providers until one answers (no caching; thread-safe)
+        
+        The offline database goes first; network providers are then tried in
+        order of remaining rate-limit budget. Raises BudgetExhausted if every
+        untried provider stays over budget past the wait limit.
+        """
+        if self.offline_db is not None and "offline" not in skip:
+            location = self.query_offline(ip_address)
+            if location:
+                return location
+        
+        apis = {api["name"]: api for api in self.apis
+                if api["name"] != "offline" and api["name"] not in skip}
+        while apis:
+            candidates = [name for name in apis if self.breakers[name].state != "open"]
+            if not candidates:
+                break
+            name = self.rate_limiter.acquire(candidates, priority, self.wait_limit(priority))
+            api = apis.pop(name)
+            breaker = self.breakers[name]
+            if not breaker.allow():
+                continue
             try:
                 url = api["url"].format(ip=ip_address)
                 self.logger.info(f"Querying {api['name']} for {ip_address}")
                 
-                response = requests.get(url, timeout=5)
+                with self.provider_slots[api["name"]]:
+                    response = self.sessions[name].get(url, timeout=self.request_timeout)
                 if response.status_code == 200:
                     data = response.json()
+                    breaker.record_success()
                     
                     # Normalize the response
                     location = self.normalize_location_data(data, api['name'])
                     location['queried_at'] = datetime.now().isoformat()
                     location['source'] = api['name']
-                    
-                    # Cache the result
-                    self.location_cache[ip_address] = location
-                    self.save_cache()
-                    
                     return location
+                self.record_provider_failure(api, response)
                     
             except Exception as e:
                 self.logger.warning(f"Error with {api['name']}: {e}")
+                self.record_provider_failure(api)
                 continue
         
         # If all APIs fail
         self.logger.error(f"Could not get location for {ip_address}")
         return None
     
+    def query_offline(self, ip_address):
+        """Look an IP up in the offline database (no network)"""
+        data = self.offline_db.lookup(ip_address)
+        if not data:
+            return None
+        location = self.normalize_location_data(data, "offline")
+        location['ip'] = ip_address
+        location['queried_at'] = datetime.now().isoformat()
+        location['source'] = "offline"
+        return location
+    
+    def store_locations(self, locations):
+        """Add many lookups to the cache with a single write
+        
+        With the prefix cache on, provider answers are also stored under their
+        enclosing network so neighbouring addresses can reuse them.
+        """
+        if self.prefix_enabled:
+            shared = {}
+            for ip, location in locations.items():
+                if location.get("unresolved") or location.get("source") == "offline":
+                    continue
+                prefix = self.prefix_key(ip)
+                if prefix:
+                    shared[prefix] = dict(location, prefix=prefix)
+            locations = {**locations, **shared}
+        self.location_cache.put_many(locations)
+    
+    def query_batch(self, api, ip_list, priority=INTERACTIVE):
+        """Resolve up to batch_size IPs with one POST; returns {ip: location}"""
+        breaker = self.breakers[api["name"]]
+        if breaker.state == "open":
+            return {}
+        try:
+            self.rate_limiter.acquire([api["name"] + "/batch"], priority, self.wait_limit(priority))
+        except BudgetExhausted:
+            return {}
+        if not breaker.allow():
+            return {}
+        try:
+            self.logger.info(f"Querying {api['name']} batch for {len(ip_list)} IPs")
+            with self.provider_slots[api["name"]]:
+                response = self.sessions[api["name"]].post(
+                    api["batch_url"], json=list(ip_list), timeout=self.request_timeout
+                )
+            if response.status_code != 200:
+                self.logger.warning(f"{api['name']} batch returned {response.status_code}")
+                self.record_provider_failure(api, response)
+                return {}
+            
+            results = response.json()
+            breaker.record_success()
+            queried_at = datetime.now().isoformat()
+            locations = {}
+            for data in results:
+                if data.get("status", "success") != "success" or not data.get("query"):
+                    continue
+                location = self.normalize_location_data(data, api['name'])
+                location['queried_at'] = queried_at
+                location['source'] = api['name']
+                locations[data["query"]] = location
+            return locations
+        
+        except Exception as e:
+            self.logger.warning(f"Error with {api['name']} batch: {e}")
+            self.record_provider_failure(api)
+            return {}
+    
+    def locate_many(self, ip_list, priority=INTERACTIVE):
+        """Resolve cache misses in bulk (no caching)
+        
+        The offline database and providers with a batch endpoint take the
+        whole list first; only IPs they leave unresolved fall back to per-IP
+        lookups. Returns ({ip: location}, [ips every provider failed on]);
+        IPs skipped for lack of rate-limit budget are in neither.
+        """
+        found = {}
+        failed = []
+        batched = set()
+        workers = max(1, min(self.max_workers, len(ip_list)))
+        
+        if self.offline_db is not None:
+            batched.add("offline")
+            for ip in ip_list:
+                location = self.query_offline(ip)
+                if location:
+                    found[ip] = location
+        
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for api in self.apis:
+                if not api.get("batch_url"):
+                    continue
+                batched.add(api["name"])
+                pending = [ip for ip in ip_list if ip not in found]
+                size = api.get("batch_size", 100)
+                chunks = [pending[i:i + size] for i in range(0, len(pending), size)]
+                for locations in pool.map(lambda chunk: self.query_batch(api, chunk, priority),
+                                          chunks):
+                    found.update(locations)
+            
+            def lookup(ip):
+                try:
+                    return self.query_providers(ip, skip=batched, priority=priority)
+                except BudgetExhausted:
+                    return False
+            
+            pending = [ip for ip in ip_list if ip not in found]
+            for ip, location in zip(pending, pool.map(lookup, pending)):
+                if location:
+                    found[ip] = location
+                elif location is None:
+                    failed.append(ip)
+        
+        return found, failed
+    
     def normalize_location_data(self, data, source):
         """Normalize location data from different APIs"""
         normalized = {
@@ -140,6 +528,9 @@ class IPLocator:
                 "organization": data.get("org")
             })
         
+        elif source == "offline":
+            normalized.update({key: data.get(key) for key in normalized})
+        
         elif source == "ipwhois.app":
             normalized.update({
                 "ip": data.get("ip"),
@@ -158,8 +549,10 @@ class IPLocator:
     
     def get_location_summary(self, ip_address):
         """Get a human-readable location summary"""
-        location = self.get_location(ip_address)
-        
+        return self.format_location_summary(ip_address, self.get_location(ip_address))
+    
+    def format_location_summary(self, ip_address, location):
+        """Render the summary from an already resolved location record"""
         if not location:
             return f"Location unknown for {ip_address}"
         
@@ -188,22 +581,69 @@ class IPLocator:
             f"{isp_info}"
         )
     
-    def track_multiple_ips(self, ip_list):
-        """Track locations for multiple IPs"""
+    def track_multiple_ips(self, ip_list, force_refresh=False):
+        """Track locations for multiple IPs concurrently
+        
+        Repeated IPs are looked up once, uncached ones in bulk (batch endpoints,
+        then a thread pool), and the cache is written once at the end. Expired
+        entries are returned as-is and refreshed in the background; bogons and
+        recently failed IPs are left out without any network call. With the
+        prefix cache on, addresses sharing a network cost one lookup and are
+        marked confidence="prefix".
+        """
         results = {}
+        pending = []
+        expired = []
         
-        for ip in ip_list:
-            self.logger.info(f"Tracking {ip}...")
-            location = self.get_location(ip)
-            if location:
-                results[ip] = location
+        for ip in dict.fromkeys(stored_key(ip) for ip in ip_list):
+            if not self.is_routable(ip):
+                continue
+            location = None if force_refresh else self.cached_location(ip)
+            if location is None:
+                pending.append(ip)
+                continue
+            stale = self.location_cache.is_expired(location)
+            if location.get("unresolved"):
+                if stale:
+                    pending.append(ip)
+                continue
+            results[ip] = location
+            if stale:
+                expired.append(ip)
+        
+        if expired:
+            self.refresh_in_background(expired)
+        
+        if pending:
+            # With the prefix cache on, one address per network is looked up
+            representatives = {}
+            if self.prefix_enabled:
+                for ip in pending:
+                    representatives.setdefault(self.prefix_key(ip), ip)
+                lookups = list(representatives.values())
+            else:
+                lookups = pending
+            
+            self.logger.info(f"Tracking {len(lookups)} IPs...")
+            found, failed = self.locate_many(lookups)
+            unresolved = {ip: self.negative_entry(ip) for ip in failed}
+            self.store_locations({**found, **unresolved})
+            results.update(found)
+            
+            for ip in pending:
+                representative = representatives.get(self.prefix_key(ip)) if representatives else None
+                if ip not in found and representative in found:
+                    results[ip] = dict(found[representative], ip=ip, confidence="prefix",
+                                       prefix=self.prefix_key(ip))
         
         return results
     
     def get_map_url(self, ip_address):
         """Get a Google Maps URL for the IP location"""
-        location = self.get_location(ip_address)
-        
+        return self.map_url_for(self.get_location(ip_address))
+    
+    def map_url_for(self, location):
+        """Google Maps URL for a resolved location record, or None"""
         if location and location.get("latitude") and location.get("longitude"):
             lat = location["latitude"]
             lon = location["longitude"]
@@ -213,17 +653,28 @@ class IPLocator:
     
     def generate_location_report(self, ip_address):
         """Generate a detailed location report"""
-        location = self.get_location(ip_address)
-        
+        return self.build_report(ip_address, self.get_location(ip_address))
+    
+    def generate_location_reports(self, ip_list):
+        """Reports for many IPs from one bulk resolution ({ip: report})"""
+        locations = self.track_multiple_ips(ip_list)
+        generated_at = datetime.now().isoformat()
+        return {
+            ip: self.build_report(ip, location, generated_at)
+            for ip, location in locations.items()
+        }
+    
+    def build_report(self, ip_address, location, generated_at=None):
+        """Summary, map URL and details rendered from one resolved record"""
         if not location:
             return None
         
         report = {
             "ip_address": ip_address,
             "location": location,
-            "summary": self.get_location_summary(ip_address),
-            "map_url": self.get_map_url(ip_address),
-            "generated_at": datetime.now().isoformat()
+            "summary": self.format_location_summary(ip_address, location),
+            "map_url": self.map_url_for(location),
+            "generated_at": generated_at or datetime.now().isoformat()
         }
         
         return report
@@ -243,7 +694,7 @@ def main():
     
     if sys.argv[1] == "cache":
         print("\n📋 Cached IP Locations:")
-        print(json.dumps(locator.location_cache, indent=2))
+        print(json.dumps(dict(locator.location_cache.items()), indent=2))
         return
     
     if sys.argv[1] == "report" and len(sys.argv) >= 3:
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+IP Network Matching
+Address normalization shared by every entry point, plus a binary radix trie
+of IPv4/IPv6 CIDR prefixes, so membership tests cost O(prefix length) no
+matter how many networks are stored
+"""
+
+import ipaddress
+import socket
+from functools import lru_cache
+
+# IPv4 addresses live in ::ffff:0:0/96 of the 128-bit integer space
+IPV4_MAPPED = 0xFFFF << 32
+
+
+def parse_network(text):
+    """ip_network for a CIDR or bare address (IPv4-mapped IPv6 becomes IPv4)"""
+    network = ipaddress.ip_network(text.strip(), strict=False)
+    if network.version == 6 and network.prefixlen >= 96:
+        mapped = network.network_address.ipv4_mapped
+        if mapped is not None:
+            network = ipaddress.ip_network(f"{mapped}/{network.prefixlen - 96}")
+    return network
+
+
+def parse_address(text):
+    """ip_address with IPv4-mapped IPv6 unwrapped to IPv4"""
+    address = ipaddress.ip_address(text)
+    if address.version == 6 and address.ipv4_mapped is not None:
+        return address.ipv4_mapped
+    return address
+
+
+@lru_cache(maxsize=65536)
+def address_value(text):
+    """128-bit integer for an address, IPv4 mapped into ::ffff:0:0/96
+
+    '1.2.3.4', '::ffff:1.2.3.4' and '001.002.003.004' all give the same
+    value. Raises ValueError for anything that is not a single address.
+    """
+    try:
+        return IPV4_MAPPED | int.from_bytes(socket.inet_pton(socket.AF_INET, text), 'big')
+    except (OSError, TypeError):
+        pass
+    parts = text.split('.')
+    if len(parts) == 4 and all(p.isdigit() and len(p) <= 3 for p in parts):
+        # Zero-padded dotted quads (decimal, as log files write them)
+        octets = [int(p) for p in parts]
+        if max(octets) <= 255:
+            return IPV4_MAPPED | int.from_bytes(bytes(octets), 'big')
+    try:
+        # Zone ids (fe80::1%eth0) do not change which host is meant
+        return int.from_bytes(socket.inet_pton(socket.AF_INET6, text.split('%', 1)[0]), 'big')
+    except (OSError, TypeError):
+        raise ValueError(f"Invalid IP address: {text}")
+
+
+def address_string(value):
+    """Canonical text for an address_value (dotted quad for IPv4)"""
+    if value >> 32 == 0xFFFF:
+        return socket.inet_ntop(socket.AF_INET, (value & 0xFFFFFFFF).to_bytes(4, 'big'))
+    return str(ipaddress.IPv6Address(value))
+
+
+@lru_cache(maxsize=65536)
+def normalize_ip(text):
+    """Canonical form of an address or CIDR; raises ValueError for anything else
+
+    Addresses are keyed by this form everywhere (attempts, blocks, caches),
+    so spelling variants of one host collapse into a single entry and text
+    that is not an address never becomes a key.
+    """
+    text = text.strip()
+    try:
+        if '/' in text:
+            network = parse_network(text)
+            if network.prefixlen == network.max_prefixlen:
+                return str(network.network_address)
+            return str(network)
+        return address_string(address_value(text))
+    except ValueError:
+        raise ValueError(f"Invalid IP address: {text}")
+
+
+def stored_key(text):
+    """normalize_ip for keys already in saved state; invalid ones are returned as-is
+
+    Used when reading or removing entries, so keys written before input was
+    validated can still be looked up and cleared.
+    """
+    try:
+        return normalize_ip(text)
+    except ValueError:
+        return text
+
+
+def read_addresses(lines):
+    """Yield (address string, None) per valid entry or (None, entry) per bad one
+
+    Takes the first field of each line and skips blanks and # comments, so
+    plain lists and commented blocklists stream through without buffering.
+    """
+    for line in lines:
+        entry = line.split("#", 1)[0].strip()
+        if not entry:
+            continue
+        entry = entry.split()[0]
+        try:
+            yield address_string(address_value(entry)), None
+        except ValueError:
+            yield None, entry
+
+
+class PrefixTrie:
+    """Set of CIDR networks answering 'is this address inside any of them'"""
+
+    def __init__(self, networks=()):
+        # Per family: node = [zero child, one child, network ending here or None]
+        self.roots = {4: [None, None, None], 6: [None, None, None]}
+        self.count = 0
+        for network in networks:
+            self.add(network)
+
+    def add(self, network):
+        """Insert a network (string or ip_network); returns it"""
+        if isinstance(network, str):
+            network = parse_network(network)
+        node = self.roots[network.version]
+        value = int(network.network_address)
+        width = network.max_prefixlen
+
+        for depth in range(network.prefixlen):
+            bit = (value >> (width - 1 - depth)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, None]
+            node = node[bit]
+
+        if node[2] is None:
+            self.count += 1
+        node[2] = network
+        return network
+
+    def discard(self, network):
+        """Remove a stored network; returns whether it was present"""
+        if isinstance(network, str):
+            network = parse_network(network)
+        node = self.roots[network.version]
+        value = int(network.network_address)
+        width = network.max_prefixlen
+
+        path = []
+        for depth in range(network.prefixlen):
+            bit = (value >> (width - 1 - depth)) & 1
+            path.append((node, bit))
+            node = node[bit]
+            if node is None:
+                return False
+        if node[2] is None:
+            return False
+
+        node[2] = None
+        self.count -= 1
+        # Prune branches that no longer lead to a stored network
+        while path and node[0] is None and node[1] is None and node[2] is None:
+            parent, bit = path.pop()
+            parent[bit] = None
+            node = parent
+        return True
+
+    def covering(self, network):
+        """Shortest stored network containing (or equal to) this network, or None"""
+        if isinstance(network, str):
+            network = parse_network(network)
+        node = self.roots[network.version]
+        value = int(network.network_address)
+        width = network.max_prefixlen
+
+        for depth in range(network.prefixlen):
+            if node[2] is not None:
+                return node[2]
+            node = node[(value >> (width - 1 - depth)) & 1]
+            if node is None:
+                return None
+        return node[2]
+
+    def outermost(self, network=None):
+        """Stored networks inside this network (or anywhere) not nested in another one"""
+        if network is None:
+            stack = [self.roots[6], self.roots[4]]
+        else:
+            if isinstance(network, str):
+                network = parse_network(network)
+            node = self.roots[network.version]
+            value = int(network.network_address)
+            width = network.max_prefixlen
+            for depth in range(network.prefixlen):
+                node = node[(value >> (width - 1 - depth)) & 1]
+                if node is None:
+                    return []
+            stack = [node]
+
+        found = []
+        while stack:
+            node = stack.pop()
+            if node[2] is not None:
+                found.append(node[2])
+                continue
+            for child in (node[1], node[0]):
+                if child is not None:
+                    stack.append(child)
+        return found
+
+    def match(self, ip_address):
+        """Shortest stored network containing the address, or None"""
+        try:
+            address = parse_address(ip_address) if isinstance(ip_address, str) else ip_address
+        except ValueError:
+            return None
+        node = self.roots[address.version]
+        value = int(address)
+        width = address.max_prefixlen
+
+        for depth in range(width):
+            if node[2] is not None:
+                return node[2]
+            node = node[(value >> (width - 1 - depth)) & 1]
+            if node is None:
+                return None
+        return node[2]
+
+    def overlaps(self, network):
+        """True if any stored network contains, or lies inside, this network"""
+        if isinstance(network, str):
+            network = parse_network(network)
+        node = self.roots[network.version]
+        value = int(network.network_address)
+        width = network.max_prefixlen
+
+        for depth in range(network.prefixlen):
+            if node[2] is not None:
+                return True
+            node = node[(value >> (width - 1 - depth)) & 1]
+            if node is None:
+                return False
+        # Nodes only exist on the path to a stored network
+        return True
+
+    def __contains__(self, ip_address):
+        return self.match(ip_address) is not None
+
+    def __len__(self):
+        return self.count
+
+    def networks(self, network=None):
+        """Stored networks (inside this network, if given) in address order"""
+        if network is None:
+            starts = [self.roots[4], self.roots[6]]
+        else:
+            if isinstance(network, str):
+                network = parse_network(network)
+            node = self.roots[network.version]
+            value = int(network.network_address)
+            width = network.max_prefixlen
+            for depth in range(network.prefixlen):
+                node = node[(value >> (width - 1 - depth)) & 1]
+                if node is None:
+                    return []
+            starts = [node]
+
+        found = []
+        for start in starts:
+            stack = [start]
+            while stack:
+                node = stack.pop()
+                if node[2] is not None:
+                    found.append(node[2])
+                # Push the one-branch first so the zero-branch is visited first
+                for child in (node[1], node[0]):
+                    if child is not None:
+                        stack.append(child)
+        return found
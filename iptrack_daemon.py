@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+IPTrack Daemon
+Long-running process that keeps security state in memory, runs periodic
+maintenance every check_interval_seconds and answers CLI requests over a
+local Unix socket
+"""
+
+import json
+import os
+import signal
+import socket
+import socketserver
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from auth_log_ingest import AuthLogIngester
+from threat_feeds import ThreatFeedImporter
+
+
+class DaemonNotRunning(ConnectionRefusedError):
+    """Nothing is listening on the daemon socket, so the state files are free"""
+
+
+class DaemonUnresponsive(RuntimeError):
+    """A daemon holds the socket but did not answer (it may still apply the request)"""
+
+
+def default_socket_path(config, log_dir="logs"):
+    """Socket location from config.json (monitoring.socket_path)"""
+    path = config.get('monitoring', {}).get('socket_path', 'iptrack.sock')
+    return Path(log_dir) / path
+
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+                result = self.server.daemon.dispatch(
+                    request.get("command"), request.get("args", {})
+                )
+                response = {"ok": True, "result": result}
+            except Exception as e:
+                response = {"ok": False, "error": str(e)}
+            try:
+                self.wfile.write((json.dumps(response) + "\n").encode())
+                self.wfile.flush()
+            except ConnectionError:
+                # The client gave up waiting; the command has still been applied
+                return
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class IPTrackDaemon:
+    def __init__(self, monitor, locator=None, socket_path=None, interval=None):
+        self.monitor = monitor
+        self.locator = locator
+        self.logger = monitor.logger
+        self.socket_path = Path(socket_path or default_socket_path(monitor.config, monitor.log_dir))
+        self.interval = interval or monitor.config.get('monitoring', {}).get(
+            'check_interval_seconds', 60
+        )
+        # All state access goes through this lock (socket threads + timer loop)
+        self.lock = threading.RLock()
+        self.stop_event = threading.Event()
+        self.server = None
+
+        # Periodic maintenance jobs, run every interval in order
+        self.tasks = [("expire", self.monitor.expire_blocks)]
+        self.ingester = None
+        if monitor.config.get('monitor_auth_log'):
+            self.ingester = AuthLogIngester(monitor)
+            self.add_task("ingest", self.ingester.poll)
+        if locator is not None:
+            self.add_task("enrich", self.enrich_blocked)
+
+        self.commands = {
+            "ping": lambda args: "pong",
+            "block": self.cmd_block,
+            "unblock": self.cmd_unblock,
+            "block_many": self.cmd_block_many,
+            "unblock_many": self.cmd_unblock_many,
+            "clear_attempts": lambda args: self.monitor.clear_attempts_many(args["ips"]),
+            "list": lambda args: dict(self.monitor.get_blocked_ips().items()),
+            "stats": lambda args: self.monitor.get_statistics(),
+            "log": self.cmd_log,
+            "expire": lambda args: self.monitor.expire_blocks(),
+            "ingest": self.cmd_ingest,
+            "locate": self.cmd_locate,
+            "feeds": self.cmd_feeds,
+        }
+        # The locator is thread-safe; slow lookups must not hold up other commands,
+        # and ping must answer while a long command holds the state lock
+        self.unlocked_commands = {"ping", "locate"}
+
+    def add_task(self, name, func):
+        """Register a job to run on every check interval"""
+        self.tasks.append((name, func))
+
+    def dispatch(self, command, args):
+        """Run one CLI command against the in-memory state"""
+        handler = self.commands.get(command)
+        if handler is None:
+            raise ValueError(f"Unknown command: {command}")
+        if command in self.unlocked_commands:
+            return handler(args)
+        with self.lock:
+            return handler(args)
+
+    def cmd_block(self, args):
+        return self.monitor.block_ip(
+            args["ip"],
+            reason=args.get("reason", "Unauthorized access attempt"),
+            duration_minutes=args.get("duration_minutes")
+        )
+
+    def cmd_unblock(self, args):
+        ip_address = args["ip"]
+        unblocked = self.monitor.unblock_ip(ip_address)
+        if unblocked and args.get("clear_attempts", True):
+            self.monitor.clear_attempts(ip_address)
+        return unblocked
+
+    def cmd_block_many(self, args):
+        return self.monitor.block_ips(
+            args["ips"],
+            reason=args.get("reason", "Unauthorized access attempt"),
+            duration_minutes=args.get("duration_minutes")
+        )
+
+    def cmd_unblock_many(self, args):
+        with self.monitor.batch():
+            unblocked = self.monitor.unblock_ips(args["ips"])
+            if args.get("clear_attempts", True):
+                self.monitor.clear_attempts_many(unblocked)
+        return unblocked
+
+    def cmd_log(self, args):
+        return self.monitor.log_attempt(
+            args["ip"], args.get("username", "unknown"), args.get("status", "failed")
+        )
+
+    def cmd_ingest(self, args):
+        ingester = self.ingester or AuthLogIngester(self.monitor)
+        return ingester.poll(args.get("paths"))
+
+    def cmd_feeds(self, args):
+        importer = ThreatFeedImporter(self.monitor)
+        action = args.get("action", "status")
+        if action == "sync":
+            return importer.sync(args.get("names"))
+        if action == "remove":
+            return importer.remove(args["name"])
+        return importer.status()
+
+    def cmd_locate(self, args):
+        if self.locator is None:
+            raise ValueError("Geolocation is not available in this daemon")
+        return self.locator.get_location(args["ip"], args.get("force_refresh", False))
+    
+    def enrich_blocked(self):
+        """Look up blocked IPs in the background, behind interactive lookups"""
+        self.locator.enrich_in_background(list(self.monitor.get_blocked_ips()))
+    
+    def run_tasks(self):
+        """Run each periodic job, isolating failures"""
+        for name, func in self.tasks:
+            try:
+                with self.lock:
+                    func()
+            except Exception as e:
+                self.logger.error(f"Daemon task {name} failed: {e}")
+
+    def prepare_socket(self):
+        """Remove a stale socket file left by a daemon that exited uncleanly
+
+        Only a refused connection proves the file is stale; a daemon that
+        accepts but is slow to answer still owns it.
+        """
+        if not self.socket_path.exists():
+            return
+        if DaemonClient(self.socket_path).is_running():
+            raise RuntimeError(f"A daemon is already listening on {self.socket_path}")
+        self.socket_path.unlink()
+
+    def serve_forever(self):
+        """Start the socket server and the maintenance loop until stopped"""
+        if not hasattr(socket, 'AF_UNIX'):
+            raise RuntimeError("Daemon mode requires Unix domain sockets")
+
+        self.prepare_socket()
+        self.server = DaemonServer(str(self.socket_path), DaemonRequestHandler)
+        self.server.daemon = self
+        os.chmod(self.socket_path, 0o600)
+
+        # Load the whole blocklist once, so the daemon also repairs sets changed by hand
+        if self.monitor.firewall is not None:
+            with self.lock:
+                self.monitor.firewall.reload()
+
+        server_thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        server_thread.start()
+
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+
+        self.logger.info(
+            f"IPTrack daemon listening on {self.socket_path} "
+            f"(interval {self.interval}s)"
+        )
+
+        try:
+            while not self.stop_event.is_set():
+                started = time.monotonic()
+                self.run_tasks()
+                elapsed = time.monotonic() - started
+                self.stop_event.wait(max(0, self.interval - elapsed))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def shutdown(self):
+        """Stop serving and persist in-memory state"""
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        try:
+            self.socket_path.unlink()
+        except OSError:
+            pass
+
+        with self.lock:
+            self.monitor.save_login_attempts()
+            self.monitor.save_stats()
+            if self.monitor.firewall is not None:
+                self.monitor.firewall.flush()
+        self.logger.info("IPTrack daemon stopped")
+
+
+class DaemonClient:
+    """Send CLI commands to a running daemon"""
+
+    def __init__(self, socket_path, timeout=5.0):
+        self.socket_path = Path(socket_path)
+        self.timeout = timeout
+
+    def is_running(self):
+        """True unless the socket is missing or refuses connections"""
+        try:
+            self.request("ping")
+        except DaemonNotRunning:
+            return False
+        except (DaemonUnresponsive, ValueError):
+            pass
+        return True
+
+    def request(self, command, **args):
+        """Send one request
+
+        Raises DaemonNotRunning if no daemon is listening (the caller may
+        then work on the files itself) and DaemonUnresponsive if one
+        accepted the connection but gave no answer.
+        """
+        if not hasattr(socket, 'AF_UNIX') or not self.socket_path.exists():
+            raise DaemonNotRunning("IPTrack daemon is not running")
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(str(self.socket_path))
+            except (ConnectionRefusedError, FileNotFoundError):
+                raise DaemonNotRunning("IPTrack daemon is not running")
+            except OSError as e:
+                raise DaemonUnresponsive(f"IPTrack daemon did not accept the request: {e}")
+            try:
+                sock.sendall((json.dumps({"command": command, "args": args}) + "\n").encode())
+                with sock.makefile('r') as reader:
+                    line = reader.readline()
+            except OSError as e:
+                raise DaemonUnresponsive(f"No answer from the IPTrack daemon to {command}: {e}")
+
+        if not line:
+            raise DaemonUnresponsive(f"IPTrack daemon closed the connection during {command}")
+        response = json.loads(line)
+        if not response.get("ok"):
+            raise ValueError(response.get("error", "daemon request failed"))
+        return response["result"]
+
+
+def running_daemon(config_file="config.json", log_dir="logs", timeout=300.0):
+    """Client for the daemon that owns this state directory, or None if none is up"""
+    try:
+        with open(config_file, 'r') as f:
+            config = json.load(f)
+    except (OSError, ValueError):
+        config = {}
+    client = DaemonClient(default_socket_path(config, log_dir), timeout=timeout)
+    return client if client.is_running() else None
+
+
+class DaemonMonitor:
+    """The SecurityMonitor calls the CLIs make, applied by a running daemon
+
+    While the daemon is up it holds the state in memory and its next save
+    would overwrite changes written to the files by another process.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    @contextmanager
+    def batch(self):
+        # Every forwarded call is already one daemon transaction
+        yield self
+
+    def log_attempt(self, ip_address, username="unknown", status="failed"):
+        return self.client.request("log", ip=ip_address, username=username, status=status)
+
+    def block_ip(self, ip_address, reason="Unauthorized access attempt", duration_minutes=None):
+        return self.client.request("block", ip=ip_address, reason=reason,
+                                   duration_minutes=duration_minutes)
+
+    def unblock_ip(self, ip_address):
+        return self.client.request("unblock", ip=ip_address, clear_attempts=False)
+
+    def unblock_ips(self, ip_addresses):
+        return self.client.request("unblock_many", ips=list(ip_addresses), clear_attempts=False)
+
+    def clear_attempts(self, ip_address):
+        return self.clear_attempts_many([ip_address])
+
+    def clear_attempts_many(self, ip_addresses):
+        return self.client.request("clear_attempts", ips=list(ip_addresses))
+
+    def expire_blocks(self):
+        return self.client.request("expire")
+
+    def get_blocked_ips(self):
+        return self.client.request("list")
+
+    def get_statistics(self):
+        return self.client.request("stats")
+
+    def simulate_attack(self, ip_address, username="attacker", attempts=5):
+        for _ in range(attempts):
+            self.log_attempt(ip_address, username=username)
+        return self.get_statistics()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Append-Only Journal
+Write-ahead log of compact NDJSON records used alongside JSON snapshots
+"""
+
+import json
+import os
+from pathlib import Path
+
+
+class AppendJournal:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.handle = None
+        self.records_written = 0
+        self.pending_records = 0
+
+    def open(self):
+        """Open the journal for appending (created on first use)"""
+        if self.handle is None:
+            self.handle = open(self.path, 'a', encoding='utf-8')
+        return self.handle
+
+    def append(self, record):
+        """Append a single record as one compact JSON line"""
+        handle = self.open()
+        handle.write(json.dumps(record, separators=(',', ':')) + "\n")
+        handle.flush()
+        self.records_written += 1
+        self.pending_records += 1
+
+    def append_many(self, records):
+        """Append several records with a single write and flush"""
+        self.append_lines([json.dumps(record, separators=(',', ':')) for record in records])
+
+    def append_lines(self, lines):
+        """Append records already encoded as compact JSON lines"""
+        if not lines:
+            return
+        handle = self.open()
+        handle.write("\n".join(lines) + "\n")
+        handle.flush()
+        self.records_written += len(lines)
+        self.pending_records += len(lines)
+
+    def replay(self):
+        """Yield every complete record in the journal, skipping a torn tail"""
+        if not self.path.exists():
+            return
+
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    # Partial write from a crash mid-append
+                    break
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                self.pending_records += 1
+                yield record
+
+    def truncate(self):
+        """Discard all journal records (called after a snapshot is written)"""
+        self.close()
+        with open(self.path, 'w', encoding='utf-8'):
+            pass
+        self.pending_records = 0
+
+    def size(self):
+        """Current journal size in bytes"""
+        try:
+            return self.path.stat().st_size
+        except OSError:
+            return 0
+
+    def close(self):
+        """Close the underlying file handle"""
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+
+
+def write_snapshot(path, data, indent=2):
+    """Atomically replace a JSON snapshot file"""
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
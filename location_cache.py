@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Location Cache
+Size-bounded LRU of IP geolocation records with TTL expiry (based on each
+record's queried_at), persisted incrementally through a journal or SQLite
+"""
+
+import json
+import threading
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from datetime import datetime
+from journal import AppendJournal, write_snapshot
+from ip_networks import stored_key
+
+
+class JournalCacheBackend:
+    """JSON snapshot plus an NDJSON journal of puts and deletes"""
+
+    def __init__(self, snapshot_path, journal_path, compact_every=1000):
+        self.snapshot_path = snapshot_path
+        self.journal = AppendJournal(journal_path)
+        self.compact_every = compact_every
+
+    def load(self):
+        locations = {}
+        if self.snapshot_path.exists():
+            try:
+                with open(self.snapshot_path, 'r') as f:
+                    locations = json.load(f)
+            except Exception as e:
+                print(f"Error loading cache: {e}")
+
+        for record in self.journal.replay():
+            if record.get("deleted"):
+                locations.pop(record["ip"], None)
+            else:
+                locations[record["ip"]] = record["location"]
+        return locations
+
+    def put_many(self, locations):
+        self.journal.append_many(
+            {"ip": ip, "location": location} for ip, location in locations.items()
+        )
+
+    def delete_many(self, ip_addresses):
+        self.journal.append_many({"ip": ip, "deleted": True} for ip in ip_addresses)
+
+    def needs_compaction(self):
+        return self.journal.pending_records >= self.compact_every
+
+    def compact(self, locations):
+        """Fold the journal into a fresh snapshot"""
+        write_snapshot(self.snapshot_path, locations)
+        self.journal.truncate()
+
+    def clear(self):
+        self.compact({})
+
+
+class SQLiteCacheBackend:
+    """Rows in the SQLite locations table (already written per change)"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def load(self):
+        return dict(self.store.locations.items())
+
+    def put_many(self, locations):
+        self.store.import_rows(self.store.locations, locations)
+
+    def delete_many(self, ip_addresses):
+        with self.store.lock:
+            self.store.conn.executemany(
+                "DELETE FROM locations WHERE ip = ?", [(ip,) for ip in ip_addresses]
+            )
+            self.store.conn.commit()
+
+    def needs_compaction(self):
+        return False
+
+    def compact(self, locations):
+        pass
+
+    def clear(self):
+        self.store.locations.clear()
+
+
+class LocationCache(MutableMapping):
+    """ip -> location mapping, least recently used first"""
+
+    def __init__(self, backend, max_entries=10000, ttl_seconds=None):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.RLock()
+
+        # Oldest lookups first so they are the first evicted; a host cached under
+        # several spellings keeps its newest record
+        self.entries = OrderedDict(sorted(
+            ((stored_key(ip), location) for ip, location in backend.load().items()),
+            key=lambda item: item[1].get("queried_at") or ""
+        ))
+        self.evict()
+
+    def __getitem__(self, ip_address):
+        with self.lock:
+            location = self.entries[ip_address]
+            self.entries.move_to_end(ip_address)
+            return location
+
+    def __setitem__(self, ip_address, location):
+        self.put_many({ip_address: location})
+
+    def __delitem__(self, ip_address):
+        with self.lock:
+            del self.entries[ip_address]
+            self.backend.delete_many([ip_address])
+
+    def __contains__(self, ip_address):
+        return ip_address in self.entries
+
+    def __iter__(self):
+        return iter(list(self.entries))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def items(self):
+        with self.lock:
+            return list(self.entries.items())
+
+    def put_many(self, locations):
+        """Insert or refresh several records with one backend write"""
+        if not locations:
+            return
+        with self.lock:
+            for ip_address, location in locations.items():
+                self.entries[ip_address] = location
+                self.entries.move_to_end(ip_address)
+            self.backend.put_many(locations)
+            self.evict()
+            if self.backend.needs_compaction():
+                self.backend.compact(self.entries)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.backend.clear()
+
+    def evict(self):
+        """Drop least recently used records beyond max_entries"""
+        if not self.max_entries or len(self.entries) <= self.max_entries:
+            return
+        with self.lock:
+            evicted = [self.entries.popitem(last=False)[0]
+                       for _ in range(len(self.entries) - self.max_entries)]
+            self.backend.delete_many(evicted)
+
+    def is_expired(self, location, now=None):
+        """True once a record is older than its TTL (never without one)
+        
+        Records may carry their own ttl_seconds (e.g. negative entries).
+        """
+        ttl_seconds = location.get("ttl_seconds", self.ttl_seconds)
+        if not ttl_seconds:
+            return False
+        try:
+            queried_at = datetime.fromisoformat(location["queried_at"])
+        except (KeyError, TypeError, ValueError):
+            return True
+        return ((now or datetime.now()) - queried_at).total_seconds() > ttl_seconds
+
+    def flush(self):
+        """Write a full snapshot (JSON backend) and reset the journal"""
+        with self.lock:
+            self.backend.compact(self.entries)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Log Backfill
+Replays historical and rotated auth logs (auth.log.1, auth.log.*.gz) in
+parallel: plain files are split into mmap'd line-aligned chunks, parsed in a
+process pool, merged into per-IP aggregates and applied in one bulk operation
+"""
+
+import gzip
+import mmap
+import os
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from attempt_stats import AttemptStats
+from auth_log_ingest import SyslogTimestampParser, parse_auth_lines
+
+DEFAULT_CHUNK_SIZE = 32 * 1024 * 1024
+
+
+def plan_chunks(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Split a file into (path, start, end) ranges that end on newlines"""
+    path = str(path)
+    if path.endswith(".gz"):
+        # Compressed streams cannot be split; one task per file
+        return [(path, None, None)]
+
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+
+    chunks = []
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        while start < size:
+            end = min(start + chunk_size, size)
+            if end < size:
+                newline = mm.find(b"\n", end)
+                end = size if newline < 0 else newline + 1
+            chunks.append((path, start, end))
+            start = end
+    return chunks
+
+
+def read_chunk_lines(path, start, end):
+    """Decode one planned chunk into text lines"""
+    if start is None:
+        with gzip.open(path, 'rt', encoding='utf-8', errors='replace') as f:
+            return f.read().split("\n")
+
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return mm[start:end].decode('utf-8', 'replace').split("\n")
+
+
+def parse_chunk(task):
+    """Worker: aggregate auth events in one chunk by IP"""
+    path, start, end, max_history = task
+    timestamps = SyslogTimestampParser()
+
+    aggregates = {}
+    stats = AttemptStats(retention_minutes=10 ** 9)
+
+    for ip_address, username, status, when in parse_auth_lines(
+        read_chunk_lines(path, start, end), timestamps
+    ):
+        entry = aggregates.get(ip_address)
+        if entry is None:
+            entry = aggregates[ip_address] = {
+                "count": 0,
+                "failures": array('d'),
+                "recent": deque(maxlen=max_history or None)
+            }
+        epoch = when.timestamp()
+        entry["count"] += 1
+        if status != "success":
+            entry["failures"].append(epoch)
+        entry["recent"].append((epoch, username, status))
+
+        stats.record(when.isoformat(), username, status)
+
+    return aggregates, stats
+
+
+def merge_aggregates(results, max_history):
+    """Combine per-chunk aggregates into one record per IP"""
+    merged = {}
+    stats = AttemptStats(retention_minutes=10 ** 9)
+
+    for aggregates, chunk_stats in results:
+        stats.merge(chunk_stats)
+
+        for ip_address, entry in aggregates.items():
+            target = merged.get(ip_address)
+            if target is None:
+                merged[ip_address] = {
+                    "count": entry["count"],
+                    "failures": entry["failures"],
+                    "recent": list(entry["recent"])
+                }
+                continue
+            target["count"] += entry["count"]
+            target["failures"].extend(entry["failures"])
+            target["recent"].extend(entry["recent"])
+
+    for entry in merged.values():
+        entry["recent"].sort()
+        if max_history:
+            entry["recent"] = entry["recent"][-max_history:]
+
+    return merged, stats
+
+
+def window_exceeded(failures, max_attempts, window_seconds):
+    """True if any max_attempts consecutive failures fit inside the window"""
+    if max_attempts <= 0 or len(failures) < max_attempts:
+        return False
+    if not window_seconds:
+        return True
+    times = sorted(failures)
+    span = max_attempts - 1
+    return any(times[i + span] - times[i] <= window_seconds
+               for i in range(len(times) - span))
+
+
+def backfill(monitor, paths, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Parse historical logs in parallel and apply attempts and blocks in bulk"""
+    max_history = monitor.config.get('max_history_per_ip')
+    tasks = []
+    for path in paths:
+        if not Path(path).is_file():
+            monitor.logger.warning(f"Skipping missing log file: {path}")
+            continue
+        tasks.extend((p, s, e, max_history) for p, s, e in plan_chunks(path, chunk_size))
+
+    summary = {"files": len(paths), "chunks": len(tasks), "events": 0,
+               "ips": 0, "blocked": []}
+    if not tasks:
+        return summary
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(tasks) == 1:
+        results = [parse_chunk(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            results = list(pool.map(parse_chunk, tasks))
+
+    merged, stats = merge_aggregates(results, max_history)
+    summary["events"] = stats.total_attempts
+    summary["ips"] = len(merged)
+
+    histories = {
+        ip: [(datetime.fromtimestamp(ts).isoformat(), user, status)
+             for ts, user, status in entry["recent"]]
+        for ip, entry in merged.items()
+    }
+    counts = {ip: entry["count"] for ip, entry in merged.items()}
+
+    offenders = []
+    if monitor.config.get('auto_block', True):
+        max_attempts = monitor.config.get('max_attempts', 3)
+        window_seconds = monitor.config.get('attempt_window_seconds')
+        offenders = [
+            ip for ip, entry in merged.items()
+            if window_exceeded(entry["failures"], max_attempts, window_seconds)
+        ]
+
+    with monitor.batch():
+        monitor.import_attempts(histories, counts, stats)
+        summary["blocked"] = monitor.block_ips(
+            offenders, reason="Too many failed attempts (backfill)"
+        )
+
+    return summary
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Provider Rate Limiter
+Token buckets sized to each geolocation provider's per-minute quota, handed
+out in priority order (interactive lookups before background enrichment) to
+whichever eligible provider has the most budget left
+"""
+
+import heapq
+import itertools
+import threading
+import time
+
+# Lower numbers are served first
+INTERACTIVE = 0
+BACKGROUND = 10
+
+
+class BudgetExhausted(Exception):
+    """No provider had budget before the caller's deadline"""
+
+
+class TokenBucket:
+    def __init__(self, per_minute, burst=None):
+        self.burst = burst or max(1, per_minute // 6)
+        # Refill slowly enough that burst + refill never exceeds the quota in any minute
+        self.rate = max(per_minute - self.burst, 1) / 60.0
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def remaining(self):
+        self.refill()
+        return self.tokens
+
+    def take(self):
+        self.tokens -= 1
+
+    def wait_time(self):
+        """Seconds until one token is available"""
+        self.refill()
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    def __init__(self, limits):
+        """limits maps provider name -> requests per minute (or {"per_minute", "burst"})"""
+        self.buckets = {}
+        for name, limit in limits.items():
+            if isinstance(limit, dict):
+                self.buckets[name] = TokenBucket(limit["per_minute"], limit.get("burst"))
+            else:
+                self.buckets[name] = TokenBucket(limit)
+        self.condition = threading.Condition()
+        self.waiting = []
+        self.sequence = itertools.count()
+
+    def remaining(self, name):
+        with self.condition:
+            bucket = self.buckets.get(name)
+            return float("inf") if bucket is None else bucket.remaining()
+
+    def acquire(self, names, priority=INTERACTIVE, timeout=None):
+        """Take a token from the eligible provider with the most budget left
+
+        Waiters are served strictly by priority, then arrival. Providers without
+        a configured limit are always eligible. Raises BudgetExhausted if
+        nothing frees up within timeout seconds.
+        """
+        names = list(names)
+        if not names:
+            raise BudgetExhausted("no provider available")
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self.condition:
+            ticket = (priority, next(self.sequence))
+            heapq.heappush(self.waiting, ticket)
+            try:
+                while True:
+                    wait = 0.05
+                    if self.waiting[0] == ticket:
+                        unlimited = [n for n in names if n not in self.buckets]
+                        if unlimited:
+                            return unlimited[0]
+                        best = max(names, key=lambda n: self.buckets[n].remaining())
+                        if self.buckets[best].remaining() >= 1:
+                            self.buckets[best].take()
+                            return best
+                        wait = min(self.buckets[n].wait_time() for n in names)
+
+                    if deadline is not None:
+                        left = deadline - time.monotonic()
+                        if left <= 0:
+                            raise BudgetExhausted(f"rate limit reached for {', '.join(names)}")
+                        wait = min(wait, left)
+                    self.condition.wait(wait)
+            finally:
+                self.waiting.remove(ticket)
+                heapq.heapify(self.waiting)
+                self.condition.notify_all()
@@ -15,6 +15,20 @@ from datetime import datetime
 from pathlib import Path
 import socket
 import re
+import atexit
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from datetime import timedelta
+from json.encoder import encode_basestring_ascii
+from attempt_stats import AttemptStats
+from attempt_store import CompactAttempts
+from block_expiry import ExpiryScheduler
+from journal import AppendJournal, write_snapshot
+from firewall_backends import create_firewall, per_ip_rule_name, per_ip_rule_names
+from sqlite_store import SQLiteStore, open_store
+from ip_networks import PrefixTrie, normalize_ip, stored_key
+from block_aggregator import BlockAggregator
 
 class SecurityMonitor:
     def __init__(self, log_dir="logs", config_file="config.json"):
@@ -36,11 +50,59 @@ class SecurityMonitor:
         )
         self.logger = logging.getLogger(__name__)
         
+        # Whitelist entries may be addresses or CIDR ranges
+        self.whitelist = self.compile_whitelist()
+        
         # Initialize tracking files
         self.blocked_ips_file = self.log_dir / "blocked_ips.json"
         self.attempts_file = self.log_dir / "login_attempts.json"
+        self.attempts_snapshot = self.log_dir / "login_attempts.bin"
+        self.attempts_journal = AppendJournal(self.log_dir / "login_attempts.journal")
+        journal_config = self.config.get('journal', {})
+        self.journal_enabled = journal_config.get('enabled', True)
+        self.snapshot_every = journal_config.get('snapshot_every', 1000)
+        
+        # Optional SQLite engine replaces the JSON files when configured
+        self.store = open_store(self.config, self.log_dir)
+        # File storage snapshots attempts as "binary" columns or legacy "json"
+        self.attempts_format = self.config.get('storage', {}).get('attempts_snapshot', 'binary')
+        
+        # Saves requested inside batch() run once when the batch ends
+        self.batch_depth = 0
+        self.deferred_saves = []
+        self.deferred_blocks = []
+        self.deferred_unblocks = []
+        self.pending_journal = []
+        self.pending_offenses = []
+        
         self.blocked_ips = self.load_blocked_ips()
+        self.offenses_file = self.log_dir / "block_offenses.json"
+        self.offenses_journal = AppendJournal(self.log_dir / "block_offenses.journal")
+        self.block_offenses = self.load_block_offenses()
+        self.expiry = ExpiryScheduler()
+        self.expiry.rebuild(self.blocked_ips, self.config.get('block_duration_minutes'))
+        
+        # Running counters; journal replay keeps them in step with attempts
+        self.stats_file = self.log_dir / "attempt_stats.json"
+        self.stats = self.load_stats()
         self.login_attempts = self.load_login_attempts()
+        if self.stats is None:
+            self.stats = AttemptStats.from_attempts(self.login_attempts)
+        self.unsaved_stats = 0
+        if self.store is not None:
+            atexit.register(self.save_stats)
+        
+        # Recent failure timestamps per IP, sized to max_attempts
+        self.attempt_windows = {}
+        
+        # Optional batching firewall backend (None keeps per-IP rules)
+        self.firewall = create_firewall(self.config.get('firewall', {}), self.log_dir, self.logger)
+        self.aggregator = self.create_aggregator()
+        if self.firewall is not None:
+            self.firewall.restore(self.enforced_addresses(), [
+                ip for ip, info in self.blocked_ips.items()
+                if info.get("method") == "windows_firewall"
+            ])
         
         self.logger.info(f"Security Monitor initialized on {platform.system()}")
     
@@ -48,11 +110,37 @@ class SecurityMonitor:
         """Load configuration settings"""
         default_config = {
             "max_attempts": 3,
+            "attempt_window_seconds": 600,
+            "max_history_per_ip": 100,
             "block_duration_minutes": 60,
+            "block_escalation": {
+                "enabled": True,
+                "multiplier": 2,
+                "max_duration_minutes": 10080
+            },
             "monitor_auth_log": True,
             "auto_block": True,
             "alert_email": None,
-            "whitelist_ips": ["127.0.0.1", "::1"]
+            "whitelist_ips": ["127.0.0.1", "::1"],
+            "journal": {
+                "enabled": True,
+                "snapshot_every": 1000
+            },
+            "firewall": {
+                "backend": "auto",
+                "batch_window_seconds": 2,
+                "ips_per_rule": 100,
+                "aggregate": {
+                    "enabled": False,
+                    "escalate_threshold": None,
+                    "escalate_prefix_v4": 24,
+                    "escalate_prefix_v6": 64
+                }
+            },
+            "storage": {
+                "backend": "json",
+                "sqlite_path": "iptrack.db"
+            }
         }
         
         if os.path.exists(self.config_file):
@@ -69,70 +157,497 @@ class SecurityMonitor:
         return default_config
     
     def load_blocked_ips(self):
-        """Load blocked IPs from file"""
+        """Load blocked IPs from file (or the SQLite blocks table)"""
+        if self.store is not None:
+            return self.store.blocks
+        return self.load_blocked_ips_json()
+    
+    def load_blocked_ips_json(self):
+        """Load blocked IPs from the JSON file"""
         if self.blocked_ips_file.exists():
             try:
                 with open(self.blocked_ips_file, 'r') as f:
-                    return json.load(f)
+                    blocked_ips = json.load(f)
+                # The earliest block of a host wins over later spelling variants
+                self.merge_address_variants(blocked_ips, lambda kept, other: kept)
+                return blocked_ips
             except Exception as e:
                 self.logger.error(f"Error loading blocked IPs: {e}")
         return {}
     
+    def merge_address_variants(self, mapping, merge):
+        """Re-key entries stored under a non-canonical spelling of an address
+        
+        merge(canonical value, variant value) decides what a collision keeps.
+        Returns how many entries were re-keyed.
+        """
+        variants = [key for key in mapping if stored_key(key) != key]
+        for key in variants:
+            value = mapping.pop(key)
+            canonical = stored_key(key)
+            mapping[canonical] = merge(mapping[canonical], value) if canonical in mapping else value
+        if variants:
+            self.logger.info(f"Merged {len(variants)} entries under canonical addresses")
+        return len(variants)
+    
     def save_blocked_ips(self):
         """Save blocked IPs to file"""
+        if self.store is not None:
+            return  # SQLite views write through
+        if self.defer_save(self.save_blocked_ips):
+            return
         try:
             with open(self.blocked_ips_file, 'w') as f:
                 json.dump(self.blocked_ips, f, indent=2)
         except Exception as e:
             self.logger.error(f"Error saving blocked IPs: {e}")
     
+    def load_block_offenses(self):
+        """Load how many times each IP has been blocked (snapshot + journal)"""
+        if self.store is not None:
+            return self.store.get_meta("block_offenses", {})
+        offenses = {}
+        if self.offenses_file.exists():
+            try:
+                with open(self.offenses_file, 'r') as f:
+                    offenses = json.load(f)
+            except Exception as e:
+                self.logger.error(f"Error loading block offenses: {e}")
+        try:
+            for record in self.offenses_journal.replay():
+                offenses[record["ip"]] = record["offense"]
+        except Exception as e:
+            self.logger.error(f"Error replaying block offense journal: {e}")
+        self.merge_address_variants(offenses, lambda kept, other: kept + other)
+        return offenses
+    
+    def save_block_offenses(self):
+        """Save per-IP block counts used for escalating durations (full snapshot)"""
+        if self.defer_save(self.save_block_offenses):
+            return
+        try:
+            if self.store is not None:
+                self.store.set_meta("block_offenses", self.block_offenses)
+            else:
+                write_snapshot(self.offenses_file, self.block_offenses)
+                self.offenses_journal.truncate()
+        except Exception as e:
+            self.logger.error(f"Error saving block offenses: {e}")
+    
+    def journal_offense(self, ip_address):
+        """Record one IP's new block count without rewriting every count"""
+        if self.store is not None:
+            self.save_block_offenses()
+            return
+        self.pending_offenses.append({"ip": ip_address, "offense": self.block_offenses[ip_address]})
+        if not self.defer_save(self.flush_offenses):
+            self.flush_offenses()
+    
+    def flush_offenses(self):
+        """Append buffered block counts, snapshotting every snapshot_every records"""
+        records, self.pending_offenses = self.pending_offenses, []
+        try:
+            self.offenses_journal.append_many(records)
+        except Exception as e:
+            self.logger.error(f"Error writing block offense journal: {e}")
+            self.save_block_offenses()
+            return
+        
+        if self.offenses_journal.pending_records >= self.snapshot_every:
+            self.save_block_offenses()
+    
+    def defer_save(self, save_method):
+        """Queue a save while a batch is open; True if it was deferred"""
+        if not self.batch_depth:
+            return False
+        if save_method not in self.deferred_saves:
+            self.deferred_saves.append(save_method)
+        return True
+    
+    @contextmanager
+    def batch(self):
+        """Group state changes so files are written and firewalls updated once
+
+        In SQLite mode the rows written inside the batch share one transaction.
+        """
+        held = self.store.hold_commits() if self.store is not None else nullcontext()
+        with held:
+            self.batch_depth += 1
+            try:
+                yield self
+            finally:
+                self.batch_depth -= 1
+                if self.batch_depth == 0:
+                    unblocks, self.deferred_unblocks = self.deferred_unblocks, []
+                    blocks, self.deferred_blocks = self.deferred_blocks, []
+                    if self.aggregator is not None:
+                        if unblocks or blocks:
+                            self.sync_firewall(unblocks + blocks)
+                    else:
+                        if unblocks:
+                            self.remove_firewall_rules(unblocks)
+                        if blocks:
+                            self.add_firewall_rules(blocks)
+                    saves, self.deferred_saves = self.deferred_saves, []
+                    for save_method in saves:
+                        save_method()
+    
     def load_login_attempts(self):
-        """Load login attempts from file"""
-        if self.attempts_file.exists():
+        """Load login attempts (indexed SQLite view or compact snapshot + journal)"""
+        if self.store is not None:
+            return self.store.attempts
+        return self.load_login_attempts_file()
+    
+    def load_login_attempts_file(self):
+        """Load the newest attempt snapshot (binary or JSON) and replay the journal tail"""
+        attempts = CompactAttempts()
+        snapshots = [path for path in (self.attempts_snapshot, self.attempts_file) if path.exists()]
+        if snapshots:
+            # Switching formats leaves the other file behind; the newer one wins
+            path = max(snapshots, key=lambda p: p.stat().st_mtime)
             try:
-                with open(self.attempts_file, 'r') as f:
-                    return json.load(f)
+                if path == self.attempts_snapshot:
+                    attempts = CompactAttempts.load(path)
+                else:
+                    with open(path, 'r') as f:
+                        attempts = CompactAttempts.from_mapping(json.load(f))
             except Exception as e:
                 self.logger.error(f"Error loading login attempts: {e}")
-        return {}
+        
+        replayed = 0
+        try:
+            for record in self.attempts_journal.replay():
+                if self.apply_journal_record(attempts, record):
+                    replayed += 1
+        except Exception as e:
+            self.logger.error(f"Error replaying attempt journal: {e}")
+        
+        if replayed:
+            self.logger.info(f"Replayed {replayed} journaled attempts")
+        
+        self.merge_address_variants(attempts, self.merge_histories)
+        return attempts
+    
+    def merge_histories(self, history, other):
+        """Combine two attempt histories of one host in time order"""
+        total = sum(h[-1].get("attempt_number", len(h)) for h in (history, other) if h)
+        merged = sorted(history + other, key=lambda attempt: attempt.get("timestamp", ""))
+        # Renumber so the newest record carries the combined total
+        for number, attempt in enumerate(merged, total - len(merged) + 1):
+            attempt["attempt_number"] = number
+        self.trim_history(merged)
+        return merged
+    
+    def apply_journal_record(self, attempts, record):
+        """Apply one journal record to the attempt store (idempotent)"""
+        ip_address = record.get("ip")
+        if not ip_address:
+            return False
+        
+        # Records already captured by the snapshot are skipped
+        if attempts.last_attempt_number(ip_address) >= record["attempt_number"]:
+            return False
+        
+        attempts.append(ip_address, record, self.config.get('max_history_per_ip'))
+        if self.stats is not None:
+            self.stats.record(record["timestamp"], record["username"], record["status"],
+                              new_ip=record["attempt_number"] == 1)
+        return True
     
     def save_login_attempts(self):
-        """Save login attempts to file"""
+        """Write a full login attempts snapshot and compact the journal"""
+        if self.store is not None:
+            return  # SQLite views write through
         try:
-            with open(self.attempts_file, 'w') as f:
-                json.dump(self.login_attempts, f, indent=2)
+            if self.attempts_format == 'json':
+                write_snapshot(self.attempts_file, dict(self.login_attempts.items()))
+            else:
+                self.login_attempts.save(self.attempts_snapshot)
+            write_snapshot(self.stats_file, self.stats.to_dict())
+            self.attempts_journal.truncate()
         except Exception as e:
             self.logger.error(f"Error saving login attempts: {e}")
     
-    def log_attempt(self, ip_address, username="unknown", status="failed"):
-        """Log an access attempt"""
-        timestamp = datetime.now().isoformat()
+    def load_stats(self):
+        """Load the counter snapshot, or None if it has to be rebuilt"""
+        if self.store is not None:
+            data = self.store.get_meta("attempt_stats")
+            return AttemptStats.from_dict(data) if data is not None else None
         
-        if ip_address not in self.login_attempts:
-            self.login_attempts[ip_address] = []
+        if self.stats_file.exists():
+            try:
+                with open(self.stats_file, 'r') as f:
+                    return AttemptStats.from_dict(json.load(f))
+            except Exception as e:
+                self.logger.error(f"Error loading statistics: {e}")
+        return None
+    
+    def save_stats(self):
+        """Persist counters (JSON mode saves them with each attempt snapshot)"""
+        self.unsaved_stats = 0
+        if self.defer_save(self.save_stats):
+            return
+        if self.store is not None:
+            self.store.set_meta("attempt_stats", self.stats.to_dict())
+        else:
+            self.save_login_attempts()
+    
+    def log_attempt(self, ip_address, username="unknown", status="failed", when=None):
+        """Log an access attempt (when defaults to now)"""
+        self.expire_blocks()
+        return self.record_attempt(ip_address, username, status, when, announce=True)
+    
+    def log_attempts(self, attempts):
+        """Log many (ip, username, status, when) attempts as one batch
+        
+        Per-attempt and per-block logging drops to debug level; returns the
+        IPs this batch blocked. Rows are stored together when the batch ends,
+        or just before an auto-block, which reads the IP's attempt count.
+        """
+        auto_block = self.config['auto_block']
+        window_seconds = self.config.get('attempt_window_seconds')
+        windows = self.attempt_windows
+        numbers = {}
+        rows = []
+        count = 0
+        last_when = None
+        
+        with self.batch():
+            self.expire_blocks()
+            # Blocks made inside the batch queue up here until it ends
+            first_block = len(self.deferred_blocks)
+            for ip_address, username, status, when in attempts:
+                ip_address = normalize_ip(ip_address)
+                if when is None:
+                    when = datetime.now()
+                
+                window = windows.get(ip_address)
+                if window is None:
+                    window = self.get_attempt_window(ip_address)
+                number = numbers.get(ip_address)
+                if number is None:
+                    number = self.attempt_count(ip_address)
+                numbers[ip_address] = number = number + 1
+                
+                count += 1
+                if when is not last_when:
+                    # Log lines within one second share a parsed datetime
+                    last_when = when
+                    timestamp = when.isoformat()
+                    seconds = when.timestamp()
+                rows.append((ip_address, timestamp, username, status, number))
+                
+                if status != "success":
+                    window.append(seconds)
+                    # window_exceeded(), inlined for the per-line path
+                    if (auto_block and len(window) == window.maxlen
+                            and (not window_seconds or window[-1] - window[0] <= window_seconds)
+                            and ip_address not in self.blocked_ips):
+                        self.store_attempts(rows)
+                        rows = []
+                        self.block_ip(ip_address, reason="Too many failed attempts",
+                                      announce=False)
+            self.store_attempts(rows)
+            newly_blocked = self.deferred_blocks[first_block:]
         
+        if count:
+            self.logger.warning(
+                f"Recorded {count} access attempts - {len(newly_blocked)} IP(s) blocked"
+            )
+        return newly_blocked
+    
+    def record_attempt(self, ip_address, username="unknown", status="failed",
+                       when=None, announce=False):
+        """Record one attempt, updating the failure window and auto-blocking"""
+        ip_address = normalize_ip(ip_address)
+        if when is None:
+            when = datetime.now()
+        
+        # Seed the window before this attempt lands in the history
+        window = self.get_attempt_window(ip_address)
         attempt_record = {
-            "timestamp": timestamp,
+            "timestamp": when.isoformat(),
             "username": username,
             "status": status,
-            "attempt_number": len(self.login_attempts[ip_address]) + 1
+            "attempt_number": self.attempt_count(ip_address) + 1
         }
         
-        self.login_attempts[ip_address].append(attempt_record)
-        self.save_login_attempts()
+        self.store_attempt(ip_address, attempt_record)
         
-        self.logger.warning(
-            f"Access attempt from {ip_address} - User: {username} - "
-            f"Status: {status} - Attempt #{attempt_record['attempt_number']}"
-        )
+        if announce:
+            self.logger.warning(
+                f"Access attempt from {ip_address} - User: {username} - "
+                f"Status: {status} - Attempt #{attempt_record['attempt_number']}"
+            )
         
-        # Auto-block if threshold exceeded
-        if (self.config['auto_block'] and 
-            len(self.login_attempts[ip_address]) >= self.config['max_attempts']):
-            self.block_ip(ip_address, reason="Too many failed attempts")
+        # Auto-block if too many failures landed inside the window
+        if status != "success":
+            window.append(when.timestamp())
+            if (self.config['auto_block'] and self.window_exceeded(window)
+                    and ip_address not in self.blocked_ips):
+                self.block_ip(ip_address, reason="Too many failed attempts", announce=announce)
         
         return attempt_record
     
+    def import_attempts(self, histories, counts, stats_delta=None):
+        """Merge attempts parsed offline (e.g. a log backfill) with one write
+        
+        histories maps ip -> [(iso_timestamp, username, status), ...] oldest
+        first; counts maps ip -> total attempts those records stand for.
+        """
+        new_ips = 0
+        rows = []
+        
+        for ip_address, records in histories.items():
+            previous = self.attempt_count(ip_address)
+            if previous == 0:
+                new_ips += 1
+            number = previous + counts.get(ip_address, len(records)) - len(records)
+            self.attempt_windows.pop(ip_address, None)
+            
+            for timestamp, username, status in records:
+                number += 1
+                rows.append((ip_address, timestamp, username, status, number))
+        
+        self.login_attempts.append_many(rows, self.config.get('max_history_per_ip'))
+        
+        if stats_delta is not None:
+            stats_delta.unique_ips = new_ips
+            self.stats.merge(stats_delta)
+        # Imported rows bypass the journal, so JSON mode needs a fresh snapshot
+        self.save_stats()
+        return len(rows)
+    
+    def store_attempt(self, ip_address, attempt_record):
+        """Persist one attempt record in the configured storage"""
+        self.stats.record(
+            attempt_record["timestamp"], attempt_record["username"],
+            attempt_record["status"], new_ip=attempt_record["attempt_number"] == 1
+        )
+        
+        if self.store is not None:
+            # Inside a batch the store holds the commit until the batch ends
+            self.store.attempts.append(
+                ip_address, attempt_record, self.config.get('max_history_per_ip')
+            )
+            self.unsaved_stats += 1
+            if self.unsaved_stats >= self.snapshot_every:
+                self.save_stats()
+            return
+        
+        self.login_attempts.append(ip_address, attempt_record, self.config.get('max_history_per_ip'))
+        self.journal_attempt(ip_address, attempt_record)
+    
+    def store_attempts(self, rows):
+        """Persist (ip, timestamp, username, status, attempt_number) rows together"""
+        if not rows:
+            return
+        self.stats.record_many(rows)
+        self.login_attempts.append_many(rows, self.config.get('max_history_per_ip'))
+        
+        if self.store is not None:
+            self.unsaved_stats += len(rows)
+            if self.unsaved_stats >= self.snapshot_every:
+                self.save_stats()
+            return
+        
+        if not self.journal_enabled:
+            self.save_login_attempts()
+            return
+        self.pending_journal.extend(journal_line(*row) for row in rows)
+        if not self.defer_save(self.flush_journal):
+            self.flush_journal()
+    
+    def attempt_count(self, ip_address):
+        """Total attempts ever recorded for an IP (survives history trimming)"""
+        return self.login_attempts.last_attempt_number(ip_address)
+    
+    def trim_history(self, history):
+        """Keep only the most recent attempts for an IP"""
+        max_history = self.config.get('max_history_per_ip')
+        if max_history and len(history) > max_history:
+            del history[:len(history) - max_history]
+    
+    def get_attempt_window(self, ip_address):
+        """Ring buffer of the last max_attempts failure times for an IP"""
+        window = self.attempt_windows.get(ip_address)
+        if window is None:
+            window = deque(maxlen=max(1, self.config['max_attempts']))
+            # Seed from persisted history the first time this IP is seen
+            for attempt in self.login_attempts.get(ip_address, [])[-window.maxlen:]:
+                if attempt.get("status") == "success":
+                    continue
+                try:
+                    window.append(datetime.fromisoformat(attempt["timestamp"]).timestamp())
+                except (KeyError, ValueError):
+                    continue
+            self.attempt_windows[ip_address] = window
+        return window
+    
+    def window_exceeded(self, window):
+        """True when max_attempts failures fall within attempt_window_seconds"""
+        if len(window) < window.maxlen:
+            return False
+        window_seconds = self.config.get('attempt_window_seconds')
+        if not window_seconds:
+            return True
+        return window[-1] - window[0] <= window_seconds
+    
+    def clear_attempts(self, ip_address):
+        """Forget recorded attempts for an IP, returning how many were cleared"""
+        ip_address = stored_key(ip_address)
+        self.attempt_windows.pop(ip_address, None)
+        if ip_address not in self.login_attempts:
+            return 0
+        cleared = self.attempt_count(ip_address)
+        history = self.login_attempts[ip_address]
+        del self.login_attempts[ip_address]
+        self.stats.forget_ip(cleared, history)
+        self.save_stats()
+        return cleared
+    
+    def clear_attempts_many(self, ip_addresses):
+        """Forget attempts for several IPs with one write; returns the total cleared"""
+        with self.batch():
+            return sum(self.clear_attempts(ip_address) for ip_address in ip_addresses)
+    
+    def journal_attempt(self, ip_address, attempt_record):
+        """Append an attempt to the journal, snapshotting periodically"""
+        if not self.journal_enabled:
+            self.save_login_attempts()
+            return
+        
+        if self.batch_depth:
+            self.pending_journal.append(journal_line(
+                ip_address, attempt_record["timestamp"], attempt_record["username"],
+                attempt_record["status"], attempt_record["attempt_number"]
+            ))
+            self.defer_save(self.flush_journal)
+            return
+        
+        try:
+            self.attempts_journal.append({"ip": ip_address, **attempt_record})
+        except Exception as e:
+            self.logger.error(f"Error writing attempt journal: {e}")
+            self.save_login_attempts()
+            return
+        
+        if self.attempts_journal.pending_records >= self.snapshot_every:
+            self.save_login_attempts()
+    
+    def flush_journal(self):
+        """Write journal records buffered during a batch in one append"""
+        lines, self.pending_journal = self.pending_journal, []
+        try:
+            self.attempts_journal.append_lines(lines)
+        except Exception as e:
+            self.logger.error(f"Error writing attempt journal: {e}")
+            self.save_login_attempts()
+            return
+        
+        if self.attempts_journal.pending_records >= self.snapshot_every:
+            self.save_login_attempts()
+    
     def block_ip_windows(self, ip_address, rule_name):
         """Block IP using Windows Firewall"""
         try:
@@ -164,72 +679,255 @@ class SecurityMonitor:
             self.logger.error(f"Error blocking IP with Windows Firewall: {e}")
             return False
     
-    def block_ip_unix(self, ip_address):
+    def block_ip_unix(self, ip_address, announce=True):
         """Block IP using iptables/pfctl (Linux/macOS)"""
+        log = self.logger.info if announce else self.logger.debug
         try:
             # Create a firewall rules file
             if sys.platform == 'darwin':  # macOS
                 pf_rules_file = self.log_dir / "blocked_ips.pf"
                 with open(pf_rules_file, 'a') as f:
                     f.write(f"block drop from {ip_address} to any\n")
-                self.logger.info(f"To activate: sudo pfctl -f {pf_rules_file}")
+                log(f"To activate: sudo pfctl -f {pf_rules_file}")
             else:  # Linux
                 # iptables command
                 cmd = ['iptables', '-A', 'INPUT', '-s', ip_address, '-j', 'DROP']
-                self.logger.info(f"To block: sudo {' '.join(cmd)}")
+                log(f"To block: sudo {' '.join(cmd)}")
             
             return True
         except Exception as e:
             self.logger.error(f"Error creating firewall rule: {e}")
             return False
     
-    def block_ip(self, ip_address, reason="Unauthorized access attempt"):
-        """Block an IP address using OS-appropriate firewall"""
+    def compile_whitelist(self):
+        """Build the whitelist trie from whitelist_ips, skipping bad entries"""
+        whitelist = PrefixTrie()
+        for entry in self.config.get('whitelist_ips', []):
+            try:
+                whitelist.add(entry)
+            except ValueError:
+                self.logger.warning(f"Ignoring invalid whitelist entry: {entry}")
+        return whitelist
+    
+    def is_whitelisted(self, ip_address):
+        """True for whitelisted addresses and for ranges overlapping the whitelist"""
+        if '/' in ip_address:
+            try:
+                return self.whitelist.overlaps(ip_address)
+            except ValueError:
+                return False
+        return ip_address in self.whitelist
+    
+    def block_ip(self, ip_address, reason="Unauthorized access attempt", duration_minutes=None,
+                 announce=True, feed=None):
+        """Block an IP address (or CIDR range) using OS-appropriate firewall
+        
+        duration_minutes overrides block_duration_minutes for this block;
+        0 makes it permanent. Repeat offenders get escalating durations.
+        Bulk callers pass announce=False to log per-IP detail at debug level.
+        feed tags the block with the threat feed that imported it.
+        """
+        log = self.logger.info if announce else self.logger.debug
+        ip_address = normalize_ip(ip_address)
+        
         # Check whitelist
-        if ip_address in self.config.get('whitelist_ips', []):
-            self.logger.info(f"IP {ip_address} is whitelisted, not blocking")
+        if self.is_whitelisted(ip_address):
+            log(f"IP {ip_address} is whitelisted, not blocking")
             return False
         
         if ip_address in self.blocked_ips:
-            self.logger.info(f"IP {ip_address} is already blocked")
+            log(f"IP {ip_address} is already blocked")
             return False
         
-        timestamp = datetime.now().isoformat()
+        now = datetime.now()
+        offense = self.block_offenses.get(ip_address, 0) + 1
+        self.block_offenses[ip_address] = offense
+        self.journal_offense(ip_address)
+        
+        duration = self.block_duration(offense, duration_minutes)
+        expires_at = now + timedelta(minutes=duration) if duration else None
         
         # Add to blocked list
-        self.blocked_ips[ip_address] = {
-            "blocked_at": timestamp,
+        record = {
+            "blocked_at": now.isoformat(),
             "reason": reason,
-            "attempts": len(self.login_attempts.get(ip_address, [])),
-            "method": "windows_firewall" if self.is_windows else "unix_firewall"
+            "attempts": self.attempt_count(ip_address),
+            "method": self.firewall_method(),
+            "expires_at": expires_at.isoformat() if expires_at else None,
+            "offense": offense
         }
+        if feed:
+            record["feed"] = feed
+        self.blocked_ips[ip_address] = record
+        if expires_at:
+            self.expiry.schedule(ip_address, expires_at.timestamp())
         
         self.save_blocked_ips()
         
         # Block using appropriate method
-        if self.is_windows:
-            rule_name = f"IPTrack_Block_{ip_address.replace('.', '_')}"
-            self.block_ip_windows(ip_address, rule_name)
+        if self.batch_depth:
+            self.deferred_blocks.append(ip_address)
         else:
-            self.block_ip_unix(ip_address)
+            self.add_firewall_rules([ip_address])
         
-        self.logger.critical(
+        (self.logger.critical if announce else self.logger.debug)(
             f"🚫 BLOCKED IP: {ip_address} - Reason: {reason} - "
-            f"Attempts: {self.blocked_ips[ip_address]['attempts']}"
+            f"Attempts: {record['attempts']}"
         )
         
         return True
     
+    def block_ips(self, ip_addresses, reason="Unauthorized access attempt", duration_minutes=None,
+                  feed=None):
+        """Block several IPs with one state write and one firewall update
+        
+        Logs a single summary line instead of one line per IP.
+        """
+        blocked = []
+        invalid = 0
+        with self.batch():
+            for ip_address in ip_addresses:
+                try:
+                    if self.block_ip(ip_address, reason, duration_minutes, announce=False, feed=feed):
+                        blocked.append(ip_address)
+                except ValueError:
+                    invalid += 1
+        if invalid:
+            self.logger.warning(f"Skipped {invalid} invalid addresses")
+        if blocked:
+            self.logger.critical(f"🚫 BLOCKED {len(blocked)} IPs - Reason: {reason}")
+        return blocked
+    
+    def create_aggregator(self):
+        """Prefix aggregation of enforced blocks (firewall.aggregate), or None"""
+        aggregate = self.config.get('firewall', {}).get('aggregate', {})
+        if not aggregate.get('enabled'):
+            return None
+        aggregator = BlockAggregator(
+            self.log_dir / "firewall_prefixes.json", self.logger,
+            escalate_threshold=aggregate.get('escalate_threshold'),
+            escalate_prefix_v4=aggregate.get('escalate_prefix_v4', 24),
+            escalate_prefix_v6=aggregate.get('escalate_prefix_v6', 64),
+            whitelist=self.whitelist,
+            snapshot_every=self.snapshot_every
+        )
+        blocked = list(self.blocked_ips.keys())
+        # Without saved state the firewall holds one entry per blocked IP
+        aggregator.load_state(blocked)
+        aggregator.track(blocked)
+        return aggregator
+    
+    def enforced_addresses(self):
+        """Addresses and prefixes the firewall should currently hold"""
+        if self.aggregator is not None:
+            return sorted(self.aggregator.emitted)
+        return list(self.blocked_ips)
+    
+    def sync_firewall(self, ip_addresses):
+        """Emit only the prefixes changed by blocking or unblocking these IPs"""
+        changes = {ip: ip in self.blocked_ips for ip in ip_addresses}
+        additions, removals = self.aggregator.update(changes)
+        if removals:
+            self.apply_firewall_removals(removals)
+        if additions:
+            self.apply_firewall_additions(additions)
+        if additions or removals:
+            self.logger.info(
+                f"Firewall prefixes: +{len(additions)} -{len(removals)} "
+                f"({len(self.aggregator.emitted)} enforced for {len(self.blocked_ips)} IPs)"
+            )
+    
+    def add_firewall_rules(self, ip_addresses):
+        """Enforce blocks for the given IPs"""
+        if self.aggregator is not None:
+            self.sync_firewall(ip_addresses)
+        else:
+            self.apply_firewall_additions(ip_addresses)
+    
+    def apply_firewall_additions(self, ip_addresses):
+        """Add enforcement for addresses or prefixes"""
+        if self.firewall is not None:
+            self.firewall.block(ip_addresses)
+        elif self.is_windows:
+            for ip_address in ip_addresses:
+                self.block_ip_windows(ip_address, self.rule_name(ip_address))
+        else:
+            announce = len(ip_addresses) == 1
+            for ip_address in ip_addresses:
+                self.block_ip_unix(ip_address, announce)
+            if not announce:
+                self.logger.info(f"Prepared firewall rules for {len(ip_addresses)} IPs")
+    
+    def block_duration(self, offense, duration_minutes=None):
+        """Minutes to block for, escalating for repeat offenders (None = forever)"""
+        base = duration_minutes
+        if base is None:
+            base = self.config.get('block_duration_minutes')
+        if not base:
+            return None
+        
+        escalation = self.config.get('block_escalation', {})
+        if escalation.get('enabled') and offense > 1:
+            base = base * escalation.get('multiplier', 2) ** (offense - 1)
+            max_minutes = escalation.get('max_duration_minutes')
+            if max_minutes:
+                base = min(base, max_minutes)
+        return base
+    
+    def expire_blocks(self, now=None):
+        """Unblock every IP whose block has expired, in one batch"""
+        now = time.time() if now is None else now
+        if not self.expiry.is_due(now):
+            return []
+        
+        due = [ip for ip in self.expiry.pop_due(now) if ip in self.blocked_ips]
+        if due:
+            self.logger.info(f"⏰ {len(due)} block(s) expired")
+            self.unblock_ips(due)
+        return due
+    
+    def unblock_ips(self, ip_addresses):
+        """Unblock several IPs with one state write and one firewall update
+        
+        Logs a single summary line instead of one line per IP.
+        """
+        ip_addresses = list(dict.fromkeys(stored_key(ip) for ip in ip_addresses))
+        with self.batch():
+            if self.store is not None:
+                # One DELETE per chunk of IPs instead of one per IP
+                removed = self.blocked_ips.pop_many(ip_addresses)
+            else:
+                removed = {ip: self.blocked_ips.pop(ip)['blocked_at'] for ip in ip_addresses
+                           if ip in self.blocked_ips}
+            for ip_address, blocked_at in removed.items():
+                self.release_block(ip_address, blocked_at, self.logger.debug)
+        unblocked = [ip for ip in ip_addresses if ip in removed]
+        if unblocked:
+            self.logger.info(f"✅ UNBLOCKED {len(unblocked)} IPs")
+        return unblocked
+    
+    def firewall_method(self):
+        """Name of the enforcement method recorded with each block"""
+        if self.firewall is not None:
+            return self.firewall.method
+        return "windows_firewall" if self.is_windows else "unix_firewall"
+    
+    def rule_name(self, ip_address):
+        """Windows Firewall rule name for an address or range"""
+        return per_ip_rule_name(ip_address)
+    
     def unblock_ip_windows(self, ip_address):
         """Unblock IP on Windows"""
         try:
-            rule_name = f"IPTrack_Block_{ip_address.replace('.', '_')}"
-            cmd = [
-                'netsh', 'advfirewall', 'firewall', 'delete', 'rule',
-                f'name={rule_name}'
-            ]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True, check=False)
+            # IPv6 rules created before names were sanitized use the legacy name
+            for rule_name in per_ip_rule_names(ip_address):
+                cmd = [
+                    'netsh', 'advfirewall', 'firewall', 'delete', 'rule',
+                    f'name={rule_name}'
+                ]
+                result = subprocess.run(cmd, capture_output=True, text=True, check=False)
+                if result.returncode == 0:
+                    break
             
             if result.returncode == 0:
                 self.logger.info(f"Windows Firewall rule removed for {ip_address}")
@@ -242,57 +940,97 @@ class SecurityMonitor:
             self.logger.error(f"Error unblocking IP: {e}")
             return False
     
-    def unblock_ip(self, ip_address):
-        """Unblock an IP address"""
-        if ip_address not in self.blocked_ips:
-            self.logger.info(f"IP {ip_address} is not blocked")
-            return False
+    def unblock_ip(self, ip_address, announce=True):
+        """Unblock an IP address (announce=False logs at debug level)"""
+        log = self.logger.info if announce else self.logger.debug
+        ip_address = stored_key(ip_address)
         
-        # Remove from blocked list
-        blocked_info = self.blocked_ips.pop(ip_address)
+        # Remove from blocked list (one lookup, so SQLite mode runs a single statement)
+        blocked_info = self.blocked_ips.pop(ip_address, None)
+        if blocked_info is None:
+            log(f"IP {ip_address} is not blocked")
+            return False
+        self.release_block(ip_address, blocked_info['blocked_at'], log)
+        return True
+    
+    def release_block(self, ip_address, blocked_at, log):
+        """Finish unblocking an IP already removed from blocked_ips"""
+        self.expiry.cancel(ip_address)
         self.save_blocked_ips()
         
-        # Remove firewall rule if Windows
-        if self.is_windows:
-            self.unblock_ip_windows(ip_address)
+        if self.batch_depth:
+            self.deferred_unblocks.append(ip_address)
+        else:
+            self.remove_firewall_rules([ip_address])
+        
+        log(f"✅ UNBLOCKED IP: {ip_address} - Was blocked at: {blocked_at}")
+    
+    def remove_firewall_rules(self, ip_addresses):
+        """Remove firewall enforcement for the given IPs"""
+        if self.aggregator is not None:
+            self.sync_firewall(ip_addresses)
         else:
-            # For Unix, rebuild rules file
+            self.apply_firewall_removals(ip_addresses)
+    
+    def apply_firewall_removals(self, ip_addresses):
+        """Remove enforcement for addresses or prefixes"""
+        if self.firewall is not None:
+            self.firewall.unblock(ip_addresses)
+        elif self.is_windows:
+            for ip_address in ip_addresses:
+                self.unblock_ip_windows(ip_address)
+        else:
+            # For Unix, rebuild rules file once for the whole set
             pf_rules_file = self.log_dir / "blocked_ips.pf"
             if pf_rules_file.exists():
+                removed = set(ip_addresses)
                 with open(pf_rules_file, 'r') as f:
                     rules = f.readlines()
                 
                 with open(pf_rules_file, 'w') as f:
                     for rule in rules:
-                        if ip_address not in rule:
+                        parts = rule.split()
+                        if len(parts) < 4 or parts[3] not in removed:
                             f.write(rule)
-        
-        self.logger.info(
-            f"✅ UNBLOCKED IP: {ip_address} - Was blocked at: {blocked_info['blocked_at']}"
-        )
-        
-        return True
     
     def get_blocked_ips(self):
         """Get list of all blocked IPs"""
         return self.blocked_ips
     
     def get_statistics(self):
-        """Get security statistics"""
-        total_attempts = sum(len(attempts) for attempts in self.login_attempts.values())
-        unique_ips = len(self.login_attempts)
+        """Get security statistics from the running counters"""
         blocked_count = len(self.blocked_ips)
         
         stats = {
-            "total_attempts": total_attempts,
-            "unique_ips_attempted": unique_ips,
+            "total_attempts": self.stats.total_attempts,
+            "unique_ips_attempted": self.stats.unique_ips,
             "blocked_ips_count": blocked_count,
-            "blocked_ips": list(self.blocked_ips.keys()),
+            "blocked_ips": list(self.blocked_ips),
+            "attempts_by_status": dict(self.stats.by_status),
+            "top_usernames": dict(self.stats.by_username.most_common(10)),
+            "attempts_per_minute": self.stats.recent_minutes(),
             "platform": platform.system()
         }
         
         return stats
     
+    def migrate_to_sqlite(self):
+        """Copy the JSON attempt and block files into the SQLite store"""
+        store = self.store
+        if store is None:
+            storage = self.config.get('storage', {})
+            store = SQLiteStore(self.log_dir / storage.get('sqlite_path', 'iptrack.db'))
+        
+        migrated = {
+            "attempts": store.import_attempts(self.load_login_attempts_file()),
+            "blocked_ips": store.import_rows(store.blocks, self.load_blocked_ips_json())
+        }
+        self.logger.info(
+            f"Migrated {migrated['attempts']} attempts and "
+            f"{migrated['blocked_ips']} blocked IPs to {store.db_path}"
+        )
+        return migrated, store
+    
     def simulate_attack(self, ip_address, username="attacker", attempts=5):
         """Simulate an attack for testing purposes"""
         self.logger.info(f"🔴 Simulating attack from {ip_address}")
@@ -303,9 +1041,29 @@ class SecurityMonitor:
         return self.get_statistics()
 
 
+def journal_line(ip_address, timestamp, username, status, attempt_number):
+    """Compact JSON journal line for an attempt, several times faster than json.dumps"""
+    if not isinstance(username, str) or not isinstance(status, str):
+        return json.dumps({
+            "ip": ip_address, "timestamp": timestamp, "username": username,
+            "status": status, "attempt_number": attempt_number
+        }, separators=(',', ':'))
+    return (
+        f'{{"ip":{encode_basestring_ascii(ip_address)},'
+        f'"timestamp":"{timestamp}",'
+        f'"username":{encode_basestring_ascii(username)},'
+        f'"status":{encode_basestring_ascii(status)},'
+        f'"attempt_number":{attempt_number}}}'
+    )
+
+
 def main():
     """Main function for CLI usage"""
-    monitor = SecurityMonitor()
+    from iptrack_daemon import DaemonMonitor, running_daemon
+    
+    # A running daemon owns the state; changes made here would be overwritten
+    client = running_daemon()
+    monitor = DaemonMonitor(client) if client is not None else SecurityMonitor()
     
     if len(sys.argv) < 2:
         print("Usage:")
@@ -313,12 +1071,20 @@ def main():
         print("  python security_monitor_windows.py block <ip> - Block an IP")
         print("  python security_monitor_windows.py unblock <ip> - Unblock an IP")
         print("  python security_monitor_windows.py list - List blocked IPs")
+        print("  python security_monitor_windows.py expire - Unblock expired blocks")
         print("  python security_monitor_windows.py stats - Show statistics")
         print("  python security_monitor_windows.py simulate <ip> - Simulate attack")
         return
     
     command = sys.argv[1]
     
+    if command in ("log", "block", "simulate") and len(sys.argv) >= 3:
+        try:
+            normalize_ip(sys.argv[2])
+        except ValueError as e:
+            print(f"❌ {e}")
+            return
+    
     if command == "log" and len(sys.argv) >= 3:
         ip = sys.argv[2]
         username = sys.argv[3] if len(sys.argv) > 3 else "unknown"
@@ -337,6 +1103,10 @@ def main():
         print("\n🚫 Blocked IPs:")
         print(json.dumps(blocked, indent=2))
     
+    elif command == "expire":
+        expired = monitor.expire_blocks()
+        print(f"\n⏰ Expired blocks: {json.dumps(expired)}")
+    
     elif command == "stats":
         stats = monitor.get_statistics()
         print("\n📊 Security Statistics:")
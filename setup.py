@@ -26,6 +26,22 @@ setup(
     py_modules=[
         'iptrack',
         'security_monitor',
+        'journal',
+        'firewall_backends',
+        'sqlite_store',
+        'ip_networks',
+        'block_aggregator',
+        'attempt_stats',
+        'attempt_store',
+        'block_expiry',
+        'iptrack_daemon',
+        'auth_log_ingest',
+        'log_backfill',
+        'threat_feeds',
+        'geo_database',
+        'location_cache',
+        'circuit_breaker',
+        'rate_limiter',
         'ip_locator',
         'defender_control',
         'quick_start'
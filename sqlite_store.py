@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+SQLite Storage Engine
+Optional indexed storage for attempts, blocks and geolocation cache (WAL mode)
+"""
+
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from collections.abc import MutableMapping
+from pathlib import Path
+from ip_networks import stored_key
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS attempts (
+    id INTEGER PRIMARY KEY,
+    ip TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    username TEXT,
+    status TEXT,
+    attempt_number INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_attempts_ip ON attempts (ip, id);
+CREATE INDEX IF NOT EXISTS idx_attempts_timestamp ON attempts (timestamp);
+CREATE INDEX IF NOT EXISTS idx_attempts_username ON attempts (username);
+
+CREATE TABLE IF NOT EXISTS blocks (
+    ip TEXT PRIMARY KEY,
+    blocked_at TEXT,
+    reason TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_blocks_blocked_at ON blocks (blocked_at);
+
+CREATE TABLE IF NOT EXISTS locations (
+    ip TEXT PRIMARY KEY,
+    queried_at TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_locations_queried_at ON locations (queried_at);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Bumped when stored ip keys need rewriting (1 = ip_networks.normalize_ip form)
+ADDRESS_FORMAT = 1
+
+
+class SQLiteStore:
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self.lock = threading.RLock()
+        # While above zero, view writes stay in the open transaction (see hold_commits)
+        self.held = 0
+        self.conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+        self.attempts = AttemptsView(self)
+        self.blocks = JSONRowView(self, "blocks", "blocked_at")
+        self.locations = JSONRowView(self, "locations", "queried_at")
+
+        if self.get_meta("address_format") != ADDRESS_FORMAT:
+            self.normalize_addresses()
+
+    def execute(self, sql, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params)
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+
+    def written(self):
+        """Commit a view write, unless a batch is holding commits"""
+        with self.lock:
+            if not self.held:
+                self.conn.commit()
+
+    @contextmanager
+    def hold_commits(self):
+        """Keep every write made inside the block in one transaction"""
+        with self.lock:
+            self.held += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self.held -= 1
+                if not self.held:
+                    self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def get_meta(self, key, default=None):
+        rows = self.query("SELECT value FROM meta WHERE key = ?", (key,))
+        return json.loads(rows[0][0]) if rows else default
+
+    def set_meta(self, key, value):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                (key, json.dumps(value))
+            )
+            self.written()
+
+    def normalize_addresses(self):
+        """Rewrite ip keys to their canonical form, folding spelling variants together
+
+        Where a variant collides with an existing canonical block or location
+        row, the canonical row is kept.
+        """
+        with self.lock:
+            self.conn.create_function("normalize_ip", 1, stored_key)
+            changed = self.conn.execute(
+                "UPDATE attempts SET ip = normalize_ip(ip) WHERE ip != normalize_ip(ip)"
+            ).rowcount
+            for table in ("blocks", "locations"):
+                changed += self.conn.execute(
+                    f"UPDATE OR IGNORE {table} SET ip = normalize_ip(ip) "
+                    "WHERE ip != normalize_ip(ip)"
+                ).rowcount
+                self.conn.execute(f"DELETE FROM {table} WHERE ip != normalize_ip(ip)")
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                ("address_format", json.dumps(ADDRESS_FORMAT))
+            )
+            self.conn.commit()
+        return changed
+
+    def import_attempts(self, login_attempts):
+        """Bulk-load a dict of attempt lists (used by the JSON migration)"""
+        rows = [
+            (ip, a["timestamp"], a.get("username"), a.get("status"),
+             a.get("attempt_number", i))
+            for ip, attempts in login_attempts.items()
+            for i, a in enumerate(attempts, 1)
+        ]
+        with self.lock:
+            # Re-running a migration replaces rather than duplicates history
+            self.conn.executemany(
+                "DELETE FROM attempts WHERE ip = ?", [(ip,) for ip in login_attempts]
+            )
+            self.conn.executemany(
+                "INSERT INTO attempts (ip, timestamp, username, status, attempt_number) "
+                "VALUES (?, ?, ?, ?, ?)", rows
+            )
+            self.conn.commit()
+        return len(rows)
+
+    def import_rows(self, view, records):
+        """Bulk-load a dict of JSON records into a blocks/locations view"""
+        with self.lock:
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO {view.table} (ip, {view.time_column}, data) "
+                "VALUES (?, ?, ?)",
+                [(ip, r.get(view.time_column), json.dumps(r)) for ip, r in records.items()]
+            )
+            self.conn.commit()
+        return len(records)
+
+
+class AttemptsView(MutableMapping):
+    """Dict-of-lists view over the attempts table, queried by indexed ip"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def __getitem__(self, ip_address):
+        rows = self.store.query(
+            "SELECT timestamp, username, status, attempt_number FROM attempts "
+            "WHERE ip = ? ORDER BY id", (ip_address,)
+        )
+        if not rows:
+            raise KeyError(ip_address)
+        return [self.row_to_dict(row) for row in rows]
+
+    def __setitem__(self, ip_address, attempts):
+        with self.store.lock:
+            self.store.conn.execute("DELETE FROM attempts WHERE ip = ?", (ip_address,))
+            self.store.conn.executemany(
+                "INSERT INTO attempts (ip, timestamp, username, status, attempt_number) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(ip_address, a["timestamp"], a.get("username"), a.get("status"),
+                  a.get("attempt_number", i)) for i, a in enumerate(attempts, 1)]
+            )
+            self.store.written()
+
+    def __delitem__(self, ip_address):
+        with self.store.lock:
+            cursor = self.store.conn.execute("DELETE FROM attempts WHERE ip = ?", (ip_address,))
+            self.store.written()
+        if cursor.rowcount == 0:
+            raise KeyError(ip_address)
+
+    def __contains__(self, ip_address):
+        return bool(self.store.query(
+            "SELECT 1 FROM attempts WHERE ip = ? LIMIT 1", (ip_address,)
+        ))
+
+    def __iter__(self):
+        return iter([row[0] for row in self.store.query("SELECT DISTINCT ip FROM attempts")])
+
+    def __len__(self):
+        return self.store.query("SELECT COUNT(DISTINCT ip) FROM attempts")[0][0]
+
+    def items(self):
+        grouped = {}
+        for row in self.store.query(
+            "SELECT ip, timestamp, username, status, attempt_number FROM attempts ORDER BY id"
+        ):
+            grouped.setdefault(row[0], []).append(self.row_to_dict(row[1:]))
+        return list(grouped.items())
+
+    def clear(self):
+        with self.store.lock:
+            self.store.conn.execute("DELETE FROM attempts")
+            self.store.written()
+
+    def append(self, ip_address, record, max_history=None, commit=True):
+        """Insert one attempt, trimming the IP's history to max_history rows"""
+        with self.store.lock:
+            self.store.conn.execute(
+                "INSERT INTO attempts (ip, timestamp, username, status, attempt_number) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (ip_address, record["timestamp"], record["username"],
+                 record["status"], record["attempt_number"])
+            )
+            if max_history:
+                self.store.conn.execute(
+                    "DELETE FROM attempts WHERE ip = ? AND id <= ("
+                    "SELECT id FROM attempts WHERE ip = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                    (ip_address, ip_address, max_history)
+                )
+            if commit:
+                self.store.written()
+
+    def append_many(self, rows, max_history=None):
+        """Insert (ip, timestamp, username, status, attempt_number) rows in one transaction"""
+        with self.store.lock:
+            self.store.conn.executemany(
+                "INSERT INTO attempts (ip, timestamp, username, status, attempt_number) "
+                "VALUES (?, ?, ?, ?, ?)", rows
+            )
+            if max_history:
+                self.store.conn.executemany(
+                    "DELETE FROM attempts WHERE ip = ? AND id <= ("
+                    "SELECT id FROM attempts WHERE ip = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                    [(ip, ip, max_history) for ip in {row[0] for row in rows}]
+                )
+            self.store.written()
+    
+    def last_attempt_number(self, ip_address):
+        rows = self.store.query(
+            "SELECT attempt_number FROM attempts WHERE ip = ? ORDER BY id DESC LIMIT 1",
+            (ip_address,)
+        )
+        return rows[0][0] if rows else 0
+
+    @staticmethod
+    def row_to_dict(row):
+        return {
+            "timestamp": row[0],
+            "username": row[1],
+            "status": row[2],
+            "attempt_number": row[3]
+        }
+
+
+class JSONRowView(MutableMapping):
+    """Write-through dict view over a table of ip -> JSON record rows"""
+
+    def __init__(self, store, table, time_column):
+        self.store = store
+        self.table = table
+        self.time_column = time_column
+
+    def __getitem__(self, ip_address):
+        rows = self.store.query(f"SELECT data FROM {self.table} WHERE ip = ?", (ip_address,))
+        if not rows:
+            raise KeyError(ip_address)
+        return json.loads(rows[0][0])
+
+    def __setitem__(self, ip_address, record):
+        with self.store.lock:
+            self.store.conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (ip, {self.time_column}, data) "
+                "VALUES (?, ?, ?)",
+                (ip_address, record.get(self.time_column), json.dumps(record))
+            )
+            self.store.written()
+
+    def __delitem__(self, ip_address):
+        with self.store.lock:
+            cursor = self.store.conn.execute(
+                f"DELETE FROM {self.table} WHERE ip = ?", (ip_address,)
+            )
+            self.store.written()
+        if cursor.rowcount == 0:
+            raise KeyError(ip_address)
+
+    def pop(self, ip_address, *default):
+        """Remove and return a record with one statement instead of a read plus a delete"""
+        if sqlite3.sqlite_version_info < (3, 35, 0):
+            return super().pop(ip_address, *default)
+        with self.store.lock:
+            rows = self.store.conn.execute(
+                f"DELETE FROM {self.table} WHERE ip = ? RETURNING data", (ip_address,)
+            ).fetchall()
+            self.store.written()
+        if rows:
+            return json.loads(rows[0][0])
+        if default:
+            return default[0]
+        raise KeyError(ip_address)
+
+    def pop_many(self, ip_addresses, chunk_size=500):
+        """Remove the rows present for these ips; returns ip -> time column value
+
+        Reads back only the indexed time column, so bulk removals skip
+        decoding every JSON record.
+        """
+        ip_addresses = list(ip_addresses)
+        removed = {}
+        with self.store.lock:
+            for start in range(0, len(ip_addresses), chunk_size):
+                chunk = ip_addresses[start:start + chunk_size]
+                marks = ','.join('?' * len(chunk))
+                if sqlite3.sqlite_version_info < (3, 35, 0):
+                    removed.update(self.store.conn.execute(
+                        f"SELECT ip, {self.time_column} FROM {self.table} WHERE ip IN ({marks})",
+                        chunk
+                    ).fetchall())
+                    self.store.conn.execute(
+                        f"DELETE FROM {self.table} WHERE ip IN ({marks})", chunk
+                    )
+                else:
+                    removed.update(self.store.conn.execute(
+                        f"DELETE FROM {self.table} WHERE ip IN ({marks}) "
+                        f"RETURNING ip, {self.time_column}", chunk
+                    ).fetchall())
+            self.store.written()
+        return removed
+
+    def __contains__(self, ip_address):
+        return bool(self.store.query(
+            f"SELECT 1 FROM {self.table} WHERE ip = ?", (ip_address,)
+        ))
+
+    def __iter__(self):
+        return iter([row[0] for row in self.store.query(
+            f"SELECT ip FROM {self.table} ORDER BY {self.time_column}"
+        )])
+
+    def __len__(self):
+        return self.store.query(f"SELECT COUNT(*) FROM {self.table}")[0][0]
+
+    def items(self):
+        return [(ip, json.loads(data)) for ip, data in self.store.query(
+            f"SELECT ip, data FROM {self.table} ORDER BY {self.time_column}"
+        )]
+
+    def values(self):
+        return [record for _, record in self.items()]
+
+    def clear(self):
+        with self.store.lock:
+            self.store.conn.execute(f"DELETE FROM {self.table}")
+            self.store.written()
+
+
+def open_store(config, log_dir):
+    """Open the SQLite store when storage.backend is sqlite, else None"""
+    storage = config.get('storage', {})
+    if storage.get('backend', 'json') != 'sqlite':
+        return None
+    return SQLiteStore(Path(log_dir) / storage.get('sqlite_path', 'iptrack.db'))
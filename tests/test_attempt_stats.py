@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+Attempt statistics tests: per-minute buckets follow the clock, not the
+order events were recorded in
+"""
+
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from attempt_stats import AttemptStats
+
+
+class AttemptStatsTest(unittest.TestCase):
+    def test_late_events_land_in_minute_order(self):
+        stats = AttemptStats(retention_minutes=3)
+        for minute in ("10:04", "10:05", "10:01", "10:03"):
+            stats.record(f"2026-10-15T{minute}:00", "root", "failed")
+        stats.record_many([("192.0.2.1", "2026-10-15T10:02:30", "root", "failed", 1)])
+
+        self.assertEqual(stats.recent_minutes(2),
+                         {"2026-10-15T10:04": 1, "2026-10-15T10:05": 1})
+        # Retention drops the oldest minutes, whenever they arrived
+        self.assertEqual(list(stats.per_minute),
+                         ["2026-10-15T10:03", "2026-10-15T10:04", "2026-10-15T10:05"])
+
+
+if __name__ == "__main__":
+    unittest.main()
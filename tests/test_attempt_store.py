@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Compact attempt store tests: timestamps must come back from a binary
+snapshot exactly as they were recorded
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from attempt_store import CompactAttempts
+
+TIMESTAMPS = [
+    "2026-10-15T06:00:01+02:00",
+    "2026-10-15T06:00:01",
+    "2026-10-15T06:00:01.250000-05:30",
+    "2026-10-15T04:00:01+00:00",
+]
+
+
+class CompactAttemptsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "login_attempts.bin")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_snapshot_keeps_timestamps_and_offsets(self):
+        attempts = CompactAttempts()
+        for number, timestamp in enumerate(TIMESTAMPS, 1):
+            attempts.append("192.0.2.1", {"timestamp": timestamp, "username": "root",
+                                          "status": "failed", "attempt_number": number})
+        attempts.append_many([("192.0.2.2", timestamp, "admin", "failed", number)
+                              for number, timestamp in enumerate(TIMESTAMPS, 1)])
+        attempts.save(self.path)
+
+        loaded = CompactAttempts.load(self.path)
+        loaded.compact()
+        for ip_address in ("192.0.2.1", "192.0.2.2"):
+            self.assertEqual([a["timestamp"] for a in loaded[ip_address]], TIMESTAMPS)
+
+
+if __name__ == "__main__":
+    unittest.main()
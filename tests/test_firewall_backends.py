@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Firewall backend tests against stub nft, ipset and netsh binaries that keep
+their sets (or rules) in a JSON file. Like nft, the nft stub rejects
+overlapping interval elements and deletes of absent ones (failing the whole
+transaction); like netsh, the netsh stub fails to set or delete a rule that
+does not exist. All of them append every transaction they run to a log
+"""
+
+import ipaddress
+import json
+import logging
+import os
+import sys
+import tempfile
+import textwrap
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from firewall_backends import IpsetFirewall, NetshBatchFirewall, NftablesFirewall
+
+STUB_NFT = textwrap.dedent('''\
+    #!{python}
+    import ipaddress, json, re, sys
+    state_file = {state!r}
+    try:
+        with open(state_file) as f:
+            sets = json.load(f)
+    except FileNotFoundError:
+        sets = {{}}
+    if sys.argv[1:3] == ["-t", "list"]:
+        sys.exit(0 if sys.argv[-1] in sets else 1)
+    if sys.argv[1] == "list":
+        sys.exit(0 if sets else 1)
+    text = sys.stdin.read()
+    with open({log!r}, "a") as f:
+        f.write(text + "---\\n")
+    for line in text.splitlines():
+        match = re.match(r"(add|delete) element inet \\S+ (\\S+) {{ (.*) }}", line)
+        if match is None:
+            match = re.match(r"flush set inet \\S+ (\\S+)", line)
+            if match:
+                sets[match.group(1)] = []
+            continue
+        verb, name, elements = match.groups()
+        current = sets.setdefault(name, [])
+        for element in elements.split(", "):
+            network = ipaddress.ip_network(element)
+            if verb == "delete":
+                if str(network) not in current:
+                    sys.exit("Error: Could not process rule: No such file or directory")
+                current.remove(str(network))
+            elif str(network) not in current:
+                if any(network.overlaps(ipaddress.ip_network(e)) for e in current):
+                    sys.exit(f"Error: interval overlaps with an existing one: {{element}}")
+                current.append(str(network))
+    with open(state_file, "w") as f:
+        json.dump(sets, f)
+''')
+
+
+STUB_IPSET = textwrap.dedent('''\
+    #!{python}
+    import ipaddress, json, sys
+    state_file = {state!r}
+    try:
+        with open(state_file) as f:
+            sets = json.load(f)
+    except FileNotFoundError:
+        sets = {{}}
+    if sys.argv[1:3] == ["-t", "list"]:
+        sys.exit(0 if sys.argv[-1] in sets else 1)
+    text = sys.stdin.read()
+    with open({log!r}, "a") as f:
+        f.write(text + "---\\n")
+    for line in text.splitlines():
+        verb, name, *rest = line.split()
+        element = str(ipaddress.ip_network(rest[0])) if verb in ("add", "del") else None
+        if verb == "create":
+            sets.setdefault(name, [])
+        elif verb == "flush":
+            sets[name] = []
+        elif verb == "add" and element not in sets[name]:
+            sets[name].append(element)
+        elif verb == "del":
+            sets[name].remove(element)
+    with open(state_file, "w") as f:
+        json.dump(sets, f)
+''')
+
+
+STUB_NETSH = textwrap.dedent('''\
+    #!{python}
+    import json, sys
+    state_file = {state!r}
+    try:
+        with open(state_file) as f:
+            rules = json.load(f)
+    except FileNotFoundError:
+        rules = {{}}
+    args = sys.argv[1:]
+    with open({log!r}, "a") as f:
+        f.write(" ".join(args) + "\\n---\\n")
+    verb = args[2]
+    options = dict(arg.split("=", 1) for arg in args[4:] if "=" in arg)
+    name = options["name"]
+    if verb == "add":
+        rules[name] = options["remoteip"].split(",")
+    elif name not in rules:
+        sys.exit("No rules match the specified criteria.")
+    elif verb == "set":
+        rules[name] = options["remoteip"].split(",")
+    else:
+        del rules[name]
+    with open(state_file, "w") as f:
+        json.dump(rules, f)
+''')
+
+
+class StubFirewallTest(unittest.TestCase):
+    stub = None
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.state = os.path.join(self.tmp.name, "sets.json")
+        self.log = os.path.join(self.tmp.name, "transactions.log")
+        self.kernel_state = os.path.join(self.tmp.name, "kernel_state.json")
+        self.binary = os.path.join(self.tmp.name, "stub")
+        with open(self.binary, "w") as f:
+            f.write(self.stub.format(python=sys.executable, state=self.state, log=self.log))
+        os.chmod(self.binary, 0o755)
+        self.logger = logging.getLogger("test_firewall_backends")
+        self.logger.addHandler(logging.NullHandler())
+        self.logger.propagate = False
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def elements(self):
+        with open(self.state) as f:
+            sets = json.load(f)
+        return {name: sorted(elements, key=ipaddress.ip_network)
+                for name, elements in sets.items()}
+
+    def transactions(self):
+        with open(self.log) as f:
+            return f.read().split("---\n")[:-1]
+
+
+class NftablesFirewallTest(StubFirewallTest):
+    stub = STUB_NFT
+
+    def firewall(self, blocked=(), state_file=None):
+        firewall = NftablesFirewall(self.logger, nft_path=self.binary, batch_window_seconds=0,
+                                    state_file=state_file)
+        firewall.restore(blocked)
+        return firewall
+
+    def test_first_transaction_loads_existing_blocks(self):
+        self.firewall(["10.0.0.0/8", "198.51.100.2"]).flush(force=True)
+        # A new process after a reboot: the kernel set starts empty
+        os.remove(self.state)
+        firewall = self.firewall(["10.0.0.0/8", "198.51.100.2", "2001:db8::1"])
+        self.assertTrue(firewall.block(["203.0.113.7"]))
+        self.assertEqual(self.elements(), {
+            "iptrack_blocked_v4": ["10.0.0.0/8", "198.51.100.2/32", "203.0.113.7/32"],
+            "iptrack_blocked_v6": ["2001:db8::1/128"],
+        })
+
+    def test_nested_entries_never_overlap(self):
+        firewall = self.firewall(["10.0.0.0/8"])
+        self.assertTrue(firewall.flush(force=True))
+        # A host inside an enforced range, then a range around enforced hosts
+        self.assertTrue(firewall.block(["10.1.2.3", "192.0.2.1", "192.0.2.2"]))
+        self.assertTrue(firewall.block(["192.0.2.0/24"]))
+        self.assertEqual(self.elements()["iptrack_blocked_v4"], ["10.0.0.0/8", "192.0.2.0/24"])
+
+        # Removing the range re-exposes the hosts it hid
+        self.assertTrue(firewall.unblock(["10.0.0.0/8", "192.0.2.0/24"]))
+        self.assertEqual(self.elements()["iptrack_blocked_v4"],
+                         ["10.1.2.3/32", "192.0.2.1/32", "192.0.2.2/32"])
+
+        # A covered host leaves without touching the kernel set
+        self.assertTrue(firewall.block(["10.0.0.0/8"]))
+        self.assertTrue(firewall.unblock(["10.1.2.3"]))
+        self.assertEqual(self.elements()["iptrack_blocked_v4"],
+                         ["10.0.0.0/8", "192.0.2.1/32", "192.0.2.2/32"])
+
+    def test_later_process_reuses_matching_sets(self):
+        blocked = ["10.0.0.0/8", "10.1.2.3", "198.51.100.2", "2001:db8::1"]
+        self.assertTrue(self.firewall(blocked, self.kernel_state).flush(force=True))
+        self.assertEqual(len(self.transactions()), 1)
+
+        # A one-shot command with the same blocklist sends only its change
+        firewall = self.firewall(blocked, self.kernel_state)
+        self.assertTrue(firewall.block(["203.0.113.7"]))
+        change = self.transactions()[-1]
+        self.assertNotIn("flush set", change)
+        self.assertEqual(change.strip(),
+                         "add element inet iptrack iptrack_blocked_v4 { 203.0.113.7 }")
+
+        # The next one sees the recorded change and still skips the reload
+        firewall = self.firewall(blocked + ["203.0.113.7"], self.kernel_state)
+        self.assertTrue(firewall.unblock(["198.51.100.2"]))
+        self.assertNotIn("flush set", self.transactions()[-1])
+        self.assertEqual(self.elements()["iptrack_blocked_v4"],
+                         ["10.0.0.0/8", "203.0.113.7/32"])
+
+    def test_mismatched_or_missing_sets_are_reloaded(self):
+        self.assertTrue(self.firewall(["192.0.2.1"], self.kernel_state).flush(force=True))
+
+        # Blocks recorded while the sets were not updated
+        firewall = self.firewall(["192.0.2.1", "192.0.2.9"], self.kernel_state)
+        self.assertTrue(firewall.block(["203.0.113.7"]))
+        self.assertIn("flush set", self.transactions()[-1])
+
+        # Sets gone (e.g. flushed by hand) despite a matching fingerprint
+        os.remove(self.state)
+        firewall = self.firewall(["192.0.2.1", "192.0.2.9", "203.0.113.7"], self.kernel_state)
+        self.assertTrue(firewall.block(["203.0.113.8"]))
+        self.assertIn("flush set", self.transactions()[-1])
+        self.assertEqual(self.elements()["iptrack_blocked_v4"],
+                         ["192.0.2.1/32", "192.0.2.9/32", "203.0.113.7/32", "203.0.113.8/32"])
+
+
+class IpsetFirewallTest(StubFirewallTest):
+    stub = STUB_IPSET
+
+    def firewall(self, blocked=(), state_file=None):
+        # true stands in for iptables: the match rules always exist
+        firewall = IpsetFirewall(self.logger, ipset_path=self.binary, iptables_path="true",
+                                 ip6tables_path="true", batch_window_seconds=0,
+                                 state_file=state_file)
+        firewall.restore(blocked)
+        return firewall
+
+    def test_first_transaction_loads_outermost_entries(self):
+        firewall = self.firewall(["10.0.0.0/8", "10.1.2.3", "2001:db8::1"])
+        self.assertTrue(firewall.block(["192.0.2.1"]))
+        self.assertEqual(self.elements(), {
+            "iptrack_blocked_v4": ["10.0.0.0/8", "192.0.2.1/32"],
+            "iptrack_blocked_v6": ["2001:db8::1/128"],
+        })
+        load = self.transactions()[0].splitlines()
+        self.assertIn("flush iptrack_blocked_v4", load)
+        self.assertNotIn("add iptrack_blocked_v4 10.1.2.3", load)
+
+    def test_changes_keep_entries_disjoint(self):
+        firewall = self.firewall(["192.0.2.1", "192.0.2.2"])
+        self.assertTrue(firewall.flush(force=True))
+        self.assertTrue(firewall.block(["192.0.2.0/24"]))
+        self.assertEqual(self.transactions()[-1].splitlines(), [
+            "del iptrack_blocked_v4 192.0.2.1",
+            "del iptrack_blocked_v4 192.0.2.2",
+            "add iptrack_blocked_v4 192.0.2.0/24",
+        ])
+        self.assertTrue(firewall.unblock(["192.0.2.0/24"]))
+        self.assertEqual(self.elements()["iptrack_blocked_v4"], ["192.0.2.1/32", "192.0.2.2/32"])
+
+    def test_later_process_reuses_matching_sets(self):
+        self.assertTrue(self.firewall(["192.0.2.1"], self.kernel_state).flush(force=True))
+        firewall = self.firewall(["192.0.2.1"], self.kernel_state)
+        self.assertTrue(firewall.block(["203.0.113.7"]))
+        self.assertEqual(self.transactions()[-1].splitlines(),
+                         ["add iptrack_blocked_v4 203.0.113.7"])
+        self.assertEqual(self.elements()["iptrack_blocked_v4"],
+                         ["192.0.2.1/32", "203.0.113.7/32"])
+
+
+class NetshBatchFirewallTest(StubFirewallTest):
+    stub = STUB_NETSH
+
+    def firewall(self, blocked=(), recorded=()):
+        firewall = NetshBatchFirewall(self.tmp.name, self.logger, netsh_path=self.binary,
+                                      batch_window_seconds=0, ips_per_rule=2)
+        firewall.restore(blocked, recorded)
+        return firewall
+
+    def rules(self):
+        with open(self.state) as f:
+            return json.load(f)
+
+    def commands(self):
+        return [transaction.strip() for transaction in self.transactions()]
+
+    def test_rule_command_lines(self):
+        firewall = self.firewall()
+        self.assertTrue(firewall.block(["192.0.2.1", "192.0.2.2", "192.0.2.3"]))
+        self.assertTrue(firewall.block(["192.0.2.4"]))
+        self.assertTrue(firewall.unblock(["192.0.2.1"]))
+        self.assertEqual(self.commands(), [
+            "advfirewall firewall add rule name=IPTrack_Batch_1 dir=in action=block "
+            "remoteip=192.0.2.1,192.0.2.2 enable=yes",
+            "advfirewall firewall add rule name=IPTrack_Batch_2 dir=in action=block "
+            "remoteip=192.0.2.3 enable=yes",
+            "advfirewall firewall set rule name=IPTrack_Batch_2 new "
+            "remoteip=192.0.2.3,192.0.2.4",
+            "advfirewall firewall set rule name=IPTrack_Batch_1 new remoteip=192.0.2.2",
+        ])
+        self.assertEqual(self.rules(), {
+            "IPTrack_Batch_1": ["192.0.2.2"],
+            "IPTrack_Batch_2": ["192.0.2.3", "192.0.2.4"],
+        })
+
+    def test_migration_waits_for_first_write(self):
+        with open(self.state, "w") as f:
+            json.dump({"IPTrack_Block_192_0_2_1": ["192.0.2.1"]}, f)
+
+        # Read-only use (e.g. status) leaves the per-IP rules alone
+        self.firewall(["192.0.2.1"], recorded=["192.0.2.1"]).flush()
+        self.assertFalse(os.path.exists(self.log))
+
+        firewall = self.firewall(["192.0.2.1"], recorded=["192.0.2.1"])
+        self.assertTrue(firewall.block(["192.0.2.9"]))
+        self.assertEqual(self.rules(), {"IPTrack_Batch_1": ["192.0.2.1", "192.0.2.9"]})
+        self.assertEqual(self.commands()[-1],
+                         "advfirewall firewall delete rule name=IPTrack_Block_192_0_2_1")
+
+        # Later processes find the saved layout and migrate nothing
+        self.assertTrue(self.firewall(["192.0.2.1", "192.0.2.9"]).is_blocked("192.0.2.9"))
+
+    def test_failed_call_keeps_saved_layout(self):
+        firewall = self.firewall()
+        self.assertTrue(firewall.block(["192.0.2.1"]))
+        # The rule disappears behind our back, so updating it fails
+        os.remove(self.state)
+        firewall.pending_add.add("192.0.2.2")
+        self.assertFalse(firewall.flush())
+        self.assertFalse(firewall.is_blocked("192.0.2.2"))
+
+        later = self.firewall()
+        self.assertEqual(later.rules, {"IPTrack_Batch_1": ["192.0.2.1"]})
+        self.assertFalse(later.is_blocked("192.0.2.2"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Threat Feed Importer
+Loads FireHOL / Spamhaus DROP style blocklists from local files, normalizes
+and de-duplicates their CIDRs, and applies only what changed since the
+previous import, tagging each block with the feed it came from
+"""
+
+import ipaddress
+import json
+from datetime import datetime
+from pathlib import Path
+from block_aggregator import prefix_string
+from ip_networks import parse_network
+
+
+def read_feed(path):
+    """Yield raw entries from a feed file
+
+    Handles plain lists and FireHOL netsets (# comments), Spamhaus DROP
+    ("1.2.3.0/24 ; SBL123") and Spamhaus NDJSON ({"cidr": ...}) lines.
+    """
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("{"):
+                try:
+                    entry = json.loads(line).get("cidr")
+                except ValueError:
+                    entry = None
+                if entry:
+                    yield entry
+                continue
+            line = line.split("#", 1)[0].split(";", 1)[0].strip()
+            if line:
+                yield line.split()[0]
+
+
+def normalize_entries(entries):
+    """(sorted minimal prefix strings, invalid entries) for raw feed entries
+
+    Host bits are masked, duplicates dropped and overlapping or adjacent
+    ranges collapsed, so the same feed always yields the same generation.
+    """
+    networks = {4: [], 6: []}
+    invalid = []
+    for entry in entries:
+        try:
+            network = parse_network(entry)
+        except ValueError:
+            invalid.append(entry)
+            continue
+        networks[network.version].append(network)
+
+    prefixes = []
+    for version in (4, 6):
+        prefixes.extend(prefix_string(n) for n in ipaddress.collapse_addresses(networks[version]))
+    return prefixes, invalid
+
+
+class ThreatFeedImporter:
+    def __init__(self, monitor, sources=None, state_file=None):
+        self.monitor = monitor
+        self.logger = monitor.logger
+        feeds = monitor.config.get('feeds', {})
+        self.sources = {source['name']: source
+                        for source in (sources or feeds.get('sources', []))}
+        self.duration_minutes = feeds.get('duration_minutes', 0)
+        self.state_file = Path(state_file or monitor.log_dir / "feed_state.json")
+        self.state = self.load_state()
+
+    def load_state(self):
+        """Previously imported generation of each feed"""
+        if self.state_file.exists():
+            try:
+                with open(self.state_file, 'r') as f:
+                    return json.load(f)
+            except Exception as e:
+                self.logger.error(f"Error loading feed state: {e}")
+        return {}
+
+    def save_state(self):
+        try:
+            with open(self.state_file, 'w') as f:
+                json.dump(self.state, f, indent=2)
+        except Exception as e:
+            self.logger.error(f"Error saving feed state: {e}")
+
+    def sync(self, names=None):
+        """Import the named feeds (default all) in one batch; returns a summary per feed
+
+        Feeds whose file is missing or unreadable are left untouched rather
+        than treated as empty, so a failed download never unblocks a feed.
+        """
+        names = list(names or self.sources)
+        summary = {}
+        with self.monitor.batch():
+            for name in names:
+                source = self.sources.get(name)
+                if source is None:
+                    raise ValueError(f"Unknown feed: {name}")
+                try:
+                    prefixes, invalid = normalize_entries(read_feed(source['path']))
+                except OSError as e:
+                    self.logger.error(f"Error reading feed {name}: {e}")
+                    summary[name] = {"error": str(e)}
+                    continue
+                summary[name] = self.apply(name, source, prefixes)
+                summary[name]["invalid"] = len(invalid)
+                if invalid:
+                    self.logger.warning(f"Feed {name}: skipped {len(invalid)} invalid entries")
+        self.save_state()
+        return summary
+
+    def apply(self, name, source, prefixes):
+        """Block what the feed added and unblock what it dropped"""
+        blocked_ips = self.monitor.blocked_ips
+        previous = set(self.state.get(name, {}).get("entries", []))
+        current = set(prefixes)
+
+        # Entries that expired or were unblocked by hand are re-applied if still listed
+        additions = [p for p in prefixes if p not in previous or p not in blocked_ips]
+        removals = [p for p in sorted(previous - current)
+                    if (blocked_ips.get(p) or {}).get("feed") == name]
+
+        self.monitor.unblock_ips(removals)
+        blocked = self.monitor.block_ips(
+            additions, reason=f"Threat feed: {name}",
+            duration_minutes=source.get('duration_minutes', self.duration_minutes),
+            feed=name
+        )
+
+        self.state[name] = {
+            "path": str(source['path']),
+            "synced_at": datetime.now().isoformat(),
+            "entries": prefixes,
+        }
+        self.logger.info(
+            f"Feed {name}: {len(prefixes)} entries, +{len(blocked)} -{len(removals)}"
+        )
+        return {"entries": len(prefixes), "added": len(blocked),
+                "removed": len(removals), "skipped": len(additions) - len(blocked)}
+
+    def remove(self, name):
+        """Unblock everything a feed imported and forget its generation"""
+        tagged = [ip for ip, info in self.monitor.blocked_ips.items()
+                  if info.get("feed") == name]
+        removed = self.monitor.unblock_ips(tagged)
+        if self.state.pop(name, None) is not None:
+            self.save_state()
+        return removed
+
+    def status(self):
+        """name -> {path, entries, blocked, synced_at} for configured and imported feeds"""
+        blocked = {}
+        for info in self.monitor.blocked_ips.values():
+            feed = info.get("feed")
+            if feed:
+                blocked[feed] = blocked.get(feed, 0) + 1
+
+        status = {}
+        for name in list(self.sources) + [n for n in self.state if n not in self.sources]:
+            state = self.state.get(name, {})
+            status[name] = {
+                "path": str(self.sources.get(name, state).get('path', '')),
+                "entries": len(state.get("entries", [])),
+                "blocked": blocked.get(name, 0),
+                "synced_at": state.get("synced_at"),
+            }
+        return status